@@ -0,0 +1,132 @@
+"""
+Connected components backends of sam2.utils.misc: OpenCV over the batch, the
+vectorized union-find in torch (used without OpenCV) and the sam2._C CUDA kernel
+when it is built, against a breadth first search reference.
+
+Checks that every backend finds the same components and areas as the reference
+(exits with 1 otherwise), then times each one and the hole and sprinkle filling
+of SAM2Transforms.postprocess_masks, which skipped the filling on CPU before.
+
+Usage: python bench_connected_components.py [--masks 3] [--size 256] [--repeat 10]
+"""
+import argparse
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from sam2.utils import misc
+from sam2.utils.transforms import SAM2Transforms
+
+
+def reference_components(mask):
+    """
+    (labels, areas) of a HxW bool array by breadth first search, 8-connectivity.
+    """
+    h, w = mask.shape
+    labels = np.zeros((h, w), dtype=np.int64)
+    areas = np.zeros((h, w), dtype=np.int64)
+    label = 0
+
+    for y, x in zip(*np.nonzero(mask)):
+        if labels[y, x]:
+            continue
+
+        label += 1
+        labels[y, x] = label
+        component = [ ]
+        queue = deque([(y, x)])
+        while queue:
+            cy, cx = queue.popleft()
+            component.append((cy, cx))
+            for ny in range(max(cy - 1, 0), min(cy + 2, h)):
+                for nx in range(max(cx - 1, 0), min(cx + 2, w)):
+                    if mask[ny, nx] and not labels[ny, nx]:
+                        labels[ny, nx] = label
+                        queue.append((ny, nx))
+
+        for cy, cx in component:
+            areas[cy, cx] = len(component)
+
+    return labels, areas
+
+
+def same_components(labels, areas, reference_labels, reference_areas):
+    """
+    Same areas and the same partition of the foreground, whatever the label numbering.
+    """
+    if not np.array_equal(areas, reference_areas) or not np.array_equal(labels > 0, reference_labels > 0):
+        return False
+
+    pairs = np.unique(np.stack([labels.ravel(), reference_labels.ravel()]), axis=1)
+    return len(pairs[0]) == len(np.unique(labels)) == len(np.unique(reference_labels))
+
+
+def random_masks(n, size, generator):
+    """
+    Blobs with holes and specks, plus the empty, full and checkerboard edge cases.
+    """
+    blobs = F.avg_pool2d(torch.rand(n, 1, size, size, generator=generator), 7, 1, 3) > 0.5
+    specks = torch.rand(n, 1, size, size, generator=generator) > 0.97
+    masks = blobs ^ specks
+
+    checkerboard = (torch.arange(size)[:, None] + torch.arange(size)[None]) % 2 == 0
+    edge_cases = torch.stack([torch.zeros(size, size, dtype=torch.bool), torch.ones(size, size, dtype=torch.bool),
+                              checkerboard])[:, None]
+
+    return torch.cat([masks, edge_cases])
+
+
+def timed(function, repeat):
+    function()
+    timings = [ ]
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--masks', type=int, default=3, help='Masks per batch, 3 for a multimask prediction')
+    parser.add_argument('--size', type=int, default=256, help='Low resolution mask size')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(0)
+    backends = {
+        'cpu': misc.get_connected_components_cpu,
+        'torch union-find': misc._connected_components_torch,
+    }
+    if torch.cuda.is_available() and misc._load_cuda_extension() is not None:
+        backends['cuda'] = lambda mask: [t.cpu() for t in misc.get_connected_components(mask.cuda())]
+
+    # Parity on small masks, the reference is slow
+    parity_masks = random_masks(8, 48, generator)
+    references = [reference_components(mask[0].numpy()) for mask in parity_masks]
+
+    failed = False
+    for name, backend in backends.items():
+        labels, areas = backend(parity_masks)
+        ok = all(same_components(labels[i, 0].numpy(), areas[i, 0].numpy(), *references[i])
+                 for i in range(len(parity_masks)))
+        failed |= not ok
+        print(f'{name:>16}: {"matches the reference" if ok else "MISMATCH"}')
+
+    masks = random_masks(args.masks, args.size, generator)[:args.masks]
+    print(f'\n{args.masks} x {args.size}x{args.size} masks')
+    for name, backend in backends.items():
+        print(f'{name:>16}: {timed(lambda: backend(masks), args.repeat):8.2f} ms')
+
+    logits = torch.randn(1, args.masks, args.size, args.size, generator=generator) * 4
+    for max_area in (0, 8):
+        transforms = SAM2Transforms(1024, 0.0, max_hole_area=max_area, max_sprinkle_area=max_area)
+        ms = timed(lambda: transforms.postprocess_low_res_masks(logits), args.repeat)
+        print(f'postprocess_low_res_masks, max areas {max_area}: {ms:8.2f} ms')
+
+    sys.exit(1 if failed else 0)
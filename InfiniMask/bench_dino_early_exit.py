@@ -0,0 +1,78 @@
+"""
+Latency and box AP drift of early exit decoding in Grounding DINO
+(GroundingDINO.set_early_exit) over a local folder of images.
+
+Compared against the cached full profile reference boxes of bench_dino_profiles.py.
+
+Usage: python bench_dino_early_exit.py FOLDER --prompt "face . hand" [--layers 2,3,4,5] [--converge 0.001,0.005]
+"""
+import argparse
+import json
+import os
+
+from bench_dino_profiles import (
+    REFERENCE_MAX_SIZE,
+    REFERENCE_SIZE,
+    box_ap,
+    list_images,
+    load_reference,
+    parse_list,
+    run_profile,
+)
+from local_groundingdino.util.inference import load_model
+
+
+if __name__ == '__main__':
+    conf = { }
+    if os.path.isfile('config.json'):
+        with open('config.json') as f:
+            conf = json.load(f)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', help='Folder of validation images')
+    parser.add_argument('--prompt', default=conf.get('dino_default_prompt', ''))
+    parser.add_argument('--config', default=conf.get('dino_config', ''))
+    parser.add_argument('--checkpoint', default=conf.get('dino_model', ''))
+    parser.add_argument('--device', default=conf.get('mask_gen_device', 'cuda'))
+    parser.add_argument('--size', type=int, default=REFERENCE_SIZE, help='Short side resolution')
+    parser.add_argument('--max-size', type=int, default=REFERENCE_MAX_SIZE)
+    parser.add_argument('--layers', default='2,3,4,5', help='Decoder layer limits to try')
+    parser.add_argument('--converge', default='0.001,0.002,0.005', help='Box convergence thresholds to try')
+    parser.add_argument('--box-threshold', type=float, default=0.3)
+    parser.add_argument('--text-threshold', type=float, default=0.25)
+    parser.add_argument('--cache', default='', help='Reference box cache, defaults to FOLDER/dino_reference_boxes.json')
+    parser.add_argument('--limit', type=int, default=0, help='Only use the first N images')
+    args = parser.parse_args()
+
+    if not args.prompt:
+        parser.error('a --prompt is required (or dino_default_prompt in config.json)')
+
+    names = list_images(args.folder, args.limit)
+    if not names:
+        parser.error(f'no images in {args.folder}')
+
+    model = load_model(args.config, args.checkpoint, args.device)
+    cache_path = args.cache or os.path.join(args.folder, 'dino_reference_boxes.json')
+    references = load_reference(model, args.folder, names, args.prompt, args.box_threshold,
+                                args.text_threshold, args.device, cache_path)
+
+    num_layers = model.transformer.num_decoder_layers
+    variants = [('all layers', None, None)]
+    variants += [(f'{layers} layers', layers, None) for layers in parse_list(args.layers) if layers < num_layers]
+    variants += [(f'converge {threshold:g}', None, threshold)
+                 for threshold in (float(value) for value in args.converge.split(',') if value.strip())]
+
+    print(f'{len(names)} images at {args.size} / {args.max_size}, {num_layers} decoder layers')
+    print(f'{"variant":>16} {"ms/img":>9} {"speedup":>8} {"AP50":>7} {"recall":>7}')
+    full_seconds = None
+
+    for label, max_layers, threshold in variants:
+        model.set_early_exit(max_layers, threshold)
+        predictions, seconds = run_profile(model, args.folder, names, args.prompt, args.size, args.max_size,
+                                           args.box_threshold, args.text_threshold, args.device)
+        ap, recall = box_ap(predictions, references)
+        full_seconds = full_seconds or seconds
+
+        print(f'{label:>16} {seconds * 1000:>9.1f} {full_seconds / seconds:>7.2f}x {ap:>7.3f} {recall:>7.3f}')
+
+    model.set_early_exit()
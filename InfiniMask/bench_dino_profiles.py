@@ -0,0 +1,205 @@
+"""
+Accuracy vs latency of Grounding DINO inference profiles (short side resolution
+and query budget) over a local folder of images.
+
+Reference boxes come from the full profile (800 / 1333, all queries) and are
+cached next to the images, so later runs only time the candidate profiles.
+Accuracy is the AP50 and recall of each profile against the reference boxes.
+
+Usage: python bench_dino_profiles.py FOLDER --prompt "face . hand" [--sizes 512,640,800] [--queries 100,300,0]
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+from PIL import Image
+from torchvision.ops import box_convert, box_iou
+
+from local_groundingdino.util.inference import load_image_pil, load_model, predict
+
+REFERENCE_SIZE = 800
+REFERENCE_MAX_SIZE = 1333
+IMAGE_TYPES = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def list_images(folder, limit=0):
+    names = sorted(name for name in os.listdir(folder) if name.lower().endswith(IMAGE_TYPES))
+
+    return names[:limit] if limit > 0 else names
+
+
+def run_profile(model, folder, names, prompt, size, max_size, box_threshold, text_threshold, device):
+    """
+    Returns ({name: (boxes, scores)}, seconds per image) for one inference profile.
+    """
+    results = { }
+    timings = [ ]
+
+    for name in names:
+        image_pil = Image.open(os.path.join(folder, name))
+        image_pil.load() # Keep file decoding out of the timing
+
+        if device.startswith('cuda'):
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+
+        _, image_tensor = load_image_pil(image_pil, size, max_size)
+        boxes, scores, _ = predict(model, image_tensor, prompt, box_threshold, text_threshold, device)
+
+        if device.startswith('cuda'):
+            torch.cuda.synchronize()
+        timings.append(time.perf_counter() - start)
+
+        results[name] = (boxes, scores)
+
+    # The first image includes warm up (cudnn autotune, allocator), leave it out when possible
+    timings = timings[1:] if len(timings) > 1 else timings
+
+    return results, sum(timings) / len(timings)
+
+
+def load_reference(model, folder, names, prompt, box_threshold, text_threshold, device, cache_path):
+    """
+    Reference boxes of the full profile, cached per image (keyed by name, size and mtime).
+    """
+    settings = {'prompt': prompt, 'box_threshold': box_threshold, 'text_threshold': text_threshold,
+                'size': REFERENCE_SIZE, 'max_size': REFERENCE_MAX_SIZE}
+    cache = { }
+
+    if os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    if cache.get('settings') != settings:
+        cache = {'settings': settings, 'images': { }}
+
+    def cache_key(name):
+        stat = os.stat(os.path.join(folder, name))
+        return f'{name}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    missing = [name for name in names if cache_key(name) not in cache['images']]
+
+    if missing:
+        print(f'Computing reference boxes for {len(missing)} images...')
+        model.set_query_budget(None)
+        results, _ = run_profile(model, folder, missing, prompt, REFERENCE_SIZE, REFERENCE_MAX_SIZE,
+                                 box_threshold, text_threshold, device)
+
+        for name, (boxes, scores) in results.items():
+            cache['images'][cache_key(name)] = {'boxes': boxes.tolist(), 'scores': scores.tolist()}
+
+        with open(cache_path, 'w') as f:
+            json.dump(cache, f)
+
+    return {
+        name: torch.tensor(cache['images'][cache_key(name)]['boxes']).view(-1, 4)
+        for name in names
+    }
+
+
+def box_ap(predictions, references, iou_threshold=0.5):
+    """
+    AP and recall of predictions {name: (cxcywh boxes, scores)} against reference boxes {name: cxcywh boxes}.
+    """
+    matches = [ ] # (score, is true positive)
+    num_reference = 0
+
+    for name, reference in references.items():
+        boxes, scores = predictions[name]
+        num_reference += len(reference)
+
+        if len(boxes) == 0:
+            continue
+        if len(reference) == 0:
+            matches += [(score, False) for score in scores.tolist()]
+            continue
+
+        order = scores.argsort(descending=True)
+        ious = box_iou(box_convert(boxes[order], 'cxcywh', 'xyxy'), box_convert(reference, 'cxcywh', 'xyxy'))
+        taken = torch.zeros(len(reference), dtype=torch.bool)
+
+        # Greedy matching in score order, each reference box is matched at most once
+        for row, score in zip(ious, scores[order].tolist()):
+            row = row.masked_fill(taken, -1)
+            best = int(row.argmax())
+            hit = bool(row[best] >= iou_threshold)
+
+            if hit:
+                taken[best] = True
+            matches.append((score, hit))
+
+    if num_reference == 0:
+        return float('nan'), float('nan')
+
+    matches.sort(key=lambda match: -match[0])
+    hits = torch.tensor([hit for _, hit in matches], dtype=torch.float64)
+
+    if len(hits) == 0:
+        return 0.0, 0.0
+
+    true_positives = hits.cumsum(0)
+    recall = true_positives / num_reference
+    precision = true_positives / torch.arange(1, len(hits) + 1, dtype=torch.float64)
+
+    # All point interpolation, precision made monotonically decreasing
+    precision = precision.flip(0).cummax(0)[0].flip(0)
+    recall_steps = torch.cat((recall.new_zeros(1), recall)).diff()
+
+    return float((precision * recall_steps).sum()), float(recall[-1])
+
+
+def parse_list(text):
+    return [int(value) for value in text.split(',') if value.strip()]
+
+
+if __name__ == '__main__':
+    conf = { }
+    if os.path.isfile('config.json'):
+        with open('config.json') as f:
+            conf = json.load(f)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', help='Folder of validation images')
+    parser.add_argument('--prompt', default=conf.get('dino_default_prompt', ''))
+    parser.add_argument('--config', default=conf.get('dino_config', ''))
+    parser.add_argument('--checkpoint', default=conf.get('dino_model', ''))
+    parser.add_argument('--device', default=conf.get('mask_gen_device', 'cuda'))
+    parser.add_argument('--sizes', default='512,640,800', help='Short side resolutions')
+    parser.add_argument('--max-ratio', type=float, default=REFERENCE_MAX_SIZE / REFERENCE_SIZE,
+                        help='Longer side limit as a multiple of the short side')
+    parser.add_argument('--queries', default='100,300,0', help='Query budgets, 0 decodes all queries')
+    parser.add_argument('--box-threshold', type=float, default=0.3)
+    parser.add_argument('--text-threshold', type=float, default=0.25)
+    parser.add_argument('--cache', default='', help='Reference box cache, defaults to FOLDER/dino_reference_boxes.json')
+    parser.add_argument('--limit', type=int, default=0, help='Only use the first N images')
+    args = parser.parse_args()
+
+    if not args.prompt:
+        parser.error('a --prompt is required (or dino_default_prompt in config.json)')
+
+    names = list_images(args.folder, args.limit)
+    if not names:
+        parser.error(f'no images in {args.folder}')
+
+    model = load_model(args.config, args.checkpoint, args.device)
+    cache_path = args.cache or os.path.join(args.folder, 'dino_reference_boxes.json')
+    references = load_reference(model, args.folder, names, args.prompt, args.box_threshold,
+                                args.text_threshold, args.device, cache_path)
+
+    print(f'{len(names)} images, {sum(len(boxes) for boxes in references.values())} reference boxes')
+    print(f'{"size":>6} {"max":>6} {"queries":>8} {"ms/img":>9} {"AP50":>7} {"recall":>7}')
+
+    for size in parse_list(args.sizes):
+        max_size = round(size * args.max_ratio)
+
+        for num_queries in parse_list(args.queries):
+            model.set_query_budget(num_queries or None)
+            predictions, seconds = run_profile(model, args.folder, names, args.prompt, size, max_size,
+                                               args.box_threshold, args.text_threshold, args.device)
+            ap, recall = box_ap(predictions, references)
+
+            print(f'{size:>6} {max_size:>6} {num_queries or "all":>8} {seconds * 1000:>9.1f} {ap:>7.3f} {recall:>7.3f}')
+
+    model.set_query_budget(None)
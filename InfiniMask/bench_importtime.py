@@ -0,0 +1,132 @@
+"""
+Import time regression check for the modules the mask server loads at start up,
+each module is imported in a fresh interpreter with python -X importtime.
+
+Prints the cumulative import time of every module and its heaviest direct
+imports, and fails (exit code 1) when a module pulls in one of its FORBIDDEN
+dependencies eagerly. Those are only needed by optional features or once a
+model is built, and have to be imported where they are used.
+
+Timings are compared as ratios to the import time of torch measured in the same
+run, so a baseline holds on other hardware. --save FILE records the ratios,
+--baseline FILE compares against them and also fails when a module got slower
+than --tolerance (relative) plus 0.05 (5% of the torch import). The baseline
+defaults to importtime_baseline.json next to this script, which is tracked in
+the repo, refresh it with --save importtime_baseline.json after an intended
+change (--baseline '' skips the comparison).
+
+Usage: python bench_importtime.py [--repeat 3] [--top 8] [--save FILE] [--baseline FILE]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Module -> dependencies it must not import eagerly
+FORBIDDEN = {
+    'local_groundingdino.util.inference': ['transformers', 'supervision', 'cv2', 'timm'],
+    'sam2.build_sam': ['transformers', 'supervision', 'timm'],
+    'sam2.sam2_image_predictor': ['transformers', 'supervision', 'timm'],
+    'mask_prep': ['torch', 'transformers'],
+    'model_prep': ['transformers', 'torchvision'],
+    'checkpoint_cache': ['transformers', 'torchvision'],
+}
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'importtime_baseline.json')
+
+IMPORTER = '''
+import json, sys
+import {module}
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+def run_import(module):
+    """
+    Returns (total ms, {direct import: cumulative ms}, loaded module names) of importing module.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORTER.format(module=module)],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total = 0.0
+    children = { }
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        ms = int(cumulative) / 1000
+
+        # Top level entries are the module and its package parents (e.g. sam2 for sam2.build_sam)
+        if depth == 0:
+            total += ms
+        elif depth == 1:
+            children[name.strip()] = children.get(name.strip(), 0) + ms
+
+    return total, children, set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def is_loaded(dependency, loaded):
+    return dependency in loaded or any(name.startswith(dependency + '.') for name in loaded)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=8, help='Heaviest direct imports to show per module')
+    parser.add_argument('--save', help='Write the timings to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE, help='Compare the timings with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    baseline = { }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Reference for the ratios, the heaviest dependency every model module shares
+    torch_ms = min(run_import('torch')[0] for _ in range(args.repeat))
+    print(f'torch: {torch_ms:.0f} ms\n')
+
+    timings = { }
+    failures = [ ]
+
+    for module, forbidden in FORBIDDEN.items():
+        try:
+            runs = [run_import(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f'{module}: import failed: {e}\n')
+            failures.append(f'{module} does not import')
+            continue
+
+        # Fastest run, the others include disk cache warm up
+        total, children, loaded = min(runs, key=lambda run: run[0])
+        ratio = total / torch_ms
+        timings[module] = round(ratio, 3)
+
+        print(f'{module}: {total:.0f} ms ({ratio:.2f}x torch), {len(loaded)} modules')
+        for name, ms in sorted(children.items(), key=lambda item: -item[1])[:args.top]:
+            print(f'  {ms:8.1f} ms  {name}')
+
+        eager = [dependency for dependency in forbidden if is_loaded(dependency, loaded)]
+        if eager:
+            failures.append(f'{module} imports {", ".join(eager)} eagerly')
+
+        if module in baseline and ratio > baseline[module] * (1 + args.tolerance) + 0.05:
+            failures.append(f'{module} import got slower: {ratio:.2f}x torch, baseline {baseline[module]:.2f}x')
+
+        print()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(timings, f, indent=4)
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+
+    sys.exit(1 if failures else 0)
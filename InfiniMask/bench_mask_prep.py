@@ -0,0 +1,78 @@
+"""
+Microbenchmark of mask_prep.prepare_mask against the PIL chain used before
+(LANCZOS resize, MaxFilter(7), GaussianBlur(3)).
+
+Usage: python bench_mask_prep.py [--size 6000x4000] [--target 768] [--repeat 5]
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+import mask_prep
+
+
+def make_mask(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    mask_pil = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(mask_pil)
+
+    for _ in range(12):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        rx, ry = rng.integers(width // 40, width // 8), rng.integers(height // 40, height // 8)
+        draw.ellipse((x - rx, y - ry, x + rx, y + ry), fill=255)
+
+    return mask_pil.convert('RGB') # Masks saved by the editor are RGB
+
+
+def pil_chain(mask_pil, size):
+    mask_pil = mask_pil.resize(size, Image.Resampling.LANCZOS)
+    mask_pil = mask_pil.filter(ImageFilter.MaxFilter(7))
+    mask_pil = mask_pil.filter(ImageFilter.GaussianBlur(3))
+
+    return np.asarray(mask_pil.convert('L'))
+
+
+def time_it(func, repeat):
+    func() # Warm up
+    timings = [ ]
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default='6000x4000', help='Source mask size, WxH')
+    parser.add_argument('--target', type=int, default=768, help='Longer side of the prepared mask')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.lower().split('x'))
+    mask_pil = make_mask(width, height)
+
+    print(f'OpenCV: {"yes" if mask_prep.cv2 is not None else "no (numpy/PIL fallback)"}')
+
+    scale = args.target / max(width, height)
+    small_pil = mask_pil.resize((width // 4, height // 4), Image.Resampling.NEAREST)
+
+    cases = [
+        (mask_pil, (max(round(width * scale), 1), max(round(height * scale), 1))), # Whole image downscaled
+        (mask_pil, (width, height)),                                               # Native resolution
+        (small_pil, (width // 4 * 3, height // 4 * 3)),                            # Small crop upscaled
+    ]
+
+    for source_pil, size in cases:
+        pil_time, pil_result = time_it(lambda: pil_chain(source_pil, size), args.repeat)
+        new_time, new_result = time_it(lambda: mask_prep.prepare_mask(source_pil, size), args.repeat)
+
+        diff = np.abs(pil_result.astype(np.int16) - new_result.astype(np.int16))
+
+        print(f'{source_pil.size[0]}x{source_pil.size[1]} -> {size[0]}x{size[1]}: '
+              f'PIL {pil_time * 1000:.1f} ms, mask_prep {new_time * 1000:.1f} ms '
+              f'({pil_time / new_time:.1f}x), max diff {diff.max()}, mean diff {diff.mean():.2f}')
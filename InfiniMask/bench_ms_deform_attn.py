@@ -0,0 +1,99 @@
+"""
+Parity check and microbenchmark of the multi-scale deformable attention
+implementations used by Grounding DINO (see MS_DEFORM_ATTN_IMPLS) against the
+grid_sample reference.
+
+Exits with status 1 when an implementation does not match the reference.
+
+Usage: python bench_ms_deform_attn.py [--repeat 3] [--threads 0] [--device cpu]
+"""
+import argparse
+import sys
+import time
+
+import torch
+
+from local_groundingdino.models.GroundingDINO.ms_deform_attn import (
+    MS_DEFORM_ATTN_IMPLS,
+    multi_scale_deformable_attn_pytorch,
+)
+
+# Feature map sizes of a 800x1067 input (strides 8, 16, 32, 64)
+SPATIAL_SHAPES = [(100, 134), (50, 67), (25, 34), (13, 17)]
+NUM_HEADS = 8
+HEAD_DIMS = 32
+NUM_POINTS = 4
+
+
+def make_inputs(batch_size, num_queries, device, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    spatial_shapes = torch.tensor(SPATIAL_SHAPES, dtype=torch.long)
+    num_value = int(spatial_shapes.prod(1).sum())
+    num_levels = len(SPATIAL_SHAPES)
+
+    value = torch.randn(batch_size, num_value, NUM_HEADS, HEAD_DIMS, generator=generator)
+    # Slightly outside [0, 1] so the zero padding at the borders is exercised too
+    sampling_locations = torch.rand(batch_size, num_queries, NUM_HEADS, num_levels, NUM_POINTS, 2, generator=generator) * 1.2 - 0.1
+    attention_weights = torch.rand(batch_size, num_queries, NUM_HEADS, num_levels * NUM_POINTS, generator=generator).softmax(-1)
+    attention_weights = attention_weights.view(batch_size, num_queries, NUM_HEADS, num_levels, NUM_POINTS)
+
+    return [t.to(device) for t in (value, spatial_shapes, sampling_locations, attention_weights)]
+
+
+def time_it(func, repeat, device):
+    func() # Warm up
+    timings = [ ]
+
+    for _ in range(repeat):
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        result = func()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help='torch.set_num_threads, 0 keeps the default')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--atol', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    device = torch.device(args.device)
+    num_value = sum(h * w for h, w in SPATIAL_SHAPES)
+
+    cases = [
+        ('encoder', 1, num_value), # Self attention over all feature map positions
+        ('decoder', 2, 900),       # Cross attention of the 900 queries
+    ]
+
+    print(f'Device {device}, {torch.get_num_threads()} threads')
+    failed = False
+
+    with torch.inference_mode():
+        for case_name, batch_size, num_queries in cases:
+            inputs = make_inputs(batch_size, num_queries, device)
+            ref_time, ref_result = time_it(lambda: multi_scale_deformable_attn_pytorch(*inputs), args.repeat, device)
+            print(f'{case_name} (bs {batch_size}, {num_queries} queries): pytorch {ref_time * 1000:.1f} ms')
+
+            for name, func in MS_DEFORM_ATTN_IMPLS.items():
+                if func is multi_scale_deformable_attn_pytorch:
+                    continue
+
+                impl_time, result = time_it(lambda: func(*inputs), args.repeat, device)
+                error = (result - ref_result).abs().max().item()
+                ok = result.shape == ref_result.shape and error <= args.atol
+                failed |= not ok
+
+                print(f'  {name}: {impl_time * 1000:.1f} ms ({ref_time / impl_time:.2f}x), '
+                      f'max error {error:.2e} {"ok" if ok else "MISMATCH"}')
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,90 @@
+"""
+Positional encoding cache microbenchmark: SAM2 PromptEncoder.get_dense_pe, the
+SAM2 decoder hot path (predict with one point on a set image) and the Grounding
+DINO sine encoding of the backbone levels, each with the cache cleared before
+every call against the cached path.
+
+Exits with 1 if a cached encoding differs from a freshly computed one.
+
+Usage: python bench_pos_encoding.py [--config configs/sam2.1/sam2.1_hiera_t.yaml] [--repeat 20]
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import torch
+
+from local_groundingdino.models.GroundingDINO.backbone.position_encoding import PositionEmbeddingSineHW
+from local_groundingdino.util.misc import NestedTensor
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+# Backbone levels of an 800x1200 Grounding DINO input
+DINO_LEVEL_SIZES = [(100, 150), (50, 75), (25, 38), (13, 19)]
+
+
+def timed(function, repeat, device, clear=None):
+    function()
+    timings = [ ]
+
+    for _ in range(repeat):
+        if clear is not None:
+            clear()
+        start = time.perf_counter()
+        function()
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        timings.append(time.perf_counter() - start)
+
+    return sorted(timings)[len(timings) // 2] * 1000
+
+
+def report(name, function, clear, repeat, device):
+    uncached = timed(function, repeat, device, clear)
+    cached = timed(function, repeat, device)
+    print(f'{name:>22}: {uncached:8.3f} ms uncached, {cached:8.3f} ms cached ({uncached / cached:.1f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='configs/sam2.1/sam2.1_hiera_t.yaml')
+    parser.add_argument('--checkpoint')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    predictor = SAM2ImagePredictor(build_sam2(args.config, args.checkpoint, device=args.device))
+    prompt_encoder = predictor.model.sam_prompt_encoder
+    pe_layer = prompt_encoder.pe_layer
+
+    dino_pe = PositionEmbeddingSineHW(128, temperatureH=20, temperatureW=20, normalize=True).to(args.device).eval()
+    dino_inputs = [
+        NestedTensor(torch.zeros(1, 256, h, w, device=args.device),
+                     torch.zeros(1, h, w, dtype=torch.bool, device=args.device), padded=False)
+        for h, w in DINO_LEVEL_SIZES
+    ]
+
+    failed = False
+    with torch.no_grad():
+        cached = prompt_encoder.get_dense_pe()
+        fresh = pe_layer._compute_dense_pe(prompt_encoder.image_embedding_size).unsqueeze(0)
+        failed |= not torch.equal(cached, fresh)
+
+        for tensor_list in dino_inputs:
+            cached = dino_pe(tensor_list)
+            fresh = dino_pe._compute_pos(tensor_list.mask)
+            failed |= not torch.equal(cached, fresh)
+
+        image = np.random.default_rng(0).integers(0, 256, (768, 1024, 3), dtype=np.uint8)
+        predictor.set_image(image)
+        point, label = np.array([[512, 384]]), np.array([1])
+
+        report('get_dense_pe', prompt_encoder.get_dense_pe, pe_layer._pe_cache.clear, args.repeat, args.device)
+        report('predict (1 point)', lambda: predictor.predict(point, label, multimask_output=True),
+               pe_layer._pe_cache.clear, args.repeat, args.device)
+        report('DINO sine, 4 levels', lambda: [dino_pe(tensor_list) for tensor_list in dino_inputs],
+               dino_pe._pe_cache.clear, args.repeat, args.device)
+
+    print('cached encodings match' if not failed else 'MISMATCH between cached and computed encodings')
+    sys.exit(1 if failed else 0)
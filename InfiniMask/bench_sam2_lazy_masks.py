@@ -0,0 +1,111 @@
+"""
+SAM2ImagePredictor.predict (every candidate upscaled and copied as float32)
+against predict_lazy reading all candidates as uint8, only the best one as
+uint8, or all of them bit packed.
+
+Checks that the lazy masks match predict (exits with 1 otherwise) and prints the
+time, the host bytes of the masks and the peak memory growth of each mode,
+measured in a fresh interpreter (Linux, the peak is read from /proc).
+
+Usage: python bench_sam2_lazy_masks.py [--size 6000x4000] [--repeat 5] [--config configs/sam2.1/sam2.1_hiera_t.yaml]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+RUNNER = '''
+import time
+import numpy as np, torch
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+width, height, repeat, device = {width}, {height}, {repeat}, {device!r}
+torch.manual_seed(0)
+predictor = SAM2ImagePredictor(build_sam2({config!r}, {checkpoint!r}, device=device))
+predictor.set_image(np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8))
+point, label = np.array([[width // 2, height // 2]]), np.array([1])
+
+def lazy(read):
+    masks, scores, _ = predictor.predict_lazy(point, label, multimask_output=True)
+    return read(masks, scores)
+
+modes = {{
+    'predict': lambda: [predictor.predict(point, label, multimask_output=True)[0]],
+    'lazy uint8': lambda: lazy(lambda masks, scores: [masks.to_uint8()]),
+    'lazy uint8 best': lambda: lazy(lambda masks, scores: [masks.to_uint8(int(scores.argmax()))]),
+    'lazy packed': lambda: lazy(lambda masks, scores: [masks.to_packed()]),
+}}
+
+def memory_kb(field):
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field))
+
+# Reset the peak after set_image, which is higher than any mode (Linux only)
+with open('/proc/self/clear_refs', 'w') as f:
+    f.write('5')
+baseline = memory_kb('VmRSS')
+timings = []
+for _ in range(repeat):
+    start = time.perf_counter()
+    result = modes[{mode!r}]()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    timings.append(time.perf_counter() - start)
+
+peak_mb = (memory_kb('VmHWM') - baseline) / 1024
+print(min(timings), peak_mb, sum(array.nbytes for array in result))
+'''
+
+PARITY = '''
+import numpy as np, torch
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+torch.manual_seed(0)
+predictor = SAM2ImagePredictor(build_sam2({config!r}, {checkpoint!r}, device={device!r}), max_hole_area=8)
+predictor.set_image(np.random.default_rng(0).integers(0, 256, (301, 517, 3), dtype=np.uint8))
+point, label = np.array([[250, 150]]), np.array([1])
+
+masks, scores, low_res = predictor.predict(point, label)
+logits = predictor.predict(point, label, return_logits=True)[0]
+lazy, lazy_scores, lazy_low_res = predictor.predict_lazy(point, label)
+
+checks = [
+    np.array_equal(lazy.to_bool(), masks > 0.5),
+    np.array_equal(lazy.to_uint8(1), (masks[1] > 0.5).astype(np.uint8) * 255),
+    np.array_equal(np.unpackbits(lazy.to_packed([2, 0]), axis=-1, count=517).astype(bool), masks[[2, 0]] > 0.5),
+    np.abs(lazy.to_logits() - logits).max() < 1e-4,
+    np.array_equal(lazy_scores, scores) and np.array_equal(lazy_low_res, low_res),
+]
+print(all(checks))
+'''
+
+
+def run(code, **kwargs):
+    result = subprocess.run([sys.executable, '-c', code.format(**kwargs)], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    return result.stdout.split()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default='6000x4000', help='WIDTHxHEIGHT')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--config', default='configs/sam2.1/sam2.1_hiera_t.yaml')
+    parser.add_argument('--checkpoint')
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+    width, height = [int(n) for n in args.size.split('x')]
+
+    ok = run(PARITY, config=args.config, checkpoint=args.checkpoint, device=args.device)[-1] == 'True'
+    print('lazy masks match predict' if ok else 'MISMATCH between lazy masks and predict')
+
+    print(f'{width}x{height} image, 3 candidates')
+    for mode in ['predict', 'lazy uint8', 'lazy uint8 best', 'lazy packed']:
+        seconds, peak_mb, nbytes = run(RUNNER, width=width, height=height, repeat=args.repeat, device=args.device,
+                                       config=args.config, checkpoint=args.checkpoint, mode=mode)[-3:]
+        print(f'{mode:>16}: {float(seconds) * 1000:8.1f} ms, masks {int(nbytes) / 2**20:7.1f} MB, '
+              f'peak +{float(peak_mb):6.0f} MB')
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,116 @@
+"""
+SAM2ImagePredictor.predict_batch against the previous per image loop (prompt
+encoder, mask decoder and three host copies for every image).
+
+Uses random weights unless --checkpoint is given, images of two sizes and a
+mix of box, point and box + point prompts. Exits with 1 if the outputs differ.
+
+Usage: python bench_sam2_predict_batch.py [--config configs/sam2.1/sam2.1_hiera_t.yaml]
+       [--checkpoint PATH] [--images 8] [--boxes 4] [--repeat 3] [--device cpu]
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import torch
+
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+
+def predict_batch_loop(predictor, point_coords_batch, point_labels_batch, box_batch, multimask_output):
+    """
+    predict_batch before batching, one decoder call per image.
+    """
+    all_masks, all_ious, all_low_res_masks = [ ], [ ], [ ]
+
+    for img_idx in range(len(predictor._features['image_embed'])):
+        point_coords = point_coords_batch[img_idx] if point_coords_batch is not None else None
+        point_labels = point_labels_batch[img_idx] if point_labels_batch is not None else None
+        box = box_batch[img_idx] if box_batch is not None else None
+        mask_input, unnorm_coords, labels, unnorm_box = predictor._prep_prompts(
+            point_coords, point_labels, box, None, True, img_idx=img_idx)
+        masks, iou_predictions, low_res_masks = predictor._predict(
+            unnorm_coords, labels, unnorm_box, mask_input, multimask_output, img_idx=img_idx)
+
+        all_masks.append(masks.squeeze(0).float().cpu().numpy())
+        all_ious.append(iou_predictions.squeeze(0).float().cpu().numpy())
+        all_low_res_masks.append(low_res_masks.squeeze(0).float().cpu().numpy())
+
+    return all_masks, all_ious, all_low_res_masks
+
+
+def make_prompts(images, num_boxes, rng):
+    """
+    Boxes on even images, box + point on odd ones, a varying number of boxes per image.
+    """
+    boxes, points, labels = [ ], [ ], [ ]
+
+    for i, image in enumerate(images):
+        h, w = image.shape[:2]
+        n = 1 + i % num_boxes
+        corners = rng.uniform(0, 1, (n, 2, 2)) * [w, h]
+        boxes.append(np.concatenate([corners.min(1), corners.max(1)], axis=1))
+        points.append(rng.uniform(0, 1, (n, 1, 2)) * [w, h] if i % 2 else None)
+        labels.append(np.ones((n, 1)) if i % 2 else None)
+
+    return boxes, points, labels
+
+
+def timed(function, repeat, device):
+    timings = [ ]
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        timings.append(time.perf_counter() - start)
+
+    return result, min(timings)
+
+
+def max_error(results, references):
+    return max(float(np.abs(result - reference).max()) for result, reference in zip(results, references))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='configs/sam2.1/sam2.1_hiera_t.yaml')
+    parser.add_argument('--checkpoint')
+    parser.add_argument('--images', type=int, default=8)
+    parser.add_argument('--boxes', type=int, default=4, help='Up to this many boxes per image')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    rng = np.random.default_rng(0)
+    predictor = SAM2ImagePredictor(build_sam2(args.config, args.checkpoint, device=args.device))
+    sizes = [(480, 640), (600, 400)]
+    images = [rng.integers(0, 256, (*sizes[i % 2], 3), dtype=np.uint8) for i in range(args.images)]
+    predictor.set_image_batch(images)
+
+    failed = False
+    for name, (boxes, points, labels) in [
+        ('boxes', (make_prompts(images, args.boxes, rng)[0], None, None)),
+        ('boxes + points', make_prompts(images, args.boxes, rng)),
+    ]:
+        for multimask_output in (False, True):
+            reference, loop_seconds = timed(
+                lambda: predict_batch_loop(predictor, points, labels, boxes, multimask_output), args.repeat, args.device)
+            result, batch_seconds = timed(
+                lambda: predictor.predict_batch(points, labels, boxes, multimask_output=multimask_output),
+                args.repeat, args.device)
+
+            mask_mismatch = max(float((m != r).mean()) for m, r in zip(result[0], reference[0]))
+            iou_error, logit_error = max_error(result[1], reference[1]), max_error(result[2], reference[2])
+            ok = iou_error < 1e-3 and logit_error < 1e-2 and mask_mismatch < 1e-4
+            failed |= not ok
+
+            print(f'{name:>15}, multimask {multimask_output!s:>5}: loop {loop_seconds * 1000:7.1f} ms, '
+                  f'batched {batch_seconds * 1000:7.1f} ms ({loop_seconds / batch_seconds:.2f}x), '
+                  f'iou error {iou_error:.1e}, logit error {logit_error:.1e}, '
+                  f'mask pixels differing {mask_mismatch:.1e}{"" if ok else " MISMATCH"}')
+
+    sys.exit(1 if failed else 0)
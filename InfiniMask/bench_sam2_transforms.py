@@ -0,0 +1,92 @@
+"""
+SAM2 image preprocessing benchmark, the previous CPU path (ToTensor, Resize and
+Normalize from torchvision) against SAM2Transforms uploading uint8 images and
+resizing them on the device.
+
+Checks that every path matches the reference (exits with 1 otherwise) and prints
+the time and the peak memory growth of each, measured in a fresh interpreter.
+
+Usage: python bench_sam2_transforms.py [--size 6000x4000] [--batch 4] [--repeat 5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+RUNNER = '''
+import resource, time
+import numpy as np, torch
+from PIL import Image
+from torchvision.transforms import Normalize, Resize, ToTensor
+from sam2.utils.transforms import SAM2Transforms
+
+width, height, batch_size, repeat, device = {width}, {height}, {batch}, {repeat}, {device!r}
+rng = np.random.default_rng(0)
+# Smooth content, random pixels at full resolution would exaggerate resampling differences
+images = [np.array(Image.fromarray(rng.integers(0, 256, (height // 10, width // 10, 3), dtype=np.uint8))
+          .resize((width, height), Image.BILINEAR)) for _ in range(batch_size)]
+
+to_tensor, resize, normalize = ToTensor(), Resize((1024, 1024)), Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+transforms = SAM2Transforms(1024, 0.0, uint8_resize={uint8_resize})
+
+modes = {{
+    'reference': lambda: torch.stack([normalize(resize(to_tensor(image))) for image in images]).to(device),
+    'device': lambda: transforms.forward_batch(images, device=device),
+}}
+
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+timings = []
+for _ in range(repeat):
+    start = time.perf_counter()
+    result = modes[{mode!r}]()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    timings.append(time.perf_counter() - start)
+
+peak_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+reference = modes['reference']() if {mode!r} != 'reference' else result
+error = (result.cpu() - reference.cpu()).abs().max().item()
+print(min(timings), peak_mb, error)
+'''
+
+
+def run(mode, device, uint8_resize, args):
+    code = RUNNER.format(width=args.width, height=args.height, batch=args.batch, repeat=args.repeat,
+                         device=device, mode=mode, uint8_resize=uint8_resize)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    seconds, peak_mb, error = result.stdout.split()[-3:]
+
+    return float(seconds), float(peak_mb), float(error)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default='6000x4000', help='WIDTHxHEIGHT')
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    # One gray level is about 0.017 after normalization
+    parser.add_argument('--uint8-tolerance', type=float, default=0.05)
+    args = parser.parse_args()
+    args.width, args.height = [int(n) for n in args.size.split('x')]
+
+    import torch
+
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [ ])
+    cases = [('reference', 'cpu', None)]
+    for device in devices:
+        cases += [('device', device, False), ('device', device, True)]
+
+    failed = False
+    print(f'{args.batch} x {args.width}x{args.height} images')
+    for mode, device, uint8_resize in cases:
+        seconds, peak_mb, error = run(mode, device, uint8_resize, args)
+        label = mode if mode == 'reference' else f'{device} {"uint8" if uint8_resize else "float"} resize'
+        tolerance = args.uint8_tolerance if uint8_resize else 1e-4
+        ok = error <= tolerance
+        failed |= not ok
+
+        print(f'{label:>20}: {seconds * 1000:8.1f} ms, peak +{peak_mb:6.0f} MB, '
+              f'max error {error:.1e}{"" if ok else " MISMATCH"}')
+
+    sys.exit(1 if failed else 0)
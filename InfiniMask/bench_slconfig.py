@@ -0,0 +1,135 @@
+"""
+Cold start benchmark of SLConfig.fromfile, each measurement runs in a fresh interpreter.
+
+Compares the previous loader (temp copy imported as a module), executing the
+config, the pure-data fast path and the JSON cache. Uses CONFIG when given,
+otherwise writes the Grounding DINO SwinT config to a temp directory.
+
+Usage: python bench_slconfig.py [CONFIG] [--repeat 5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+# Grounding DINO SwinT OGC config
+SAMPLE_CONFIG = '''batch_size = 1
+modelname = "groundingdino"
+backbone = "swin_T_224_1k"
+position_embedding = "sine"
+pe_temperatureH = 20
+pe_temperatureW = 20
+return_interm_indices = [1, 2, 3]
+backbone_freeze_keywords = None
+enc_layers = 6
+dec_layers = 6
+pre_norm = False
+dim_feedforward = 2048
+hidden_dim = 256
+dropout = 0.0
+nheads = 8
+num_queries = 900
+query_dim = 4
+num_patterns = 0
+num_feature_levels = 4
+enc_n_points = 4
+dec_n_points = 4
+two_stage_type = "standard"
+two_stage_bbox_embed_share = False
+two_stage_class_embed_share = False
+transformer_activation = "relu"
+dec_pred_bbox_embed_share = True
+dn_box_noise_scale = 1.0
+dn_label_noise_ratio = 0.5
+dn_label_coef = 1.0
+dn_bbox_coef = 1.0
+embed_init_tgt = True
+dn_labelbook_size = 2000
+max_text_len = 256
+text_encoder_type = "bert-base-uncased"
+use_text_enhancer = True
+use_fusion_layer = True
+use_checkpoint = True
+use_transformer_ckpt = True
+use_text_cross_attention = True
+text_dropout = 0.0
+fusion_dropout = 0.0
+fusion_droppath = 0.1
+sub_sentence_present = True
+'''
+
+# The loader before the cache: copy into a temp dir, put it on sys.path and import it
+LEGACY_LOADER = '''
+import os.path as osp, shutil, sys, tempfile
+from importlib import import_module
+from local_groundingdino.util.slconfig import SLConfig
+def load(filename):
+    with tempfile.TemporaryDirectory() as temp_config_dir:
+        temp_config_file = tempfile.NamedTemporaryFile(dir=temp_config_dir, suffix=".py")
+        temp_config_name = osp.basename(temp_config_file.name)
+        shutil.copyfile(filename, osp.join(temp_config_dir, temp_config_name))
+        temp_module_name = osp.splitext(temp_config_name)[0]
+        sys.path.insert(0, temp_config_dir)
+        SLConfig._validate_py_syntax(filename)
+        mod = import_module(temp_module_name)
+        sys.path.pop(0)
+        cfg_dict = {name: value for name, value in mod.__dict__.items() if not name.startswith("__")}
+        del sys.modules[temp_module_name]
+        temp_config_file.close()
+    return SLConfig(cfg_dict, filename=filename)
+'''
+
+MODES = {
+    'legacy import': LEGACY_LOADER,
+    'exec': '''
+from local_groundingdino.util.slconfig import SLConfig
+SLConfig._parse_pure_data = staticmethod(lambda content: None)
+load = lambda filename: SLConfig.fromfile(filename, use_cache=False)
+''',
+    'pure data': '''
+from local_groundingdino.util.slconfig import SLConfig
+load = lambda filename: SLConfig.fromfile(filename, use_cache=False)
+''',
+    'cache hit': '''
+from local_groundingdino.util.slconfig import SLConfig
+load = lambda filename: SLConfig.fromfile(filename)
+''',
+}
+
+TIMER = '''
+import time
+start = time.perf_counter()
+cfg = load({filename!r})
+print(time.perf_counter() - start, len(cfg._cfg_dict))
+'''
+
+
+def run_mode(setup, filename):
+    code = setup + TIMER.format(filename=filename)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    seconds, num_keys = result.stdout.split()[-2:]
+
+    return float(seconds), int(num_keys)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', nargs='?', help='Config file, defaults to a copy of the SwinT config')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = args.config
+        if filename is None:
+            filename = os.path.join(temp_dir, 'GroundingDINO_SwinT_OGC.py')
+            with open(filename, 'w') as f:
+                f.write(SAMPLE_CONFIG)
+
+        filename = os.path.abspath(filename)
+        run_mode(MODES['cache hit'], filename) # Write the cache
+
+        for mode, setup in MODES.items():
+            timings = [run_mode(setup, filename) for _ in range(args.repeat)]
+            print(f'{mode:>14}: {min(seconds for seconds, _ in timings) * 1000:7.2f} ms ({timings[0][1]} keys)')
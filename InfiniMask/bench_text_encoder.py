@@ -0,0 +1,65 @@
+"""
+Start up breakdown of the Grounding DINO text encoder (tokenizer + BERT), each
+measurement runs in a fresh interpreter.
+
+Compares loading by hub name from the Hugging Face cache (what from_pretrained
+did before, minus the network checks) with the exported copy in
+TEXT_ENCODER_DIR (see local_groundingdino/util/get_tokenlizer.py), exporting
+it first if needed.
+
+Usage: python bench_text_encoder.py [--name bert-base-uncased] [--repeat 3]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+LOADER = '''
+import time
+start = time.perf_counter()
+from transformers import AutoTokenizer, BertModel, RobertaModel
+imported = time.perf_counter()
+tokenizer = AutoTokenizer.from_pretrained({path!r}, use_fast=True, local_files_only=True)
+tokenized = time.perf_counter()
+model = (RobertaModel if {name!r} == "roberta-base" else BertModel).from_pretrained({path!r}, local_files_only=True)
+loaded = time.perf_counter()
+print(imported - start, tokenized - imported, loaded - tokenized, type(tokenizer).__name__)
+'''
+
+
+def run_loader(name, path):
+    env = dict(os.environ, HF_HUB_OFFLINE='1', TRANSFORMERS_OFFLINE='1')
+    result = subprocess.run([sys.executable, '-c', LOADER.format(name=name, path=path)], capture_output=True,
+                            text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    *timings, tokenizer_class = result.stdout.split()[-4:]
+
+    return [float(seconds) for seconds in timings], tokenizer_class
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--name', default='bert-base-uncased')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from local_groundingdino.util.get_tokenlizer import get_local_text_encoder_dir, is_exported, resolve_text_encoder
+
+    exported_path = get_local_text_encoder_dir(args.name)
+    if not is_exported(exported_path):
+        resolve_text_encoder(args.name)
+
+    print(f'{"source":>10} {"import":>9} {"tokenizer":>10} {"model":>9} {"total":>9}')
+
+    for label, path in [('hub cache', args.name), ('exported', exported_path)]:
+        try:
+            runs = [run_loader(args.name, path) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f'{label:>10} failed: {e}')
+            continue
+
+        best = [min(timings[i] for timings, _ in runs) * 1000 for i in range(3)]
+        print(f'{label:>10} {best[0]:>7.0f}ms {best[1]:>8.0f}ms {best[2]:>7.0f}ms {sum(best):>7.0f}ms  ({runs[0][1]})')
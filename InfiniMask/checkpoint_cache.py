@@ -0,0 +1,169 @@
+"""
+Checkpoint loading through a memory-mapped safetensors cache, shared by the
+Grounding DINO and SAM2 loaders.
+
+The first load of model.pth unpickles it as usual, applies the loader's cleanup
+(e.g. clean_state_dict) and writes the resulting state dict to model.safetensors
+next to it. Later loads map that file read-only and copy-on-write: tensors are
+views into the page cache, so start up skips unpickling and worker processes
+share the same physical pages. Pass the state dict to load_state_dict with
+assign=True to keep the weights mapped instead of copying them into fresh
+parameters.
+
+The cache records the size and mtime of the source checkpoint and is rebuilt
+when they change.
+"""
+import json
+import logging
+import os
+import struct
+
+import torch
+
+try:
+    from safetensors.torch import save_file
+except ImportError:
+    save_file = None
+
+CACHE_FORMAT = '1'
+
+DTYPES = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool,
+}
+
+
+def get_cache_path(checkpoint_path: str) -> str:
+    return os.path.splitext(checkpoint_path)[0] + '.safetensors'
+
+
+def get_source_metadata(checkpoint_path: str, key, transform) -> dict:
+    stat = os.stat(checkpoint_path)
+
+    return {
+        'format': CACHE_FORMAT,
+        'source_size': str(stat.st_size),
+        'source_mtime_ns': str(stat.st_mtime_ns),
+        'key': str(key),
+        'transform': getattr(transform, '__name__', str(transform)),
+    }
+
+
+def read_header(path: str):
+    """
+    Returns (header, data offset) of a safetensors file.
+    """
+    with open(path, 'rb') as f:
+        header_size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_size))
+
+    return header, 8 + header_size
+
+
+def load_safetensors_mmap(path: str):
+    """
+    Map a safetensors file and return ({name: tensor view}, metadata) without reading the data.
+    """
+    header, data_offset = read_header(path)
+    metadata = header.pop('__metadata__', { })
+    # Copy-on-write mapping, pages come from the page cache and are shared between processes
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+
+    state_dict = { }
+    for name, info in header.items():
+        dtype = DTYPES[info['dtype']]
+        begin = data_offset + info['data_offsets'][0]
+        itemsize = torch.empty((), dtype=dtype).element_size()
+
+        if begin % itemsize:
+            raise ValueError(f'{path}: tensor {name} is not aligned')
+
+        state_dict[name] = torch.empty(0, dtype=dtype).set_(storage, begin // itemsize, info['shape'])
+
+    # Tensors that shared storage in the source (tied weights) are stored once
+    for alias, name in json.loads(metadata.get('aliases', '{}')).items():
+        state_dict[alias] = state_dict[name]
+
+    return state_dict, metadata
+
+
+def write_cache(state_dict: dict, cache_path: str, metadata: dict, mode: int = 0o644):
+    tensors = { }
+    aliases = { }
+    seen = { } # (data_ptr, dtype, shape, stride) -> name
+
+    for name, tensor in state_dict.items():
+        if not isinstance(tensor, torch.Tensor):
+            continue
+
+        view = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape), tensor.stride())
+        if tensor.numel() and view in seen:
+            aliases[name] = seen[view]
+            continue
+
+        seen[view] = name
+        # safetensors refuses tensors sharing memory, every stored tensor gets its own copy
+        tensors[name] = tensor.detach().to('cpu').contiguous().clone()
+
+    metadata = dict(metadata, aliases=json.dumps(aliases))
+
+    # Write to a temporary name first, workers starting together may convert concurrently
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        save_file(tensors, temp_path, metadata=metadata)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, cache_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def load_checkpoint(checkpoint_path: str, key='model', transform=None, weights_only=None) -> dict:
+    """
+    Load checkpoint_path[key] (the whole checkpoint if key is None) with transform applied,
+    through the safetensors cache next to it. Falls back to a plain torch.load when the
+    cache cannot be used. weights_only is passed to torch.load, None keeps the torch default.
+    """
+    if checkpoint_path.endswith('.safetensors'):
+        return load_safetensors_mmap(checkpoint_path)[0]
+
+    cache_path = get_cache_path(checkpoint_path)
+    source_metadata = get_source_metadata(checkpoint_path, key, transform)
+
+    if os.path.isfile(cache_path):
+        try:
+            state_dict, metadata = load_safetensors_mmap(cache_path)
+            if all(metadata.get(name) == value for name, value in source_metadata.items()):
+                return state_dict
+            logging.info(f'{cache_path} is out of date, rebuilding it')
+        except (ValueError, KeyError, OSError, RuntimeError) as e:
+            logging.warning(f'Could not read {cache_path}, rebuilding it: {e}')
+
+    load_kwargs = {'weights_only': weights_only} if weights_only is not None else { }
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', **load_kwargs)
+    state_dict = checkpoint[key] if key is not None else checkpoint
+    if transform is not None:
+        state_dict = transform(state_dict)
+
+    if save_file is None:
+        logging.warning('safetensors is not installed, checkpoints are not cached')
+        return state_dict
+
+    try:
+        # Same permissions as the source, other users' workers map the cache too
+        write_cache(state_dict, cache_path, source_metadata, os.stat(checkpoint_path).st_mode & 0o777)
+    except OSError as e:
+        logging.warning(f'Could not write {cache_path}: {e}')
+        return state_dict
+
+    logging.info(f'Cached {checkpoint_path} as {cache_path}')
+    # Return the mapped copy, so this process drops the unpickled tensors too
+    return load_safetensors_mmap(cache_path)[0]
@@ -16,9 +16,11 @@ import io
 import copy
 import numpy as np
 from PIL import Image
-from local_groundingdino.util.inference import load_model as load_dino_model, load_image_pil, predict
+from local_groundingdino.util.inference import load_model as load_dino_model, load_image_pil, predict, predict_captions
 from sam2.build_sam import build_sam2
 from sam2.sam2_image_predictor import SAM2ImagePredictor
+from mask_prep import encode_mask_png
+from sam_embedding_store import get_model_id, hash_image, open_store
 
 # Disable Torch warnings
 import warnings
@@ -31,10 +33,27 @@ warnings.filterwarnings("ignore", category=UserWarning)
 print('Loading Grouding DINO...')
 dino_model = load_dino_model(conf['dino_config'], conf['dino_model'])
 
+# Inference profile, smaller sizes and fewer queries trade accuracy for latency (see bench_dino_profiles.py)
+DINO_IMAGE_SIZE = conf.get('dino_image_size', 800) # Shorter side
+DINO_IMAGE_MAX_SIZE = conf.get('dino_image_max_size', 1333) # Longer side limit
+dino_model.set_query_budget(conf.get('dino_num_queries', None)) # None decodes all queries
+# Separate layers per concept of 'a . b' prompts (predict_captions), a box may then appear in several layers
+DINO_CONCEPT_LAYERS = conf.get('dino_concept_layers', False)
+
 # Load the SAM2 model
 print('Loading SAM2...')
 sam_predictor = SAM2ImagePredictor(build_sam2(conf['sam_config'], conf['sam_model']))
 
+# Precomputed image features (see sam_embedding_store.py), used instead of the image encoder when present
+SAM_EMBEDDING_STORE = conf.get('sam_embedding_store', '')
+if SAM_EMBEDDING_STORE:
+    try:
+        # Read only, stores are created by sam_embedding_store.py build
+        open_store(SAM_EMBEDDING_STORE, get_model_id(conf['sam_config'], conf['sam_model']), create=False)
+        sam_predictor.embedding_store = SAM_EMBEDDING_STORE
+    except ValueError as e:
+        print(f'Embedding store disabled: {e}')
+
 HOST = conf['mask_api_host'] # Host address to run the server
 PORT = conf['mask_api_port'] # Port to listen on (non-privileged ports are > 1023)
 
@@ -45,17 +64,28 @@ PORT = conf['mask_api_port'] # Port to listen on (non-privileged ports are > 102
 app = Flask(__name__)
 CORS(app, origins='*')
 
+def load_stored_features(image_bytes):
+    """
+    Set the SAM image from the embedding store, False if no store is configured or the image is not in it.
+    """
+    # Hashing reads the whole upload, only worth it with a store
+    if sam_predictor.embedding_store is None:
+        return False
+
+    return sam_predictor.load_features(hash_image(image_bytes))
+
 @app.route('/generate_masks', methods = ['POST'])
 def generate_masks():
     received_json = request.get_json()
 
     image_bytes = base64.b64decode(received_json['image_bytes'])
 
-    image_pil = Image.open(io.BytesIO(image_bytes))
-    image_np = np.asarray(image_pil.convert('RGB'))
+    # Set image for SAM, from the embedding store if it was precomputed
+    if not load_stored_features(image_bytes):
+        image_pil = Image.open(io.BytesIO(image_bytes))
+        image_np = np.asarray(image_pil.convert('RGB'))
 
-    # Set image for SAM
-    sam_predictor.set_image(image_np)
+        sam_predictor.set_image(image_np)
 
     control_flag = received_json['control_flag']
 
@@ -106,7 +136,8 @@ def generate_masks():
     else:
         input_box_np = None
     
-    masks, scores, logits = sam_predictor.predict(
+    # Masks are upscaled one at a time when encoded, as uint8
+    masks, scores, logits = sam_predictor.predict_lazy(
         point_coords=input_point_np,
         point_labels=input_label_np,
         box=input_box_np,
@@ -118,15 +149,9 @@ def generate_masks():
     result['masks'] = [ ]
 
     for i in range(masks.shape[0]):
-        # Convert to rgb image (still as np array)
-        mask_as_image_np = np.stack((masks[i].astype(np.uint8) * 255,) * 3, axis=-1)
-        print('Mask image shape: ' + str(mask_as_image_np.shape) + ', Score: ' + str(scores[i]))
+        print('Mask image shape: ' + str(masks.shape[1:]) + ', Score: ' + str(scores[i]))
 
-        byte_buffer = io.BytesIO()
-
-        mask_pil = Image.fromarray(mask_as_image_np)
-        mask_pil.save(byte_buffer, format='PNG')
-        mask_png_bytes = byte_buffer.getvalue()
+        mask_png_bytes = encode_mask_png(masks.to_uint8(i))
 
         result['masks'].append({
             'score': str(scores[i]),
@@ -147,15 +172,26 @@ def generate_box_layers():
 
     # Load the image
     image_pil = Image.open(io.BytesIO(image_bytes))
-    image_np, image_as_tensor = load_image_pil(image_pil)
+    image_np, image_as_tensor = load_image_pil(image_pil, DINO_IMAGE_SIZE, DINO_IMAGE_MAX_SIZE)
 
     # Set image for SAM
-    sam_predictor.set_image(image_np)
+    if not load_stored_features(image_bytes):
+        sam_predictor.set_image(image_np)
 
     h, w, _ = image_np.shape
     
     # Predict the bounding boxes and labels using Grounding DINO
-    boxes, logits, captions = predict(dino_model, image_as_tensor, text_prompt, 0.3, 0.3)
+    concepts = [concept.strip() for concept in text_prompt.split('.') if concept.strip()]
+
+    if DINO_CONCEPT_LAYERS and len(concepts) > 1:
+        # Separate layers per concept (e.g. 'hair . face . hand'), all from a single DINO pass
+        grouped = predict_captions(dino_model, image_as_tensor, concepts, 0.3)
+
+        boxes = torch.cat([concept_boxes for concept_boxes, _ in grouped])
+        logits = torch.cat([concept_logits for _, concept_logits in grouped])
+        captions = [concept for concept, (concept_boxes, _) in zip(concepts, grouped) for _ in range(len(concept_boxes))]
+    else:
+        boxes, logits, captions = predict(dino_model, image_as_tensor, text_prompt, 0.3, 0.3)
 
     print(f'Dino boxes shape: {boxes.shape}')
     sam_boxes = copy.deepcopy(boxes) # Bx4, Mask count * 4 [Box shape]
@@ -179,7 +215,7 @@ def generate_box_layers():
 
         input_box_np = np.array([x1, y1, x2, y2])
 
-        masks, scores, logits = sam_predictor.predict(
+        masks, scores, logits = sam_predictor.predict_lazy(
             box=input_box_np,
             mask_input=None,
             multimask_output=True,
@@ -195,15 +231,9 @@ def generate_box_layers():
         box_obj['masks'] = [ ]
         
         for i in range(masks.shape[0]):
-            # Convert to rgb image (still as np array)
-            mask_as_image_np = np.stack((masks[i].astype(np.uint8) * 255,) * 3, axis=-1)
-            print('Mask image shape: ' + str(mask_as_image_np.shape) + ', Score: ' + str(scores[i]))
-
-            byte_buffer = io.BytesIO()
+            print('Mask image shape: ' + str(masks.shape[1:]) + ', Score: ' + str(scores[i]))
 
-            mask_pil = Image.fromarray(mask_as_image_np)
-            mask_pil.save(byte_buffer, format='PNG')
-            mask_png_bytes = byte_buffer.getvalue()
+            mask_png_bytes = encode_mask_png(masks.to_uint8(i))
 
             box_obj['masks'].append({
                 'score': str(scores[i]),
@@ -4,56 +4,112 @@ with open("config.json") as f:
     conf = json.load(f)
 
 import requests
+import os
 import io
+import math
+import time
 import base64
-from PIL import Image, ImageFilter
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image, ImageFilter, PngImagePlugin
+
+import mask_prep
 
 pos_prompt = conf['inpaint_pos_prompt']
 neg_prompt = conf['inpaint_neg_prompt']
 api = conf['inpaint_api']
 
-def img2img(image_path, mask_path, seed, output_path):
-    api_url = f"{api}/sdapi/v1/img2img"
+# Mask dilation radius and blur sigma, both in pixels at inpaint resolution
+mask_dilate_radius = int(conf.get('inpaint_mask_dilate_radius', 3))
+mask_blur_sigma    = float(conf.get('inpaint_mask_blur_sigma', 3))
+mask_resample      = conf.get('inpaint_mask_resample', 'lanczos')
 
-    with open(image_path, 'rb') as file:
-        image_data = file.read()
-        image_pil = Image.open(file)
+# Crop-to-mask mode: only the region around the mask is sent for inpainting, and
+# the result is pasted back into the full-resolution source image
+crop_to_mask  = bool(conf.get('inpaint_crop_to_mask', False))
+crop_padding  = int(conf.get('inpaint_crop_padding', 32))   # In source pixels
+crop_min_side = int(conf.get('inpaint_crop_min_side', 512)) # In inpaint pixels
+crop_feather  = int(conf.get('inpaint_crop_feather', 8))    # In source pixels
 
-        longer_side = int(conf['inpaint_resize_longer_side'])
+# Pipeline stage settings. Preparation runs in worker processes because PIL
+# filters are CPU-heavy, dispatch and writing run in threads
+prep_workers     = int(conf.get('inpaint_prep_workers', 2))
+dispatch_workers = int(conf.get('inpaint_dispatch_workers', 1))
+write_workers    = int(conf.get('inpaint_write_workers', 2))
+queue_size       = int(conf.get('inpaint_queue_size', 8))
+stats_interval   = float(conf.get('inpaint_stats_interval', 10))
 
-        # Scale down
-        if image_pil.width >= image_pil.height:
-            image_w = longer_side
-            image_h = round(image_pil.height * (longer_side / image_pil.width))
-        else:
-            image_w = round(image_pil.width * (longer_side / image_pil.height))
-            image_h = longer_side
-        
-        print(f'Scaling to ({image_w}, {image_h})')
-        image_pil = image_pil.resize((image_w, image_h), Image.Resampling.LANCZOS).convert('RGB')
-        # Assign back to file binary
-        img_byte_arr = io.BytesIO()
-        image_pil.save(img_byte_arr, format='JPEG')
-        image_data = img_byte_arr.getvalue()
-    
-    with open(mask_path, 'rb') as file:
-        mask_data = file.read()
-        mask_pil = Image.open(file)
-        # Scale down
-        mask_pil = mask_pil.resize((image_w, image_h), Image.Resampling.LANCZOS)
-
-        # Dilate and blur the mask
-        mask_pil = mask_pil.filter(ImageFilter.MaxFilter(7))
-        mask_pil = mask_pil.filter(ImageFilter.GaussianBlur(3))
-
-        # Assign back to file binary
-        img_byte_arr = io.BytesIO()
-        mask_pil.save(img_byte_arr, format='PNG')
-        mask_data = img_byte_arr.getvalue()
-    
-    encoded_image = base64.b64encode(image_data).decode('utf-8')
-    encoded_mask  = base64.b64encode(mask_data).decode('utf-8')
+seeds = [42, 1337, 2077]
+
+def get_scaled_size(width, height, longer_side):
+    if width >= height:
+        return longer_side, round(height * (longer_side / width))
+    else:
+        return round(width * (longer_side / height)), longer_side
+
+def prepare_mask(mask_pil, size):
+    # Scale, dilate and blur the mask
+    mask_np = mask_prep.prepare_mask(mask_pil, size, mask_dilate_radius, mask_blur_sigma, mask_resample)
+
+    return Image.fromarray(mask_np)
+
+def encode_pil(image_pil, format):
+    img_byte_arr = io.BytesIO()
+    image_pil.save(img_byte_arr, format=format)
+
+    return base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
+
+def expand_span(lo, hi, min_length, limit):
+    lo, hi = max(lo, 0), min(hi, limit)
+    missing = min_length - (hi - lo)
+
+    if missing > 0: # Grow around the center, then shift back inside the image
+        lo = max(lo - missing // 2, 0)
+        hi = min(lo + min_length, limit)
+        lo = max(hi - min_length, 0)
+
+    return lo, hi
+
+def get_crop_box(mask_pil, image_scale):
+    """
+    Get the region of the source image to inpaint, or None if the mask is empty.
+
+    The bounding box of the mask is grown by what dilation and blur add at inpaint
+    resolution plus the configured padding, then enlarged if needed so that the
+    model still gets at least crop_min_side pixels of context.
+    """
+    bbox = mask_pil.convert('L').getbbox()
+
+    if bbox is None:
+        return None
+
+    grow = math.ceil((mask_dilate_radius + mask_blur_sigma * 3) / image_scale) + crop_padding
+    min_side = math.ceil(crop_min_side / image_scale)
+
+    x1, x2 = expand_span(bbox[0] - grow, bbox[2] + grow, min_side, mask_pil.width)
+    y1, y2 = expand_span(bbox[1] - grow, bbox[3] + grow, min_side, mask_pil.height)
 
+    return x1, y1, x2, y2
+
+def paste_inpainted_crop(source_pil, result_pil, mask_pil, crop_box):
+    crop_size = (crop_box[2] - crop_box[0], crop_box[3] - crop_box[1])
+
+    # Scale result back to source resolution
+    result_pil = result_pil.convert('RGB').resize(crop_size, Image.Resampling.LANCZOS)
+
+    # Feather the inpaint mask so that the seam blends into the original
+    blend_mask = mask_pil.convert('L').resize(crop_size, Image.Resampling.LANCZOS)
+
+    if crop_feather > 0:
+        blend_mask = blend_mask.filter(ImageFilter.GaussianBlur(crop_feather))
+
+    source_pil.paste(result_pil, crop_box[:2], blend_mask)
+
+    return source_pil
+
+def build_payload(encoded_image, encoded_mask, seed, image_w, image_h):
     payload = {
         "alwayson_scripts": {
             "ControlNet": {
@@ -179,46 +235,442 @@ def img2img(image_path, mask_path, seed, output_path):
         "scheduler": "Automatic",
     }
 
-    response = requests.post(api_url, json=payload)
-    
+    return payload
+
+def prepare_inputs(image_path, mask_path):
+    """
+    Load, crop and scale the source image and its mask for img2img.
+
+    Returns a picklable dict with the encoded inputs, or None if the mask is empty.
+    """
+    image_pil = Image.open(image_path).convert('RGB')
+    mask_pil = Image.open(mask_path)
+
+    longer_side = int(conf['inpaint_resize_longer_side'])
+    image_w, image_h = get_scaled_size(image_pil.width, image_pil.height, longer_side)
+    crop_box = None
+
+    if crop_to_mask:
+        if mask_pil.size != image_pil.size:
+            mask_pil = mask_pil.resize(image_pil.size, Image.Resampling.LANCZOS)
+
+        image_scale = image_w / image_pil.width
+        crop_box = get_crop_box(mask_pil, image_scale)
+
+        if crop_box is None:
+            print(f'Mask for {image_path} is empty. Skipped.')
+            return None
+
+        print(f'Cropping to {crop_box}')
+        image_pil = image_pil.crop(crop_box)
+        mask_pil = mask_pil.crop(crop_box)
+
+        image_w = max(round(image_pil.width * image_scale), 1)
+        image_h = max(round(image_pil.height * image_scale), 1)
+
+    print(f'Scaling to ({image_w}, {image_h})')
+    image_pil = image_pil.resize((image_w, image_h), Image.Resampling.LANCZOS)
+    mask_pil = prepare_mask(mask_pil, (image_w, image_h))
+
+    return {
+        'image_path': image_path,
+        'crop_box': crop_box,
+        'width': image_w,
+        'height': image_h,
+        'image': encode_pil(image_pil, 'JPEG'),
+        'mask': encode_pil(mask_pil, 'PNG'),
+    }
+
+# Sessions keep connections to the backend alive, one per dispatch thread
+thread_local = threading.local()
+
+def post_img2img(payload):
+    api_url = f"{api}/sdapi/v1/img2img"
+
+    if not hasattr(thread_local, 'session'):
+        thread_local.session = requests.Session()
+
+    response = thread_local.session.post(api_url, json=payload)
+
     if response.status_code == 200:
         response_data = response.json()
         encoded_result = response_data["images"][0]
-        result_data = base64.b64decode(encoded_result)
 
-        with open(output_path, 'wb') as file:
-            file.write(result_data)
+        return base64.b64decode(encoded_result)
     else:
         print("Unexpected error occurred:", response.text)
+        return None
+
+def write_result(prepared, result_data, output_path):
+    crop_box = prepared['crop_box']
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    if crop_box is None:
+        with open(output_path, 'wb') as file:
+            file.write(result_data)
+        return
+
+    result_pil = Image.open(io.BytesIO(result_data))
+    result_pil.load() # necessary for png images to prepare the info data
+
+    # Keep generation parameters of the inpainted region
+    png_info = PngImagePlugin.PngInfo()
+    if 'parameters' in result_pil.info:
+        png_info.add_text('parameters', result_pil.info['parameters'])
 
-import glob, os
+    source_pil = Image.open(prepared['image_path']).convert('RGB')
+    mask_pil = Image.open(io.BytesIO(base64.b64decode(prepared['mask'])))
 
-handled_extn_names = conf['accept_types']
+    output_pil = paste_inpainted_crop(source_pil, result_pil, mask_pil, crop_box)
+    output_pil.save(output_path, format='PNG', pnginfo=png_info)
+
+handled_extn_names = [extn_name.lower() for extn_name in conf['accept_types']]
 dir_i = conf['inpaint_dir_i']
 dir_o = conf['inpaint_dir_o']
 
-if not os.path.exists(dir_o):
-    os.mkdir(dir_o)
+# Also pick up images in subfolders of dir_i, outputs mirror the folder layout
+recursive = bool(conf.get('inpaint_recursive', False))
 
-for file in glob.glob(f'{dir_i}/*'):
-    file = file.replace('\\', '/')
-    file_name = file.rsplit('/', 1)[1]
-    extn_index = file_name.rfind('.')
+# Watch mode keeps polling dir_i and inpaints new or changed image/mask pairs
+watch_mode     = bool(conf.get('inpaint_watch', False))
+watch_interval = float(conf.get('inpaint_watch_interval', 2))
 
-    base_name = file_name[:extn_index].lower()
-    extn_name = file_name[extn_index:].lower()
+mask_suffix = '_mask.png'
 
-    seeds = [42, 1337, 2077]
+def get_outputs(base_name, dir_o):
     output_name_format = conf['inpaint_name_format']
 
-    if not base_name.endswith('_mask') and extn_name in handled_extn_names:
-        print(f'Processing [{base_name}][{extn_name}]...')
-        source_path = f'{dir_i}/{base_name}{extn_name}'
-        mask_path   = f'{dir_i}/{base_name}_mask.png'
-        
-        if os.path.isfile(mask_path):
-            for seed in seeds:
-                output_path = f'{dir_o}/{output_name_format.format(base_name, seed)}'
-                img2img(source_path, mask_path, seed, output_path)
+    return [(seed, f'{dir_o}/{output_name_format.format(base_name, seed)}') for seed in seeds]
+
+def scan_files(dir_i, recursive):
+    """
+    Yield (relative path, DirEntry) for every file under dir_i.
+
+    Each folder is listed exactly once with scandir, which also provides the
+    file type (and on Windows the stat data) without extra calls per file.
+    """
+    folders = [ '' ]
+
+    while folders:
+        rel_dir = folders.pop()
+
+        with os.scandir(f'{dir_i}/{rel_dir}' if rel_dir else dir_i) as entries:
+            for entry in entries:
+                rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+
+                if entry.is_dir():
+                    if recursive:
+                        folders.append(rel_path)
+                elif entry.is_file():
+                    yield rel_path, entry
+
+def split_input_name(rel_path):
+    """
+    Get (base name, kind) of an input file, kind being 'mask', 'image' or None.
+
+    Names keep their case, only the extension and mask suffix are matched
+    case-insensitively.
+    """
+    if rel_path.lower().endswith(mask_suffix):
+        return rel_path[:-len(mask_suffix)], 'mask'
+
+    base_name, extn_name = os.path.splitext(rel_path)
+
+    if extn_name.lower() in handled_extn_names and not base_name.lower().endswith('_mask'):
+        return base_name, 'image'
+
+    return None, None
+
+def index_inputs(rel_paths):
+    """
+    Group input files into casefolded base name -> { 'name': base name, 'images': [image variants], 'mask': mask or None }.
+
+    Foo.png pairs with foo_mask.png as on case-insensitive shares, 'name' keeps the
+    spelling of the image for output names.
+    """
+    index = { }
+
+    for rel_path in rel_paths:
+        base_name, kind = split_input_name(rel_path)
+
+        if kind is None:
+            continue
+
+        pair = index.setdefault(base_name.casefold(), { 'name': base_name, 'images': [ ], 'mask': None })
+
+        if kind == 'mask':
+            pair['mask'] = rel_path
         else:
-            print(f'Mask for {source_path} is not present. Skipped.')
+            if not pair['images']:
+                pair['name'] = base_name
+            pair['images'].append(rel_path)
+
+    return index
+
+def get_pair_jobs(base_name, pair, dir_i, dir_o):
+    """
+    Get a job for every image variant sharing this mask.
+    """
+    jobs = [ ]
+    output_bases = set() # Casefolded, output folders may be case-insensitive
+
+    for image_name in sorted(pair['images']):
+        # Keep outputs of a.png and a.jpg apart when both use a_mask.png, in the spelling of each image
+        image_base, extn_name = os.path.splitext(image_name)
+        output_base = base_name if len(pair['images']) == 1 else f'{image_base}_{extn_name[1:]}'
+
+        if output_base.casefold() in output_bases:
+            # Foo.png and foo.png on a case-sensitive share would overwrite each other's outputs
+            print(f'Skipping {image_name}, its outputs would only differ in case from another image of {base_name}')
+            continue
+
+        output_bases.add(output_base.casefold())
+        jobs.append((f'{dir_i}/{image_name}', f'{dir_i}/{pair["mask"]}', get_outputs(output_base, dir_o)))
+
+    return jobs
+
+def scan_jobs(dir_i, dir_o):
+    """
+    Index dir_i in a single pass and return the work list of image/mask pairs.
+    """
+    index = index_inputs(rel_path for rel_path, _ in scan_files(dir_i, recursive))
+
+    jobs = [ ]
+    orphan_images = orphan_masks = 0
+
+    for key in sorted(index):
+        pair = index[key]
+
+        if pair['mask'] is None:
+            orphan_images += len(pair['images'])
+        elif not pair['images']:
+            orphan_masks += 1
+        else:
+            jobs += get_pair_jobs(pair['name'], pair, dir_i, dir_o)
+
+    print(f'Found {len(jobs)} images with masks, {orphan_images} images without masks, {orphan_masks} masks without images.')
+
+    return jobs
+
+def hash_files(*paths):
+    digest = hashlib.blake2b(digest_size=16)
+
+    for path in paths:
+        with open(path, 'rb') as file:
+            while chunk := file.read(1 << 20):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+def is_output_up_to_date(outputs, input_mtime_ns):
+    for _, output_path in outputs:
+        try:
+            if os.stat(output_path).st_mtime_ns < input_mtime_ns:
+                return False
+        except FileNotFoundError:
+            return False
+
+    return True
+
+def watch_jobs(dir_i, dir_o):
+    """
+    Poll dir_i forever and yield a job whenever an image and its mask both exist.
+
+    Each poll is a single scandir pass which builds a name -> (mtime, size) index,
+    files are only looked at again when their entry changed. A changed file must
+    keep the same entry for one more poll before it is used, so that half-written
+    masks are not picked up. Pairs are deduplicated by content hash, and pairs whose
+    outputs are newer than both inputs are skipped, so restarting the daemon does
+    not redo finished work.
+    """
+    index = { }    # Relative path -> (mtime_ns, size) as of the previous poll
+    pending = set() # Paths which changed in the previous poll
+    seen_hashes = { } # Relative image path -> content key of its last queued pair
+
+    while True:
+        current = { }
+
+        for rel_path, entry in scan_files(dir_i, recursive):
+            stat = entry.stat()
+            current[rel_path] = (stat.st_mtime_ns, stat.st_size)
+
+        changed = { rel_path for rel_path, sig in current.items() if index.get(rel_path) != sig }
+        # Paths renamed or deleted since the previous poll are not settled, they are gone
+        settled = (pending - changed) & current.keys()
+
+        index = current
+        pending = changed
+
+        # Forget images which left the folder, so the map stays as small as the index
+        for rel_image in seen_hashes.keys() - current.keys():
+            del seen_hashes[rel_image]
+
+        if settled:
+            pairs = index_inputs(current)
+            keys = { base_name.casefold() for base_name, kind in map(split_input_name, settled) if kind is not None }
+
+            for key in sorted(keys):
+                pair = pairs[key]
+                base_name = pair['name']
+
+                if pair['mask'] is None or not pair['images']:
+                    continue # Wait for the other half of the pair
+
+                for source_path, mask_path, outputs in get_pair_jobs(base_name, pair, dir_i, dir_o):
+                    rel_image = source_path[len(dir_i) + 1:]
+
+                    if rel_image in pending or pair['mask'] in pending:
+                        continue # Still being written
+
+                    try:
+                        content_key = hash_files(source_path, mask_path)
+                    except OSError as e:
+                        print(f'Failed to read {source_path}: {e}')
+                        continue
+
+                    if seen_hashes.get(rel_image) == content_key:
+                        continue # Saved again without changes
+
+                    seen_hashes[rel_image] = content_key
+
+                    if is_output_up_to_date(outputs, max(current[rel_image][0], current[pair['mask']][0])):
+                        continue
+
+                    print(f'Processing [{base_name}]...')
+                    yield source_path, mask_path, outputs
+
+        time.sleep(watch_interval)
+
+class PipelineStats:
+    """
+    Item counts per stage and current/peak depth of the queues between stages.
+    """
+    def __init__(self, queues):
+        self.queues = queues
+        self.start_time = time.perf_counter()
+        self.done = { name: 0 for name in queues }
+        self.failed = { name: 0 for name in queues }
+        self.peak_depth = { name: 0 for name in queues }
+        self.last_reported = None
+
+    def sample(self):
+        for name, queue in self.queues.items():
+            self.peak_depth[name] = max(self.peak_depth[name], queue.qsize())
+
+    def report(self, force=False):
+        """
+        Print the stats, unless nothing changed since the last report (an idle watch daemon).
+        """
+        state = (dict(self.done), dict(self.failed), dict(self.peak_depth),
+                 [queue.qsize() for queue in self.queues.values()])
+        if state == self.last_reported and not force:
+            return
+        self.last_reported = state
+
+        elapsed = time.perf_counter() - self.start_time
+        depths = ', '.join(f'{name} {queue.qsize()}/{queue.maxsize} (peak {self.peak_depth[name]})'
+                           for name, queue in self.queues.items())
+        counts = ', '.join(f'{name} {self.done[name]} ok/{self.failed[name]} failed' for name in self.queues)
+
+        print(f'[{elapsed:.1f}s] Queues: {depths} | Stages: {counts}')
+
+async def run_stage(name, queue, stats, worker_count, handler):
+    """
+    Run worker_count consumers which pass every item of queue to handler.
+    """
+    async def consume():
+        while True:
+            item = await queue.get()
+            stats.sample()
+
+            try:
+                await handler(item)
+                stats.done[name] += 1
+            except Exception as e:
+                stats.failed[name] += 1
+                print(f'Stage {name} failed: {e!r}')
+            finally:
+                queue.task_done()
+
+    return [ asyncio.create_task(consume()) for _ in range(worker_count) ]
+
+async def run_pipeline(jobs):
+    """
+    Stream jobs through bounded queues: scan -> prepare (processes) -> dispatch -> write (threads).
+
+    A slow backend, resize or disk write only fills its input queue and applies
+    back pressure instead of stalling the other stages.
+    """
+    loop = asyncio.get_running_loop()
+
+    prep_queue     = asyncio.Queue(queue_size) # Scanned (source, mask, outputs)
+    dispatch_queue = asyncio.Queue(queue_size) # (prepared, seed, output_path)
+    write_queue    = asyncio.Queue(queue_size) # (prepared, result_data, output_path)
+
+    stats = PipelineStats({ 'prepare': prep_queue, 'dispatch': dispatch_queue, 'write': write_queue })
+
+    prep_pool = ProcessPoolExecutor(max_workers=prep_workers)
+    dispatch_pool = ThreadPoolExecutor(max_workers=dispatch_workers)
+    write_pool = ThreadPoolExecutor(max_workers=write_workers)
+
+    async def prepare(job):
+        source_path, mask_path, outputs = job
+        prepared = await loop.run_in_executor(prep_pool, prepare_inputs, source_path, mask_path)
+
+        if prepared is not None:
+            for seed, output_path in outputs:
+                await dispatch_queue.put((prepared, seed, output_path))
+
+    async def dispatch(item):
+        prepared, seed, output_path = item
+        payload = build_payload(prepared['image'], prepared['mask'], seed, prepared['width'], prepared['height'])
+        result_data = await loop.run_in_executor(dispatch_pool, post_img2img, payload)
+
+        if result_data is None:
+            raise RuntimeError(f'No result for {output_path}')
+
+        await write_queue.put((prepared, result_data, output_path))
+
+    async def write(item):
+        await loop.run_in_executor(write_pool, write_result, *item)
+
+    async def report():
+        while True:
+            await asyncio.sleep(stats_interval)
+            stats.report()
+
+    workers = await run_stage('prepare', prep_queue, stats, prep_workers, prepare)
+    workers += await run_stage('dispatch', dispatch_queue, stats, dispatch_workers, dispatch)
+    workers += await run_stage('write', write_queue, stats, write_workers, write)
+    workers.append(asyncio.create_task(report()))
+
+    try:
+        # Scanning touches the disk, so pull jobs from a thread as well
+        job_iter = iter(jobs)
+        while (job := await loop.run_in_executor(None, next, job_iter, None)) is not None:
+            await prep_queue.put(job)
+            stats.sample()
+
+        # Drain stage by stage, each one only receives items from the previous
+        await prep_queue.join()
+        await dispatch_queue.join()
+        await write_queue.join()
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+        prep_pool.shutdown()
+        dispatch_pool.shutdown()
+        write_pool.shutdown()
+
+    stats.report(force=True)
+
+if __name__ == '__main__':
+    os.makedirs(dir_o, exist_ok=True)
+
+    if watch_mode:
+        print(f'Watching {dir_i} for new masks...')
+        asyncio.run(run_pipeline(watch_jobs(dir_i, dir_o)))
+    else:
+        asyncio.run(run_pipeline(scan_jobs(dir_i, dir_o)))
@@ -94,11 +94,31 @@ class PositionEmbeddingSineHW(nn.Module):
         if scale is None:
             scale = 2 * math.pi
         self.scale = scale
+        # eval mode encodings of feature maps known to be unpadded, {(h, w, device): 1 x C x h x w}
+        self._pe_cache = {}
+
+    def _apply(self, fn, *args, **kwargs):
+        # .to() / .cuda() / .half(), cached encodings belong to the previous device
+        self._pe_cache.clear()
+        return super()._apply(fn, *args, **kwargs)
 
     def forward(self, tensor_list: NestedTensor):
-        x = tensor_list.tensors
         mask = tensor_list.mask
         assert mask is not None
+        # Padding comes from the caller (nested_tensor_from_tensor_list), reading the mask would sync
+        if self.training or tensor_list.padded is not False:
+            return self._compute_pos(mask)
+
+        # Without padding the encoding only depends on the feature map size
+        key = (mask.shape[-2], mask.shape[-1], mask.device)
+        if key not in self._pe_cache:
+            if len(self._pe_cache) >= 8:
+                self._pe_cache.clear()
+            with torch.inference_mode(False), torch.no_grad():
+                self._pe_cache[key] = self._compute_pos(mask[:1].clone())
+        return self._pe_cache[key].expand(mask.shape[0], -1, -1, -1)
+
+    def _compute_pos(self, mask):
         not_mask = ~mask
         y_embed = not_mask.cumsum(1, dtype=torch.float32)
         x_embed = not_mask.cumsum(2, dtype=torch.float32)
@@ -110,11 +130,11 @@ class PositionEmbeddingSineHW(nn.Module):
             y_embed = y_embed / (y_embed[:, -1:, :] + eps) * self.scale
             x_embed = x_embed / (x_embed[:, :, -1:] + eps) * self.scale
 
-        dim_tx = torch.arange(self.num_pos_feats, dtype=torch.float32, device=x.device)
+        dim_tx = torch.arange(self.num_pos_feats, dtype=torch.float32, device=mask.device)
         dim_tx = self.temperatureW ** (2 * (torch.div(dim_tx, 2, rounding_mode='floor')) / self.num_pos_feats)
         pos_x = x_embed[:, :, :, None] / dim_tx
 
-        dim_ty = torch.arange(self.num_pos_feats, dtype=torch.float32, device=x.device)
+        dim_ty = torch.arange(self.num_pos_feats, dtype=torch.float32, device=mask.device)
         dim_ty = self.temperatureH ** (2 * (torch.div(dim_ty, 2, rounding_mode='floor')) / self.num_pos_feats)
         pos_y = y_embed[:, :, :, None] / dim_ty
 
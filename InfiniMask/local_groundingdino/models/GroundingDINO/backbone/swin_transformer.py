@@ -16,10 +16,12 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.utils.checkpoint as checkpoint
-from timm.models.layers import DropPath, to_2tuple, trunc_normal_
+from torch.nn.init import trunc_normal_
 
 from local_groundingdino.util.misc import NestedTensor
 
+from ..utils import DropPath, to_2tuple
+
 
 class Mlp(nn.Module):
     """Multilayer perceptron."""
@@ -749,7 +751,7 @@ class SwinTransformer(nn.Module):
             m = tensor_list.mask
             assert m is not None
             mask = F.interpolate(m[None].float(), size=out_i.shape[-2:]).to(torch.bool)[0]
-            outs_dict[idx] = NestedTensor(out_i, mask)
+            outs_dict[idx] = NestedTensor(out_i, mask, tensor_list.padded)
 
         return outs_dict
 
@@ -7,7 +7,6 @@
 
 import torch
 from torch import nn
-from transformers.modeling_outputs import BaseModelOutputWithPoolingAndCrossAttentions
 
 
 class BertModelWarper(nn.Module):
@@ -152,6 +151,9 @@ class BertModelWarper(nn.Module):
         if not return_dict:
             return (sequence_output, pooled_output) + encoder_outputs[1:]
 
+        # already imported by the wrapped bert model, kept out of the module import
+        from transformers.modeling_outputs import BaseModelOutputWithPoolingAndCrossAttentions
+
         return BaseModelOutputWithPoolingAndCrossAttentions(
             last_hidden_state=sequence_output,
             pooler_output=pooled_output,
@@ -8,7 +8,8 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from timm.models.layers import DropPath
+
+from .utils import DropPath
 
 
 class FeatureResizer(nn.Module):
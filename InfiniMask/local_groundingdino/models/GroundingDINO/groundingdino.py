@@ -15,7 +15,7 @@
 # Copyright (c) 2020 SenseTime. All Rights Reserved.
 # ------------------------------------------------------------------------
 import copy
-from typing import List
+from typing import List, Optional
 
 import torch
 import torch.nn.functional as F
@@ -199,6 +199,19 @@ class GroundingDINO(nn.Module):
     def init_ref_points(self, use_num_queries):
         self.refpoint_embed = nn.Embedding(use_num_queries, self.query_dim)
 
+    def set_query_budget(self, num_queries: Optional[int] = None):
+        """Decode only the top num_queries encoder proposals at inference, None decodes all of them."""
+        if num_queries is not None and num_queries <= 0:
+            raise ValueError("num_queries must be positive, got {}".format(num_queries))
+        self.transformer.num_select_queries = num_queries
+
+    def set_early_exit(self, max_layers: Optional[int] = None, converge_threshold: Optional[float] = None):
+        """Stop decoding early at inference, the heads of the last decoded layer give the outputs.
+
+        See TransformerDecoder.set_early_exit, both None (the default) runs every decoder layer.
+        """
+        self.transformer.decoder.set_early_exit(max_layers, converge_threshold)
+
     def forward(self, samples: NestedTensor, targets: List = None, **kw):
         """The forward expects a NestedTensor, which consists of:
            - samples.tensor: batched images, of shape [batch_size x 3 x H x W]
@@ -218,12 +231,19 @@ class GroundingDINO(nn.Module):
             captions = kw["captions"]
         else:
             captions = [t["caption"] for t in targets]
-        len(captions)
 
+        if isinstance(samples, (list, torch.Tensor)):
+            samples = nested_tensor_from_tensor_list(samples)
+
+        text_dict = self.encode_text(captions, samples.device)
+        srcs, masks, poss = self.encode_image(samples)
+
+        return self.forward_features(srcs, masks, poss, text_dict)
+
+    def encode_text(self, captions: List[str], device) -> dict:
+        """Tokenize and encode captions with BERT, returns the text_dict consumed by the transformer."""
         # encoder texts
-        tokenized = self.tokenizer(captions, padding="longest", return_tensors="pt").to(
-            samples.device
-        )
+        tokenized = self.tokenizer(captions, padding="longest", return_tensors="pt").to(device)
         (
             text_self_attention_masks,
             position_ids,
@@ -272,10 +292,10 @@ class GroundingDINO(nn.Module):
             "text_self_attention_masks": text_self_attention_masks,  # bs, 195,195
         }
 
-        # import ipdb; ipdb.set_trace()
+        return text_dict
 
-        if isinstance(samples, (list, torch.Tensor)):
-            samples = nested_tensor_from_tensor_list(samples)
+    def encode_image(self, samples: NestedTensor):
+        """Run the backbone and input projections, returns per-level (srcs, masks, poss)."""
         features, poss = self.backbone(samples)
 
         srcs = []
@@ -294,20 +314,32 @@ class GroundingDINO(nn.Module):
                     src = self.input_proj[l](srcs[-1])
                 m = samples.mask
                 mask = F.interpolate(m[None].float(), size=src.shape[-2:]).to(torch.bool)[0]
-                pos_l = self.backbone[1](NestedTensor(src, mask)).to(src.dtype)
+                pos_l = self.backbone[1](NestedTensor(src, mask, samples.padded)).to(src.dtype)
                 srcs.append(src)
                 masks.append(mask)
                 poss.append(pos_l)
 
+        return srcs, masks, poss
+
+    def forward_features(self, srcs, masks, poss, text_dict):
+        """Run the transformer and prediction heads on encoded image and text features."""
         input_query_bbox = input_query_label = attn_mask = dn_meta = None
         hs, reference, hs_enc, ref_enc, init_box_proposal = self.transformer(
             srcs, masks, input_query_bbox, poss, input_query_label, attn_mask, text_dict
         )
 
+        if not self.training:
+            # only the heads of the last decoded layer are used, skip the auxiliary ones
+            last = len(hs) - 1
+            hs, reference = hs[last:], reference[last:]
+            bbox_embed, class_embed = self.bbox_embed[last:], self.class_embed[last:]
+        else:
+            bbox_embed, class_embed = self.bbox_embed, self.class_embed
+
         # deformable-detr-like anchor update
         outputs_coord_list = []
         for dec_lid, (layer_ref_sig, layer_bbox_embed, layer_hs) in enumerate(
-            zip(reference[:-1], self.bbox_embed, hs)
+            zip(reference[:-1], bbox_embed, hs)
         ):
             layer_delta_unsig = layer_bbox_embed(layer_hs)
             layer_outputs_unsig = layer_delta_unsig + inverse_sigmoid(layer_ref_sig)
@@ -319,7 +351,7 @@ class GroundingDINO(nn.Module):
         outputs_class = torch.stack(
             [
                 layer_cls_embed(layer_hs, text_dict)
-                for layer_cls_embed, layer_hs in zip(self.class_embed, hs)
+                for layer_cls_embed, layer_hs in zip(class_embed, hs)
             ]
         )
         out = {"pred_logits": outputs_class[-1], "pred_boxes": outputs_coord_list[-1]}
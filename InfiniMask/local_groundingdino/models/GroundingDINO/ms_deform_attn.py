@@ -74,6 +74,118 @@ def multi_scale_deformable_attn_pytorch(
     return output.transpose(1, 2).contiguous()
 
 
+def multi_scale_deformable_attn_sparse(
+    value: torch.Tensor,
+    value_spatial_shapes: torch.Tensor,
+    sampling_locations: torch.Tensor,
+    attention_weights: torch.Tensor,
+) -> torch.Tensor:
+    """Sparse matmul equivalent of multi_scale_deformable_attn_pytorch for inference.
+
+    The bilinear corner weights of every sampling point (same convention as
+    grid_sample with align_corners=False and zero padding) are folded with the
+    attention weights into one CSR matrix of shape
+    (bs * num_heads * num_queries, bs * num_heads * num_value), so all levels
+    are sampled and reduced by a single sparse-dense matmul, without the
+    per-level grid_sample outputs and their stacked copy.
+    """
+    bs, num_value, num_heads, embed_dims = value.shape
+    _, num_queries, num_heads, num_levels, num_points, _ = sampling_locations.shape
+    device = sampling_locations.device
+
+    spatial_shapes = value_spatial_shapes.to(device=device, dtype=torch.int32)
+    heights = spatial_shapes[:, 0].view(num_levels, 1)
+    widths = spatial_shapes[:, 1].view(num_levels, 1)
+    level_start = torch.cat(
+        (spatial_shapes.new_zeros((1,)), spatial_shapes.prod(1).cumsum(0)[:-1].int())
+    ).view(num_levels, 1)
+
+    # Heads first, (bs, num_heads, num_queries, num_levels, num_points)
+    sampling_locations = sampling_locations.transpose(1, 2)
+    attention_weights = attention_weights.transpose(1, 2)
+
+    # Pixel coordinates of the top left corner and the bilinear fractions
+    x = sampling_locations[..., 0] * widths - 0.5
+    y = sampling_locations[..., 1] * heights - 0.5
+    x0 = x.floor()
+    y0 = y.floor()
+    fx = x - x0
+    fy = y - y0
+    x0 = x0.int()
+    y0 = y0.int()
+
+    # Per axis weights, zeroed where the corner falls outside the feature map
+    wx0 = (1 - fx) * ((x0 >= 0) & (x0 < widths))
+    wx1 = fx * ((x0 >= -1) & (x0 < widths - 1))
+    wy0 = attention_weights * (1 - fy) * ((y0 >= 0) & (y0 < heights))
+    wy1 = attention_weights * fy * ((y0 >= -1) & (y0 < heights - 1))
+
+    # Rows into the flattened (bs * num_heads * num_value, embed_dims) value
+    head_start = torch.arange(bs * num_heads, device=device, dtype=torch.int32) * num_value
+    base = level_start + head_start.view(bs, num_heads, 1, 1, 1)
+    row0 = base + y0.clamp(min=0).minimum(heights - 1) * widths
+    row1 = base + (y0 + 1).clamp(min=0).minimum(heights - 1) * widths
+    x1 = (x0 + 1).clamp(min=0).minimum(widths - 1)
+    x0 = x0.clamp(min=0).minimum(widths - 1)
+
+    weights = torch.stack((wx0 * wy0, wx1 * wy0, wx0 * wy1, wx1 * wy1), dim=-1)
+    index = torch.stack((row0 + x0, row0 + x1, row1 + x0, row1 + x1), dim=-1)
+
+    num_rows = bs * num_heads * num_queries
+    num_samples = num_levels * num_points * 4
+    crow = torch.arange(
+        0, num_rows * num_samples + 1, num_samples, device=device, dtype=torch.int32
+    )
+    with warnings.catch_warnings():
+        # Sparse CSR support is flagged as beta
+        warnings.simplefilter("ignore", UserWarning)
+        matrix = torch.sparse_csr_tensor(
+            crow,
+            index.reshape(-1),
+            weights.reshape(-1).to(value.dtype),
+            size=(num_rows, bs * num_heads * num_value),
+        )
+    value = value.transpose(1, 2).reshape(bs * num_heads * num_value, embed_dims)
+    output = matrix @ value
+
+    # bs*num_heads*num_queries, embed_dims -> bs, num_queries, num_heads*embed_dims
+    return (
+        output.view(bs, num_heads, num_queries, embed_dims)
+        .transpose(1, 2)
+        .reshape(bs, num_queries, num_heads * embed_dims)
+    )
+
+
+MS_DEFORM_ATTN_IMPLS = {
+    "pytorch": multi_scale_deformable_attn_pytorch,
+    "sparse": multi_scale_deformable_attn_sparse,
+}
+
+# "auto" uses the sparse kernel for CPU inference and the reference one otherwise
+_ms_deform_attn_impl = "auto"
+
+
+def set_ms_deform_attn_impl(name: str):
+    """Select the deformable attention implementation used by all modules, "auto" or a key of MS_DEFORM_ATTN_IMPLS."""
+    global _ms_deform_attn_impl
+    if name != "auto" and name not in MS_DEFORM_ATTN_IMPLS:
+        raise ValueError(
+            "unknown deformable attention implementation {}, expected auto or one of {}".format(
+                name, list(MS_DEFORM_ATTN_IMPLS)
+            )
+        )
+    _ms_deform_attn_impl = name
+
+
+def get_ms_deform_attn_impl(value: torch.Tensor):
+    """Resolve the selected implementation for a value tensor."""
+    if _ms_deform_attn_impl != "auto":
+        return MS_DEFORM_ATTN_IMPLS[_ms_deform_attn_impl]
+    if value.device.type == "cpu" and not (torch.is_grad_enabled() and value.requires_grad):
+        return multi_scale_deformable_attn_sparse
+    return multi_scale_deformable_attn_pytorch
+
+
 class MultiScaleDeformableAttention(nn.Module):
     """Multi-Scale Deformable Attention Module used in Deformable-DETR
 
@@ -268,7 +380,7 @@ class MultiScaleDeformableAttention(nn.Module):
                 )
             )
 
-        output = multi_scale_deformable_attn_pytorch(
+        output = get_ms_deform_attn_impl(value)(
             value, spatial_shapes, sampling_locations, attention_weights
         )
 
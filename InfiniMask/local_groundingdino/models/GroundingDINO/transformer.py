@@ -147,6 +147,8 @@ class Transformer(nn.Module):
         self.nhead = nhead
         self.dec_layers = num_decoder_layers
         self.num_queries = num_queries  # useful for single stage model only
+        # inference-time cap on the decoded two stage proposals, None decodes all num_queries
+        self.num_select_queries = None
         self.num_patterns = num_patterns
         if not isinstance(num_patterns, int):
             Warning("num_patterns should be int but {}".format(type(num_patterns)))
@@ -297,6 +299,8 @@ class Transformer(nn.Module):
                 self.enc_out_bbox_embed(output_memory) + output_proposals
             )  # (bs, \sum{hw}, 4) unsigmoid
             topk = self.num_queries
+            if self.num_select_queries is not None:
+                topk = min(topk, self.num_select_queries, topk_logits.shape[1])
 
             topk_proposals = torch.topk(topk_logits, topk, dim=1)[1]  # bs, nq
 
@@ -315,7 +319,7 @@ class Transformer(nn.Module):
             )
             if self.embed_init_tgt:
                 tgt_ = (
-                    self.tgt_embed.weight[:, None, :].repeat(1, bs, 1).transpose(0, 1)
+                    self.tgt_embed.weight[:topk, None, :].repeat(1, bs, 1).transpose(0, 1)
                 )  # nq, bs, d_model
             else:
                 tgt_ = tgt_undetach.detach()
@@ -630,6 +634,19 @@ class TransformerDecoder(nn.Module):
 
         self.ref_anchor_head = None
 
+        # inference-time early exit, see set_early_exit
+        self.max_layers = None
+        self.converge_threshold = None
+
+    def set_early_exit(self, max_layers: Optional[int] = None, converge_threshold: Optional[float] = None):
+        """Stop decoding after max_layers layers, or once no reference box coordinate moves by more
+        than converge_threshold in a layer (requires the iterative box refinement of bbox_embed).
+        None disables the respective check."""
+        if max_layers is not None and max_layers <= 0:
+            raise ValueError("max_layers must be positive, got {}".format(max_layers))
+        self.max_layers = max_layers
+        self.converge_threshold = converge_threshold
+
     def forward(
         self,
         tgt,
@@ -723,12 +740,21 @@ class TransformerDecoder(nn.Module):
                 outputs_unsig = delta_unsig + reference_before_sigmoid
                 new_reference_points = outputs_unsig.sigmoid()
 
+                converged = (
+                    self.converge_threshold is not None
+                    and (new_reference_points - reference_points).abs().max() < self.converge_threshold
+                )
                 reference_points = new_reference_points.detach()
                 # if layer_id != self.num_layers - 1:
                 ref_points.append(new_reference_points)
+            else:
+                converged = False
 
             intermediate.append(self.norm(output))
 
+            if converged or (self.max_layers is not None and layer_id + 1 >= self.max_layers):
+                break
+
         return [
             [itm_out.transpose(0, 1) for itm_out in intermediate],
             [itm_refpoint.transpose(0, 1) for itm_refpoint in ref_points],
@@ -13,6 +13,31 @@ import torch.nn.functional as F
 from torch import Tensor, nn
 
 
+class DropPath(nn.Module):
+    """Stochastic depth, same as timm.layers.DropPath without importing timm (about 0.75s)."""
+
+    def __init__(self, drop_prob=0.0, scale_by_keep=True):
+        super().__init__()
+        self.drop_prob = drop_prob
+        self.scale_by_keep = scale_by_keep
+
+    def forward(self, x):
+        if self.drop_prob == 0.0 or not self.training:
+            return x
+        keep_prob = 1 - self.drop_prob
+        shape = (x.shape[0],) + (1,) * (x.ndim - 1)
+        random_tensor = x.new_empty(shape).bernoulli_(keep_prob)
+        if keep_prob > 0.0 and self.scale_by_keep:
+            random_tensor.div_(keep_prob)
+        return x * random_tensor
+
+
+def to_2tuple(x):
+    if isinstance(x, (list, tuple)):
+        return tuple(x)
+    return (x, x)
+
+
 def _get_clones(module, N, layer_share=False):
     # import ipdb; ipdb.set_trace()
     if layer_share:
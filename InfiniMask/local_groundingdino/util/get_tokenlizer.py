@@ -1,6 +1,100 @@
-from transformers import AutoTokenizer, BertModel, BertTokenizer, RobertaModel, RobertaTokenizerFast
+import argparse
 import os
 
+# transformers is imported in the functions below, it takes about a second and is only needed to build the model
+
+# Local copies of the text encoder assets, one directory per text_encoder_type (see export_text_encoder).
+# Relative to the working directory, the servers run from the InfiniMask folder next to models/.
+TEXT_ENCODER_DIR = os.environ.get("GROUNDINGDINO_TEXT_ENCODER_DIR", "models/text-encoders")
+
+
+def get_local_text_encoder_dir(text_encoder_type):
+    return os.path.join(TEXT_ENCODER_DIR, text_encoder_type.replace("/", "--"))
+
+
+def is_exported(path):
+    # tokenizer.json is the serialized fast tokenizer, loading it skips the vocab.txt conversion
+    return all(
+        os.path.isfile(os.path.join(path, name))
+        for name in ("config.json", "tokenizer.json", "model.safetensors")
+    )
+
+
+def load_hub_text_encoder(text_encoder_type, local_files_only=False):
+    """
+    Returns (fast tokenizer, model) of a hub text encoder, from the Hugging Face cache only
+    with local_files_only. OSError or ValueError when it is not available.
+    """
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        text_encoder_type, use_fast=True, local_files_only=local_files_only
+    )
+    model = get_model_class(text_encoder_type).from_pretrained(
+        text_encoder_type, local_files_only=local_files_only
+    )
+    return tokenizer, model
+
+
+def save_text_encoder(text_encoder_type, tokenizer, model):
+    path = get_local_text_encoder_dir(text_encoder_type)
+    tokenizer.save_pretrained(path)
+    model.save_pretrained(path, safe_serialization=True)
+    print("exported {} to {}".format(text_encoder_type, path))
+    return path
+
+
+def export_text_encoder(text_encoder_type, local_files_only=False):
+    """
+    Save the fast tokenizer and the weights (safetensors) of a hub text encoder into
+    TEXT_ENCODER_DIR, returns the directory. Run once on a machine with the model in the
+    Hugging Face cache or with network access, then copy the directory to offline servers.
+    """
+    return save_text_encoder(
+        text_encoder_type, *load_hub_text_encoder(text_encoder_type, local_files_only)
+    )
+
+
+def resolve_text_encoder(text_encoder_type):
+    """
+    Returns (path or hub name, local_files_only) to load text_encoder_type from, without network access
+    whenever possible: a directory as is, else the exported copy in TEXT_ENCODER_DIR, else the Hugging
+    Face cache, which is then exported for the next start. Only a model that is nowhere local is downloaded.
+    """
+    if os.path.isdir(text_encoder_type):
+        return text_encoder_type, True
+
+    path = get_local_text_encoder_dir(text_encoder_type)
+    if is_exported(path):
+        return path, True
+
+    try:
+        assets = load_hub_text_encoder(text_encoder_type, local_files_only=True)
+    except (OSError, ValueError) as e:
+        print("{} is not cached locally ({}), downloading it".format(text_encoder_type, e))
+        try:
+            assets = load_hub_text_encoder(text_encoder_type)
+        except (OSError, ValueError) as e:
+            print("could not download {}: {}".format(text_encoder_type, e))
+            return text_encoder_type, False
+
+    # The model is in the Hugging Face cache now, a failed export (e.g. read-only models
+    # directory) only means it is loaded from there, still without network access
+    try:
+        return save_text_encoder(text_encoder_type, *assets), True
+    except OSError as e:
+        print("could not export {}: {}".format(text_encoder_type, e))
+        return text_encoder_type, True
+
+
+def get_model_class(text_encoder_type):
+    from transformers import BertModel, RobertaModel
+
+    if text_encoder_type == "roberta-base":
+        return RobertaModel
+    return BertModel
+
+
 def get_tokenlizer(text_encoder_type):
     if not isinstance(text_encoder_type, str):
         # print("text_encoder_type is not a str")
@@ -16,14 +110,30 @@ def get_tokenlizer(text_encoder_type):
             )
     print("final text_encoder_type: {}".format(text_encoder_type))
 
-    tokenizer = AutoTokenizer.from_pretrained(text_encoder_type)
+    from transformers import AutoTokenizer
+
+    path, local_files_only = resolve_text_encoder(text_encoder_type)
+    tokenizer = AutoTokenizer.from_pretrained(path, use_fast=True, local_files_only=local_files_only)
     return tokenizer
 
 
 def get_pretrained_language_model(text_encoder_type):
-    if text_encoder_type == "bert-base-uncased" or (os.path.isdir(text_encoder_type) and os.path.exists(text_encoder_type)):
-        return BertModel.from_pretrained(text_encoder_type)
-    if text_encoder_type == "roberta-base":
-        return RobertaModel.from_pretrained(text_encoder_type)
+    if text_encoder_type in ("bert-base-uncased", "roberta-base") or (
+        os.path.isdir(text_encoder_type) and os.path.exists(text_encoder_type)
+    ):
+        path, local_files_only = resolve_text_encoder(text_encoder_type)
+        return get_model_class(text_encoder_type).from_pretrained(
+            path, local_files_only=local_files_only
+        )
 
     raise ValueError("Unknown text_encoder_type {}".format(text_encoder_type))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export text encoders for offline loading")
+    parser.add_argument("text_encoder_type", nargs="+", help="e.g. bert-base-uncased")
+    parser.add_argument("--local-files-only", action="store_true", help="only use the Hugging Face cache")
+    args = parser.parse_args()
+
+    for name in args.text_encoder_type:
+        export_text_encoder(name, local_files_only=args.local_files_only)
@@ -1,17 +1,24 @@
-from typing import Tuple, List
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Tuple, List, Union
 
-import cv2
 import numpy as np
-import supervision as sv
 import torch
 from PIL import Image, ImageFile
 from torchvision.ops import box_convert
 
 import local_groundingdino.datasets.transforms as T
 from local_groundingdino.models import build_model
-from local_groundingdino.util.misc import clean_state_dict
+from local_groundingdino.models.GroundingDINO.bertwarper import generate_masks_with_special_tokens_and_transfer_map
+from local_groundingdino.util.misc import clean_state_dict, nested_tensor_from_tensor_list
 from local_groundingdino.util.slconfig import SLConfig
-from local_groundingdino.util.utils import get_phrases_from_posmap
+from local_groundingdino.util.utils import CaptionPhrases
+from checkpoint_cache import load_checkpoint
+from model_prep import prepare_for_inference
+
+# cv2 and supervision are only needed by annotate and the Model API, they are imported on use
+if TYPE_CHECKING:
+    import supervision as sv
 
 # ----------------------------------------------------------------------------------------------------------------------
 # OLD API
@@ -25,23 +32,31 @@ def preprocess_caption(caption: str) -> str:
     return result + "."
 
 
-def load_model(model_config_path: str, model_checkpoint_path: str, device: str = "cuda"):
+def load_model(model_config_path: str, model_checkpoint_path: str, device: str = "cuda", prepare: bool = True):
     args = SLConfig.fromfile(model_config_path)
     args.device = device
     model = build_model(args)
-    checkpoint = torch.load(model_checkpoint_path, map_location="cpu")
-    model.load_state_dict(clean_state_dict(checkpoint["model"]), strict=False)
+    # mapped from the safetensors cache next to the checkpoint, assign keeps the weights shared
+    state_dict = load_checkpoint(model_checkpoint_path, key="model", transform=clean_state_dict)
+    model.load_state_dict(state_dict, strict=False, assign=True)
     model.eval()
+    if prepare:
+        # fold norms and drop dropout for inference
+        prepare_for_inference(model)
     return model
 
 
-def load_image(image_path: str) -> Tuple[np.array, torch.Tensor]:
-    return load_image_pil(Image.open(image_path))
+def load_image(image_path: str, size: int = 800, max_size: int = 1333) -> Tuple[np.array, torch.Tensor]:
+    return load_image_pil(Image.open(image_path), size=size, max_size=max_size)
 
-def load_image_pil(image_pil: ImageFile) -> Tuple[np.array, torch.Tensor]:
+def load_image_pil(image_pil: ImageFile, size: int = 800, max_size: int = 1333) -> Tuple[np.array, torch.Tensor]:
+    """
+    Returns the RGB image as an array and the normalized tensor for the model, resized so that
+    the shorter side is `size` and the longer side at most `max_size` (800 / 1333 in training).
+    """
     transform = T.Compose(
         [
-            T.RandomResize([800], max_size=1333),
+            T.RandomResize([size], max_size=max_size),
             T.ToTensor(),
             T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
         ]
@@ -71,23 +86,179 @@ def predict(
     prediction_logits = outputs["pred_logits"].cpu().sigmoid()[0]  # prediction_logits.shape = (nq, 256)
     prediction_boxes = outputs["pred_boxes"].cpu()[0]  # prediction_boxes.shape = (nq, 4)
 
+    return postprocess_prediction(
+        model.tokenizer, prediction_logits, prediction_boxes, caption, box_threshold, text_threshold)
+
+
+def postprocess_prediction(
+        tokenizer,
+        prediction_logits: torch.Tensor,
+        prediction_boxes: torch.Tensor,
+        caption: str,
+        box_threshold: float,
+        text_threshold: float
+) -> Tuple[torch.Tensor, torch.Tensor, List[str]]:
     mask = prediction_logits.max(dim=1)[0] > box_threshold
     logits = prediction_logits[mask]  # logits.shape = (n, 256)
     boxes = prediction_boxes[mask]  # boxes.shape = (n, 4)
 
-    tokenizer = model.tokenizer
-    tokenized = tokenizer(caption)
-
     phrases = [
-        get_phrases_from_posmap(logit > text_threshold, tokenized, tokenizer).replace('.', '')
-        for logit
-        in logits
+        phrase.replace('.', '')
+        for phrase
+        in get_caption_phrases(tokenizer, caption).get_phrases(logits > text_threshold, tokenizer)
     ]
 
     return boxes, logits.max(dim=1)[0], phrases
 
 
+_caption_phrases = OrderedDict()  # caption -> CaptionPhrases, least recently used first
+_caption_phrases_lock = threading.Lock()  # The mask server handles requests in threads
+
+
+def get_caption_phrases(tokenizer, caption: str, max_captions: int = 128) -> CaptionPhrases:
+    """
+    Token ids and decoded phrases of a caption, tokenized once and kept for the next calls.
+    """
+    tokenizer_name = getattr(tokenizer, "name_or_path", None)
+
+    with _caption_phrases_lock:
+        caption_phrases = _caption_phrases.get(caption)
+
+        if caption_phrases is None or caption_phrases.tokenizer_name != tokenizer_name:
+            caption_phrases = CaptionPhrases(tokenizer(caption)["input_ids"], tokenizer_name)
+            _caption_phrases[caption] = caption_phrases
+            if len(_caption_phrases) > max_captions:
+                _caption_phrases.popitem(last=False)
+
+        _caption_phrases.move_to_end(caption)
+        return caption_phrases
+
+
+def predict_batch(
+        model,
+        images: List[torch.Tensor],
+        captions: Union[str, List[str]],
+        box_threshold: float,
+        text_threshold: float,
+        device: str = "cuda",
+        batch_size: int = 4
+) -> List[Tuple[torch.Tensor, torch.Tensor, List[str]]]:
+    """
+    Batched version of predict, returns (boxes, logits, phrases) for each image in input order.
+
+    Images may have different sizes. They are grouped into batches of similar aspect
+    ratio, padded to the largest shape of their batch (with a padding mask, so boxes
+    stay normalized to each image) and run through a single forward per batch.
+    `captions` is either one caption for all images or one caption per image.
+    """
+    if isinstance(captions, str):
+        captions = [captions] * len(images)
+    assert len(captions) == len(images), "need one caption per image"
+
+    captions = [preprocess_caption(caption=caption) for caption in captions]
+    model = model.to(device)
+
+    # Sort by aspect ratio, so that neighbours (which share a batch) need little padding
+    order = sorted(range(len(images)), key=lambda i: images[i].shape[1] / images[i].shape[2])
+    results = [None] * len(images)
+
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        samples = nested_tensor_from_tensor_list([images[i].to(device) for i in indices])
+
+        with torch.no_grad():
+            outputs = model(samples, captions=[captions[i] for i in indices])
+
+        prediction_logits = outputs["pred_logits"].cpu().sigmoid()  # prediction_logits.shape = (bs, nq, 256)
+        prediction_boxes = outputs["pred_boxes"].cpu()  # prediction_boxes.shape = (bs, nq, 4)
+
+        for batch_index, image_index in enumerate(indices):
+            results[image_index] = postprocess_prediction(
+                model.tokenizer, prediction_logits[batch_index], prediction_boxes[batch_index],
+                captions[image_index], box_threshold, text_threshold)
+
+    return results
+
+
+def predict_captions(
+        model,
+        image: torch.Tensor,
+        captions: List[str],
+        box_threshold: float,
+        device: str = "cuda",
+        mode: str = "concat"
+) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Detect several captions in one image, returns (boxes, logits) for each caption in order.
+
+    mode="concat" joins the captions into "a . b . c ." and runs a single forward.
+    Each caption owns the tokens between its separators (the text encoder attends
+    within those spans only), so a box is scored against a caption by the max logit
+    over that caption's tokens. A box may belong to several captions.
+
+    mode="expand" runs the backbone once, then expands the image features along
+    the batch dimension and runs the transformer for all captions as one batch.
+    Slower than concat, but captions cannot influence each other.
+    """
+    # Separators inside a caption would split it into several phrases
+    captions = [caption.replace(".", " ").replace("?", " ").strip() for caption in captions]
+    assert all(captions), "captions must not be empty"
+
+    model = model.to(device)
+    image = image.to(device)
+
+    if mode == "concat":
+        caption = preprocess_caption(caption=" . ".join(captions))
+
+        with torch.no_grad():
+            outputs = model(image[None], captions=[caption])
+
+        prediction_logits = outputs["pred_logits"].cpu().sigmoid()[0]  # prediction_logits.shape = (nq, 256)
+        prediction_boxes = outputs["pred_boxes"].cpu()[0]  # prediction_boxes.shape = (nq, 4)
+
+        tokenized = model.tokenizer([caption], return_tensors="pt")
+        _, _, cate_to_token_mask_list = generate_masks_with_special_tokens_and_transfer_map(
+            tokenized, model.specical_tokens, model.tokenizer)
+
+        token_masks = cate_to_token_mask_list[0][:, :prediction_logits.shape[1]]  # token_masks.shape = (k, num_token)
+        token_masks = torch.nn.functional.pad(token_masks, (0, prediction_logits.shape[1] - token_masks.shape[1]))
+
+        # caption_scores.shape = (nq, k)
+        caption_scores = torch.where(token_masks[None], prediction_logits[:, None, :], 0).max(dim=2)[0]
+        caption_boxes = [prediction_boxes] * len(captions)
+    elif mode == "expand":
+        batch = len(captions)
+
+        with torch.no_grad():
+            samples = nested_tensor_from_tensor_list(image[None])
+            srcs, masks, poss = model.encode_image(samples)
+
+            srcs = [src.expand(batch, -1, -1, -1) for src in srcs]
+            masks = [mask.expand(batch, -1, -1) for mask in masks]
+            poss = [pos.expand(batch, -1, -1, -1) for pos in poss]
+
+            text_dict = model.encode_text([preprocess_caption(caption=caption) for caption in captions], image.device)
+            outputs = model.forward_features(srcs, masks, poss, text_dict)
+
+        # caption_scores.shape = (nq, k)
+        caption_scores = outputs["pred_logits"].cpu().sigmoid().max(dim=2)[0].T
+        caption_boxes = list(outputs["pred_boxes"].cpu())
+    else:
+        raise ValueError(f"unknown mode {mode}")
+
+    results = []
+    for caption_index, boxes in enumerate(caption_boxes):
+        scores = caption_scores[:, caption_index]
+        mask = scores > box_threshold
+        results.append((boxes[mask], scores[mask]))
+
+    return results
+
+
 def annotate(image_source: np.ndarray, boxes: torch.Tensor, logits: torch.Tensor, phrases: List[str]) -> np.ndarray:
+    import cv2
+    import supervision as sv
+
     h, w, _ = image_source.shape
     boxes = boxes * torch.Tensor([w, h, w, h])
     xyxy = box_convert(boxes=boxes, in_fmt="cxcywh", out_fmt="xyxy").numpy()
@@ -131,7 +302,7 @@ class Model:
         caption: str,
         box_threshold: float = 0.35,
         text_threshold: float = 0.25
-    ) -> Tuple[sv.Detections, List[str]]:
+    ) -> Tuple["sv.Detections", List[str]]:
         """
         import cv2
 
@@ -172,7 +343,7 @@ class Model:
         classes: List[str],
         box_threshold: float,
         text_threshold: float
-    ) -> sv.Detections:
+    ) -> "sv.Detections":
         """
         import cv2
 
@@ -213,6 +384,8 @@ class Model:
 
     @staticmethod
     def preprocess_image(image_bgr: np.ndarray) -> torch.Tensor:
+        import cv2
+
         transform = T.Compose(
             [
                 T.RandomResize([800], max_size=1333),
@@ -230,7 +403,9 @@ class Model:
             source_w: int,
             boxes: torch.Tensor,
             logits: torch.Tensor
-    ) -> sv.Detections:
+    ) -> "sv.Detections":
+        import supervision as sv
+
         boxes = boxes * torch.Tensor([source_w, source_h, source_w, source_h])
         xyxy = box_convert(boxes=boxes, in_fmt="cxcywh", out_fmt="xyxy").numpy()
         confidence = logits.numpy()
@@ -397,9 +397,11 @@ def _max_by_axis(the_list):
 
 
 class NestedTensor(object):
-    def __init__(self, tensors, mask: Optional[Tensor]):
+    def __init__(self, tensors, mask: Optional[Tensor], padded: Optional[bool] = None):
         self.tensors = tensors
         self.mask = mask
+        # Whether mask has padding, None if unknown (answering it would read the mask on the host)
+        self.padded = padded
         if mask == "auto":
             self.mask = torch.zeros_like(tensors).to(tensors.device)
             if self.mask.dim() == 3:
@@ -431,7 +433,7 @@ class NestedTensor(object):
             cast_mask = mask.to(device)
         else:
             cast_mask = None
-        return NestedTensor(cast_tensor, cast_mask)
+        return NestedTensor(cast_tensor, cast_mask, self.padded)
 
     def to_img_list_single(self, tensor, mask):
         assert tensor.dim() == 3, "dim of tensor should be 3 but {}".format(tensor.dim())
@@ -491,9 +493,10 @@ def nested_tensor_from_tensor_list(tensor_list: List[Tensor]):
         for img, pad_img, m in zip(tensor_list, tensor, mask):
             pad_img[: img.shape[0], : img.shape[1], : img.shape[2]].copy_(img)
             m[: img.shape[1], : img.shape[2]] = False
+        padded = any(list(img.shape) != max_size for img in tensor_list)
     else:
         raise ValueError("not supported")
-    return NestedTensor(tensor, mask)
+    return NestedTensor(tensor, mask, padded)
 
 
 # _onnx_nested_tensor_from_tensor_list() is an implementation of
@@ -2,13 +2,12 @@
 # Modified from mmcv
 # ==========================================================
 import ast
+import hashlib
+import json
 import os
 import os.path as osp
-import shutil
-import sys
-import tempfile
+import threading
 from argparse import Action
-from importlib import import_module
 
 from addict import Dict
 from yapf.yapflib.yapf_api import FormatCode
@@ -16,6 +15,7 @@ from yapf.yapflib.yapf_api import FormatCode
 BASE_KEY = "_base_"
 DELETE_KEY = "_delete_"
 RESERVED_KEYS = ["filename", "text", "pretty_text", "get", "dump", "merge_from_dict"]
+CACHE_VERSION = 1
 
 
 def check_file_exist(filename, msg_tmpl='file "{}" does not exist'):
@@ -74,28 +74,54 @@ class SLConfig(object):
             raise SyntaxError("There are syntax errors in config " f"file {filename}")
 
     @staticmethod
-    def _file2dict(filename):
+    def _parse_pure_data(content):
+        """Returns the values of a config made only of `name = <literal>` assignments, else None."""
+        try:
+            tree = ast.parse(content)
+        except SyntaxError:
+            return None
+        cfg_dict = {}
+        for node in tree.body:
+            if (
+                isinstance(node, ast.Expr)
+                and isinstance(node.value, ast.Constant)
+                and isinstance(node.value.value, str)
+            ):
+                continue  # docstring
+            if not isinstance(node, ast.Assign) or not all(
+                isinstance(target, ast.Name) for target in node.targets
+            ):
+                return None
+            try:
+                value = ast.literal_eval(node.value)
+            except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                return None
+            for target in node.targets:
+                if not target.id.startswith("__"):
+                    cfg_dict[target.id] = value
+        return cfg_dict
+
+    @staticmethod
+    def _exec_py_config(filename, content):
+        # executed in a fresh namespace instead of importing a temp copy, so sys.path and
+        # sys.modules are left alone and configs can be loaded from several threads
+        namespace = {"__file__": filename, "__name__": "slconfig"}
+        exec(compile(content, filename, "exec"), namespace)
+        return {name: value for name, value in namespace.items() if not name.startswith("__")}
+
+    @staticmethod
+    def _file2dict(filename, loaded_files=None):
         filename = osp.abspath(osp.expanduser(filename))
         check_file_exist(filename)
+        if loaded_files is not None:
+            loaded_files.append(filename)
         if filename.lower().endswith(".py"):
-            with tempfile.TemporaryDirectory() as temp_config_dir:
-                temp_config_file = tempfile.NamedTemporaryFile(dir=temp_config_dir, suffix=".py")
-                temp_config_name = osp.basename(temp_config_file.name)
-                if os.name == 'nt':
-                    temp_config_file.close()
-                shutil.copyfile(filename, osp.join(temp_config_dir, temp_config_name))
-                temp_module_name = osp.splitext(temp_config_name)[0]
-                sys.path.insert(0, temp_config_dir)
-                SLConfig._validate_py_syntax(filename)
-                mod = import_module(temp_module_name)
-                sys.path.pop(0)
-                cfg_dict = {
-                    name: value for name, value in mod.__dict__.items() if not name.startswith("__")
-                }
-                # delete imported module
-                del sys.modules[temp_module_name]
-                # close temp file
-                temp_config_file.close()
+            SLConfig._validate_py_syntax(filename)
+            with open(filename, "r") as f:
+                content = f.read()
+            cfg_dict = SLConfig._parse_pure_data(content)
+            if cfg_dict is None:
+                cfg_dict = SLConfig._exec_py_config(filename, content)
         elif filename.lower().endswith((".yml", ".yaml", ".json")):
             from .slio import slload
 
@@ -116,7 +142,7 @@ class SLConfig(object):
             cfg_dict_list = list()
             cfg_text_list = list()
             for f in base_filename:
-                _cfg_dict, _cfg_text = SLConfig._file2dict(osp.join(cfg_dir, f))
+                _cfg_dict, _cfg_text = SLConfig._file2dict(osp.join(cfg_dir, f), loaded_files)
                 cfg_dict_list.append(_cfg_dict)
                 cfg_text_list.append(_cfg_text)
 
@@ -181,8 +207,61 @@ class SLConfig(object):
         return b
 
     @staticmethod
-    def fromfile(filename):
-        cfg_dict, cfg_text = SLConfig._file2dict(filename)
+    def _cache_path(filename):
+        return osp.splitext(filename)[0] + ".cache.json"
+
+    @staticmethod
+    def _hash_file(filename):
+        with open(filename, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    @staticmethod
+    def _file2dict_cached(filename):
+        """_file2dict through a JSON cache next to .py configs, keyed by the content hashes of
+        the config and its bases. Configs whose values do not survive a JSON round trip
+        (tuples, objects, non-string keys) are not cached."""
+        filename = osp.abspath(osp.expanduser(filename))
+        if not filename.lower().endswith(".py"):
+            return SLConfig._file2dict(filename)
+
+        cache_path = SLConfig._cache_path(filename)
+        try:
+            with open(cache_path, "r") as f:
+                cache = json.load(f)
+            if cache.get("version") == CACHE_VERSION and all(
+                SLConfig._hash_file(path) == digest for path, digest in cache["files"].items()
+            ):
+                return cache["cfg_dict"], cache["cfg_text"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+        loaded_files = []
+        cfg_dict, cfg_text = SLConfig._file2dict(filename, loaded_files)
+
+        try:
+            cache = {
+                "version": CACHE_VERSION,
+                "files": {path: SLConfig._hash_file(path) for path in loaded_files},
+                "cfg_dict": cfg_dict,
+                "cfg_text": cfg_text,
+            }
+            text = json.dumps(cache)
+            if json.loads(text)["cfg_dict"] == cfg_dict:
+                temp_path = "{}.{}.{}.tmp".format(cache_path, os.getpid(), threading.get_ident())
+                with open(temp_path, "w") as f:
+                    f.write(text)
+                os.replace(temp_path, cache_path)
+        except (TypeError, ValueError, OSError):
+            pass
+
+        return cfg_dict, cfg_text
+
+    @staticmethod
+    def fromfile(filename, use_cache=True):
+        if use_cache:
+            cfg_dict, cfg_text = SLConfig._file2dict_cached(filename)
+        else:
+            cfg_dict, cfg_text = SLConfig._file2dict(filename)
         return SLConfig(cfg_dict, cfg_text=cfg_text, filename=filename)
 
     def __init__(self, cfg_dict=None, cfg_text=None, filename=None):
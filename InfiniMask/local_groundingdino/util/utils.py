@@ -3,14 +3,16 @@ import json
 import warnings
 from collections import OrderedDict
 from copy import deepcopy
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Dict, List
 
 import numpy as np
 import torch
-from transformers import AutoTokenizer
 
 from local_groundingdino.util.slconfig import SLConfig
 
+if TYPE_CHECKING:
+    from transformers import AutoTokenizer
+
 
 def slprint(x, name="x"):
     if isinstance(x, (torch.Tensor, np.ndarray)):
@@ -597,7 +599,7 @@ def targets_to(targets: List[Dict[str, Any]], device):
 
 
 def get_phrases_from_posmap(
-    posmap: torch.BoolTensor, tokenized: Dict, tokenizer: AutoTokenizer
+    posmap: torch.BoolTensor, tokenized: Dict, tokenizer: "AutoTokenizer"
 ):
     assert isinstance(posmap, torch.Tensor), "posmap must be torch.Tensor"
     if posmap.dim() == 1:
@@ -606,3 +608,34 @@ def get_phrases_from_posmap(
         return tokenizer.decode(token_ids)
     else:
         raise NotImplementedError("posmap must be 1-dim")
+
+
+class CaptionPhrases:
+    """Token ids of one caption and the phrases already decoded from it.
+
+    Built once per caption and reused by every call: the posmaps of all boxes are
+    mapped to phrase ids with one torch.unique over rows, and each distinct token
+    subset is decoded only the first time it is seen.
+    """
+
+    def __init__(self, input_ids: List[int], tokenizer_name=None):
+        self.input_ids = torch.as_tensor(input_ids)
+        self.tokenizer_name = tokenizer_name
+        self.phrases = {}
+
+    def get_phrases(self, posmaps: torch.BoolTensor, tokenizer: "AutoTokenizer") -> List[str]:
+        """get_phrases_from_posmap for each row of the (n, num_token) posmaps."""
+        assert isinstance(posmaps, torch.Tensor) and posmaps.dim() == 2, "posmaps must be 2-dim"
+        if posmaps.shape[0] == 0:
+            return []
+
+        posmaps = posmaps[:, : len(self.input_ids)].cpu()
+        unique_posmaps, phrase_ids = torch.unique(posmaps, dim=0, return_inverse=True)
+
+        phrases = []
+        for posmap in unique_posmaps:
+            key = posmap.numpy().tobytes()
+            if key not in self.phrases:
+                self.phrases[key] = tokenizer.decode(self.input_ids[posmap].tolist())
+            phrases.append(self.phrases[key])
+        return [phrases[i] for i in phrase_ids.tolist()]
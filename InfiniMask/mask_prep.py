@@ -0,0 +1,145 @@
+"""
+Mask preparation shared by the inpaint runner and the mask server.
+
+Works on uint8 numpy arrays and uses OpenCV when it is available, falling back
+to numpy (dilation) and PIL (resize, blur) otherwise.
+"""
+import io
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+RESAMPLE_MODES = ['nearest', 'bilinear', 'bicubic', 'lanczos', 'area']
+
+_CV2_RESAMPLE = {
+    'nearest': 'INTER_NEAREST',
+    'bilinear': 'INTER_LINEAR',
+    'bicubic': 'INTER_CUBIC',
+    'lanczos': 'INTER_LANCZOS4',
+    'area': 'INTER_AREA',
+}
+
+_PIL_RESAMPLE = {
+    'nearest': Image.Resampling.NEAREST,
+    'bilinear': Image.Resampling.BILINEAR,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+    'area': Image.Resampling.BOX,
+}
+
+
+def to_mask_array(mask) -> np.ndarray:
+    """
+    Convert a PIL image or an array (bool, float in [0, 1] or uint8, HW or HWC) into a HxW uint8 mask.
+    """
+    if isinstance(mask, Image.Image):
+        return np.asarray(mask.convert('L'))
+
+    mask = np.asarray(mask)
+
+    if mask.ndim == 3:
+        mask = mask[..., :3].max(axis=2)
+
+    if mask.dtype == bool:
+        return mask.astype(np.uint8) * 255
+    if np.issubdtype(mask.dtype, np.floating):
+        return np.clip(mask * 255 + 0.5, 0, 255).astype(np.uint8)
+
+    return mask.astype(np.uint8, copy=False)
+
+
+def resize_mask(mask: np.ndarray, size, resample: str = 'lanczos') -> np.ndarray:
+    """
+    Resize a HxW uint8 mask to size (width, height).
+    """
+    if (mask.shape[1], mask.shape[0]) == tuple(size):
+        return mask
+
+    if cv2 is not None:
+        return cv2.resize(mask, tuple(size), interpolation=getattr(cv2, _CV2_RESAMPLE[resample]))
+
+    return np.asarray(Image.fromarray(mask).resize(tuple(size), _PIL_RESAMPLE[resample]))
+
+
+def dilate_mask(mask: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Dilate with a (2 * radius + 1) square window, same as PIL's MaxFilter(2 * radius + 1).
+    """
+    if radius <= 0:
+        return mask
+
+    size = 2 * radius + 1
+
+    if cv2 is not None:
+        return cv2.dilate(mask, np.ones((size, size), np.uint8), borderType=cv2.BORDER_REPLICATE)
+
+    # A square max filter is separable, run it over rows then columns
+    padded = np.pad(mask, radius, mode='edge')
+    rows = np.lib.stride_tricks.sliding_window_view(padded, size, axis=1).max(axis=-1)
+
+    return np.lib.stride_tricks.sliding_window_view(rows, size, axis=0).max(axis=-1)
+
+
+def blur_mask(mask: np.ndarray, sigma: float) -> np.ndarray:
+    """
+    Gaussian blur with standard deviation sigma, matching PIL's GaussianBlur(sigma).
+    """
+    if sigma <= 0:
+        return mask
+
+    if cv2 is not None:
+        return cv2.GaussianBlur(mask, (0, 0), sigma, borderType=cv2.BORDER_REPLICATE)
+
+    return np.asarray(Image.fromarray(mask).filter(ImageFilter.GaussianBlur(sigma)))
+
+
+def prepare_mask(mask, size=None, dilate_radius: int = 3, blur_sigma: float = 3, resample: str = 'lanczos') -> np.ndarray:
+    """
+    Resize a mask to size (width, height), then grow and soften it for inpainting.
+
+    dilate_radius and blur_sigma are in pixels of the output size. Downscaled
+    masks are dilated after resizing. Upscaled masks are dilated before resizing
+    when the radius maps to a whole number of input pixels, which gives the same
+    coverage on far fewer pixels.
+    """
+    mask = to_mask_array(mask)
+
+    if size is None:
+        size = (mask.shape[1], mask.shape[0])
+
+    scale = min(size[0] / mask.shape[1], size[1] / mask.shape[0])
+    input_radius = dilate_radius / scale
+
+    if scale > 1 and input_radius >= 1 and abs(input_radius - round(input_radius)) < 1e-6:
+        mask = dilate_mask(mask, round(input_radius))
+        mask = resize_mask(mask, size, resample)
+    else:
+        mask = resize_mask(mask, size, resample)
+        mask = dilate_mask(mask, dilate_radius)
+
+    return blur_mask(mask, blur_sigma)
+
+
+def encode_mask_png(mask) -> bytes:
+    """
+    Encode a mask as an RGB PNG (white on black).
+    """
+    mask = to_mask_array(mask)
+
+    if cv2 is not None:
+        # Gray to RGB, channels are identical so the BGR order of OpenCV does not matter
+        rgb = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
+        ok, png = cv2.imencode('.png', rgb, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+
+        if ok:
+            return png.tobytes()
+
+    byte_buffer = io.BytesIO()
+    Image.fromarray(mask).convert('RGB').save(byte_buffer, format='PNG', compress_level=1)
+
+    return byte_buffer.getvalue()
@@ -0,0 +1,220 @@
+"""
+Inference-time rewrites shared by the Grounding DINO and SAM2 loaders.
+
+prepare_for_inference(model) folds frozen / eval batch norms into the preceding
+convolutions, folds LayerNorm affines into the Linear that consumes them,
+replaces dropout and drop path modules with identities and lets modules
+precompute constant tensors (see the prepare_for_inference hooks). Every fold is
+checked against the original modules on random inputs and skipped if it does not
+match.
+"""
+import logging
+
+import torch
+from torch import nn
+
+# Modules whose forward feeds LayerNorm `norm` straight into Linear `linear`, as {class name: [(norm, linear)]}.
+# Only pairs without padding or other ops in between, the folded bias would leak into zero padded tokens.
+LAYER_NORM_LINEAR_PAIRS = {
+    'SwinTransformerBlock': [('norm2', 'mlp.fc1')],
+    'PatchMerging': [('norm', 'reduction')],
+    'MultiScaleBlock': [('norm2', 'mlp.layers.0')],
+}
+
+DROP_MODULES = (nn.Dropout, nn.Dropout1d, nn.Dropout2d, nn.Dropout3d, nn.AlphaDropout)
+
+
+class NoDropout(nn.Identity):
+    """
+    Identity that replaces dropout and drop path modules. Keeps their rate attributes at 0,
+    some forwards read them (e.g. the transformers BERT attention passes self.dropout.p).
+    """
+    p = 0.0
+    drop_prob = 0.0
+
+
+def is_foldable_batch_norm(module: nn.Module) -> bool:
+    if type(module).__name__ == 'FrozenBatchNorm2d':
+        return True
+
+    return isinstance(module, nn.BatchNorm2d) and not module.training and module.track_running_stats
+
+
+def get_batch_norm_affine(bn: nn.Module):
+    """
+    Returns (scale, shift) of a batch norm in eval mode, y = x * scale + shift per channel.
+    """
+    eps = getattr(bn, 'eps', 1e-5) # FrozenBatchNorm2d hard-codes 1e-5
+    weight = bn.weight if bn.weight is not None else torch.ones_like(bn.running_mean)
+    bias = bn.bias if bn.bias is not None else torch.zeros_like(bn.running_mean)
+    scale = weight * (bn.running_var + eps).rsqrt()
+
+    return scale, bias - bn.running_mean * scale
+
+
+def fold_conv_batch_norm(conv: nn.Conv2d, bn: nn.Module) -> nn.Conv2d:
+    scale, shift = get_batch_norm_affine(bn)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(shift)
+
+    fused = nn.Conv2d(
+        conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride, conv.padding,
+        conv.dilation, conv.groups, bias=True, padding_mode=conv.padding_mode,
+    ).to(device=conv.weight.device, dtype=conv.weight.dtype)
+
+    fused.weight.copy_(conv.weight * scale.view(-1, 1, 1, 1))
+    fused.bias.copy_(bias * scale + shift)
+    fused.weight.requires_grad_(conv.weight.requires_grad)
+    fused.bias.requires_grad_(conv.weight.requires_grad)
+
+    return fused
+
+
+def fold_layer_norm_linear(norm: nn.LayerNorm, linear: nn.Linear):
+    """
+    Returns (norm without affine, linear with the affine folded in).
+    """
+    plain_norm = nn.LayerNorm(norm.normalized_shape, eps=norm.eps, elementwise_affine=False)
+    fused = nn.Linear(linear.in_features, linear.out_features, bias=True).to(
+        device=linear.weight.device, dtype=linear.weight.dtype
+    )
+
+    weight = norm.weight if norm.weight is not None else torch.ones_like(linear.weight[0])
+    shift = norm.bias if norm.bias is not None else torch.zeros_like(linear.weight[0])
+    bias = linear.bias if linear.bias is not None else torch.zeros_like(linear.weight[:, 0])
+
+    # W (n * g + b) + c = (W g) n + (W b + c)
+    fused.weight.copy_(linear.weight * weight)
+    fused.bias.copy_(linear.weight @ shift + bias)
+    fused.weight.requires_grad_(linear.weight.requires_grad)
+    fused.bias.requires_grad_(linear.weight.requires_grad)
+
+    return plain_norm, fused
+
+
+def is_close(reference: torch.Tensor, result: torch.Tensor, rtol: float) -> bool:
+    # Relative to the output magnitude, weights of different layers vary a lot in scale
+    tolerance = rtol * reference.abs().max().clamp(min=1)
+
+    return bool((reference - result).abs().max() <= tolerance)
+
+
+def get_submodule(module: nn.Module, path: str):
+    try:
+        return module.get_submodule(path)
+    except AttributeError:
+        return None
+
+
+def set_submodule(module: nn.Module, path: str, value: nn.Module):
+    parent_path, _, name = path.rpartition('.')
+    setattr(module.get_submodule(parent_path) if parent_path else module, name, value)
+
+
+def get_conv_batch_norm_pairs(module: nn.Module):
+    """
+    (conv name, bn name) children of module that are applied back to back: consecutive entries of a
+    Sequential, or convN / bnN pairs as in torchvision ResNets.
+    """
+    children = list(module.named_children())
+
+    if isinstance(module, nn.Sequential):
+        return [
+            (conv_name, bn_name)
+            for (conv_name, conv), (bn_name, bn) in zip(children, children[1:])
+            if type(conv) is nn.Conv2d and is_foldable_batch_norm(bn)
+        ]
+
+    names = dict(children)
+
+    return [
+        (name, 'bn' + name[4:])
+        for name, child in children
+        if name.startswith('conv') and type(child) is nn.Conv2d and is_foldable_batch_norm(names.get('bn' + name[4:]))
+    ]
+
+
+@torch.no_grad()
+def fold_batch_norms(model: nn.Module, rtol: float = 1e-4) -> int:
+    folded = 0
+
+    for parent in list(model.modules()):
+        for conv_name, bn_name in get_conv_batch_norm_pairs(parent):
+            conv, bn = getattr(parent, conv_name), getattr(parent, bn_name)
+            fused = fold_conv_batch_norm(conv, bn)
+
+            x = torch.randn(2, conv.in_channels, 9, 9, device=conv.weight.device, dtype=conv.weight.dtype)
+            if not is_close(bn(conv(x)), fused(x), rtol):
+                logging.warning(f'Skipped folding {type(parent).__name__}.{bn_name}, outputs differ')
+                continue
+
+            setattr(parent, conv_name, fused)
+            setattr(parent, bn_name, nn.Identity())
+            folded += 1
+
+    return folded
+
+
+@torch.no_grad()
+def fold_layer_norms(model: nn.Module, rtol: float = 1e-4) -> int:
+    folded = 0
+
+    for parent in list(model.modules()):
+        for norm_path, linear_path in LAYER_NORM_LINEAR_PAIRS.get(type(parent).__name__, [ ]):
+            norm, linear = get_submodule(parent, norm_path), get_submodule(parent, linear_path)
+
+            if type(norm) is not nn.LayerNorm or not norm.elementwise_affine or type(linear) is not nn.Linear:
+                continue
+
+            plain_norm, fused = fold_layer_norm_linear(norm, linear)
+
+            x = torch.randn(4, *norm.normalized_shape, device=linear.weight.device, dtype=linear.weight.dtype)
+            if not is_close(linear(norm(x)), fused(plain_norm(x)), rtol):
+                logging.warning(f'Skipped folding {type(parent).__name__}.{norm_path}, outputs differ')
+                continue
+
+            set_submodule(parent, norm_path, plain_norm)
+            set_submodule(parent, linear_path, fused)
+            folded += 1
+
+    return folded
+
+
+def remove_dropout(model: nn.Module) -> int:
+    """
+    Replace dropout and drop path (stochastic depth) modules with identities, they are no-ops in eval.
+    """
+    removed = 0
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, DROP_MODULES) or type(child).__name__ == 'DropPath':
+                setattr(parent, name, NoDropout())
+                removed += 1
+
+    return removed
+
+
+@torch.no_grad()
+def prepare_for_inference(model: nn.Module, rtol: float = 1e-4) -> nn.Module:
+    """
+    Rewrite an eval mode model in place for faster inference, returns the model.
+
+    Submodules can define a prepare_for_inference() method to precompute constant tensors,
+    it is called after the folding.
+    """
+    if model.training:
+        raise ValueError('prepare_for_inference expects a model in eval mode')
+
+    batch_norms = fold_batch_norms(model, rtol)
+    layer_norms = fold_layer_norms(model, rtol)
+    dropouts = remove_dropout(model)
+
+    for module in model.modules():
+        hook = getattr(module, 'prepare_for_inference', None)
+        if callable(hook):
+            hook()
+
+    logging.info(f'Prepared {type(model).__name__} for inference: folded {batch_norms} batch norms '
+                 f'and {layer_norms} layer norms, removed {dropouts} dropout modules')
+
+    return model
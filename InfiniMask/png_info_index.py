@@ -0,0 +1,463 @@
+"""
+Index the generation parameters stored in PNG outputs into a SQLite database.
+
+Only the text chunks of each PNG are read, pixel data is skipped with seeks.
+Files are parsed in a process pool and the results are written from the main
+process.
+
+Indexing is incremental: files whose mtime and size are unchanged since the
+last run are not opened, files which changed are only re-parsed if their
+content fingerprint changed, and files which were deleted are pruned.
+
+Usage:
+    python png_info_index.py index G:/BulkMagic --db png_index.sqlite [--watch]
+    python png_info_index.py query --db png_index.sqlite --seed 2077 --token "1girl"
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TEXT_CHUNKS = { b'tEXt', b'zTXt', b'iTXt' }
+
+# The fingerprint hashes the size plus the first and last block of a file
+FINGERPRINT_BLOCK = 64 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    fingerprint TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    seed INTEGER,
+    sampler TEXT,
+    steps INTEGER,
+    cfg_scale REAL,
+    width INTEGER,
+    height INTEGER,
+    model TEXT,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS prompt_tokens (
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    token TEXT NOT NULL,
+    negative INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_seed ON images(seed);
+CREATE INDEX IF NOT EXISTS images_sampler ON images(sampler);
+CREATE INDEX IF NOT EXISTS prompt_tokens_token ON prompt_tokens(token, negative);
+CREATE INDEX IF NOT EXISTS prompt_tokens_image ON prompt_tokens(image_id);
+'''
+
+
+def decode_text_chunk(chunk_type, data):
+    """
+    Decode a tEXt, zTXt or iTXt chunk into (keyword, text).
+    """
+    keyword, _, rest = data.partition(b'\0')
+    keyword = keyword.decode('latin-1')
+
+    if chunk_type == b'tEXt':
+        return keyword, rest.decode('latin-1')
+
+    if chunk_type == b'zTXt':
+        return keyword, zlib.decompress(rest[1:]).decode('latin-1')
+
+    # iTXt: compression flag, compression method, language tag, translated keyword, text
+    compressed = rest[0] == 1
+    _, _, rest = rest[2:].partition(b'\0') # Language tag
+    _, _, text = rest.partition(b'\0')     # Translated keyword
+
+    return keyword, (zlib.decompress(text) if compressed else text).decode('utf-8')
+
+
+def read_png_chunks(file):
+    """
+    Read the text chunks of an open PNG file without decoding the image.
+
+    Only chunk headers are read for other chunks, their data is skipped with a seek.
+    Reading stops at the first IDAT once the A1111 'parameters' chunk was seen, since
+    text chunks normally come before the image data.
+    """
+    texts = { }
+
+    file.seek(0)
+    if file.read(8) != PNG_SIGNATURE:
+        return None
+
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            break
+
+        length, chunk_type = struct.unpack('>I4s', header)
+
+        if chunk_type in TEXT_CHUNKS:
+            keyword, text = decode_text_chunk(chunk_type, file.read(length))
+            texts[keyword] = text
+            file.seek(4, os.SEEK_CUR) # CRC
+        elif chunk_type == b'IEND' or (chunk_type == b'IDAT' and 'parameters' in texts):
+            break
+        else:
+            file.seek(length + 4, os.SEEK_CUR)
+
+    return texts
+
+
+def read_png_text(path):
+    with open(path, 'rb') as file:
+        return read_png_chunks(file)
+
+
+def get_fingerprint(file):
+    """
+    Hash the size, first and last block of an open file.
+
+    PNG text chunks sit at the start and the last block covers the end of the
+    image data, so this catches rewritten files without reading them fully.
+    """
+    size = file.seek(0, os.SEEK_END)
+    digest = hashlib.blake2b(size.to_bytes(8, 'little'), digest_size=16)
+
+    file.seek(0)
+    digest.update(file.read(FINGERPRINT_BLOCK))
+
+    if size > FINGERPRINT_BLOCK:
+        file.seek(max(size - FINGERPRINT_BLOCK, FINGERPRINT_BLOCK))
+        digest.update(file.read(FINGERPRINT_BLOCK))
+
+    return digest.hexdigest()
+
+
+def parse_param_line(line):
+    """
+    Parse 'Key: value, Key: "quoted, value", ...' into a dict in a single pass.
+
+    Quoted values (A1111 quotes them as JSON strings) which contain key/value
+    pairs themselves, e.g. ControlNet units, are parsed into nested dicts.
+    """
+    params = { }
+    i, n = 0, len(line)
+
+    while i < n:
+        colon = line.find(':', i)
+        if colon < 0:
+            break
+
+        key = line[i:colon].strip()
+        i = colon + 1
+
+        while i < n and line[i] == ' ':
+            i += 1
+
+        if i < n and line[i] == '"':
+            # Find the closing quote, skipping escaped characters
+            j = i + 1
+            while j < n and line[j] != '"':
+                j += 2 if line[j] == '\\' else 1
+
+            raw = line[i:j + 1]
+            try:
+                value = json.loads(raw)
+            except ValueError:
+                value = raw.strip('"')
+
+            if ':' in value:
+                value = parse_param_line(value)
+
+            comma = line.find(',', j + 1)
+        else:
+            comma = line.find(',', i)
+            value = line[i:comma if comma >= 0 else n].strip()
+
+        if key:
+            params[key] = value
+
+        i = comma + 1 if comma >= 0 else n
+
+    return params
+
+
+def parse_parameters(text):
+    """
+    Split A1111 'parameters' text into prompt, negative prompt and key/value params.
+    """
+    lines = text.strip().split('\n')
+    params = parse_param_line(lines[-1])
+
+    # Same rule as A1111: the last line holds the params if it has at least 3 of them
+    if len(params) >= 3:
+        lines = lines[:-1]
+    else:
+        params = { }
+
+    prompt_lines, negative_lines = [ ], [ ]
+    target = prompt_lines
+
+    for line in lines:
+        if line.lower().startswith('negative prompt:'):
+            target = negative_lines
+            line = line[len('negative prompt:'):].strip()
+
+        target.append(line)
+
+    return {
+        'prompt': '\n'.join(prompt_lines).strip(),
+        'negative_prompt': '\n'.join(negative_lines).strip(),
+        'params': params,
+    }
+
+
+def get_prompt_tokens(prompt):
+    """
+    Split a prompt into lowercased tags with attention syntax removed, e.g. '(red hair:1.2)' -> 'red hair'.
+    """
+    tokens = set()
+
+    for token in prompt.replace('\n', ',').split(','):
+        token = token.strip().strip('()[]{} ').lower()
+
+        weight_index = token.rfind(':')
+        if weight_index > 0 and token[weight_index + 1:].replace('.', '', 1).isdigit():
+            token = token[:weight_index].rstrip(') ')
+
+        if token:
+            tokens.add(token)
+
+    return tokens
+
+
+def read_png_parameters(path, known_fingerprint=None):
+    """
+    Parse one file, returns (path, fingerprint, parsed parameters or None, error message or None).
+
+    Parsing is skipped (parsed is None) when the fingerprint equals known_fingerprint.
+    """
+    fingerprint = None
+
+    try:
+        with open(path, 'rb') as file:
+            fingerprint = get_fingerprint(file)
+
+            if fingerprint == known_fingerprint:
+                return path, fingerprint, None, None
+
+            texts = read_png_chunks(file)
+
+        if not texts or 'parameters' not in texts:
+            return path, fingerprint, None, None
+
+        return path, fingerprint, parse_parameters(texts['parameters']), None
+    except Exception as e:
+        return path, fingerprint, None, repr(e)
+
+
+def scan_pngs(root):
+    """
+    Yield (path, mtime_ns, size) of every PNG under root.
+    """
+    folders = [ root ]
+
+    while folders:
+        folder = folders.pop()
+
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        folders.append(entry.path)
+                    elif entry.name.lower().endswith('.png') and entry.is_file():
+                        stat = entry.stat()
+                        yield entry.path.replace('\\', '/'), stat.st_mtime_ns, stat.st_size
+        except OSError as e:
+            print(f'Failed to list {folder}: {e}')
+
+
+def to_number(value, number_type):
+    try:
+        return number_type(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def open_index(db_path):
+    connection = sqlite3.connect(db_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA foreign_keys=ON')
+    connection.executescript(SCHEMA)
+
+    # Indexes created before change detection have no fingerprint column
+    columns = { row[1] for row in connection.execute('PRAGMA table_info(images)') }
+    if 'fingerprint' not in columns:
+        connection.execute('ALTER TABLE images ADD COLUMN fingerprint TEXT')
+
+    return connection
+
+
+def store_parameters(connection, path, mtime_ns, size, fingerprint, parsed):
+    """
+    Insert or replace the row of a file. parsed is None for files without parameters,
+    which are still stored so that they are not read again until they change.
+    """
+    params = parsed['params'] if parsed is not None else { }
+    width, _, height = str(params.get('Size', '')).partition('x')
+
+    connection.execute('''
+        INSERT INTO images (path, mtime_ns, size, fingerprint, prompt, negative_prompt, seed, sampler,
+                            steps, cfg_scale, width, height, model, params)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            mtime_ns = excluded.mtime_ns, size = excluded.size, fingerprint = excluded.fingerprint,
+            prompt = excluded.prompt, negative_prompt = excluded.negative_prompt, seed = excluded.seed,
+            sampler = excluded.sampler, steps = excluded.steps, cfg_scale = excluded.cfg_scale,
+            width = excluded.width, height = excluded.height, model = excluded.model,
+            params = excluded.params''', (
+            path, mtime_ns, size, fingerprint,
+            parsed['prompt'] if parsed is not None else None,
+            parsed['negative_prompt'] if parsed is not None else None,
+            to_number(params.get('Seed'), int), params.get('Sampler'), to_number(params.get('Steps'), int),
+            to_number(params.get('CFG scale'), float), to_number(width, int), to_number(height, int),
+            params.get('Model'), json.dumps(params, ensure_ascii=False) if parsed is not None else None))
+
+    image_id = connection.execute('SELECT id FROM images WHERE path = ?', (path,)).fetchone()[0]
+
+    connection.execute('DELETE FROM prompt_tokens WHERE image_id = ?', (image_id,))
+
+    if parsed is not None:
+        connection.executemany('INSERT INTO prompt_tokens (image_id, token, negative) VALUES (?, ?, ?)',
+                [(image_id, token, 0) for token in get_prompt_tokens(parsed['prompt'])] +
+                [(image_id, token, 1) for token in get_prompt_tokens(parsed['negative_prompt'])])
+
+
+def update_index(connection, root, pool, batch_size):
+    """
+    Bring the index of root up to date. Only new files and files with a changed
+    mtime or size are opened, and only those with a changed fingerprint are stored.
+    """
+    start_time = time.perf_counter()
+    root = root.replace('\\', '/').rstrip('/')
+
+    files = { path: (mtime_ns, size) for path, mtime_ns, size in scan_pngs(root) }
+
+    # Rows under this root from previous runs, the database may hold other roots too
+    known = { path: (mtime_ns, size, fingerprint) for path, mtime_ns, size, fingerprint in
+              connection.execute('SELECT path, mtime_ns, size, fingerprint FROM images WHERE substr(path, 1, ?) = ?',
+                                 (len(root) + 1, root + '/')) }
+
+    deleted = [ (path,) for path in known if path not in files ]
+    changed = [ path for path, stat in files.items() if known.get(path, (None, None))[:2] != stat ]
+
+    connection.executemany('DELETE FROM images WHERE path = ?', deleted)
+    connection.commit()
+
+    indexed = touched = failed = 0
+
+    results = pool.map(read_png_parameters, changed,
+                       [ known[path][2] if path in known else None for path in changed ],
+                       chunksize=batch_size)
+
+    for done, (path, fingerprint, parsed, error) in enumerate(results, 1):
+        mtime_ns, size = files[path]
+
+        if error is not None:
+            failed += 1
+            print(f'Failed to read {path}: {error}')
+        elif path in known and fingerprint == known[path][2]:
+            # Same content, only refresh the stat data
+            connection.execute('UPDATE images SET mtime_ns = ?, size = ? WHERE path = ?', (mtime_ns, size, path))
+            touched += 1
+        else:
+            store_parameters(connection, path, mtime_ns, size, fingerprint, parsed)
+            indexed += 1
+
+        if done % batch_size == 0:
+            connection.commit()
+
+    connection.commit()
+
+    if changed or deleted:
+        print(f'{len(files)} PNG files: indexed {indexed}, unchanged content {touched}, failed {failed}, '
+              f'pruned {len(deleted)} in {time.perf_counter() - start_time:.1f}s')
+
+
+def build_index(root, db_path, workers, batch_size, watch_interval=None):
+    """
+    Update the index once, or keep updating it every watch_interval seconds.
+    """
+    connection = open_index(db_path)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        update_index(connection, root, pool, batch_size)
+
+        while watch_interval is not None:
+            time.sleep(watch_interval)
+            update_index(connection, root, pool, batch_size)
+
+    connection.close()
+
+
+def query_index(db_path, seed=None, sampler=None, model=None, tokens=(), negative_tokens=(), limit=100):
+    connection = open_index(db_path)
+
+    conditions, values = [ 'params IS NOT NULL' ], [ ]
+
+    if seed is not None:
+        conditions.append('seed = ?')
+        values.append(seed)
+    if sampler is not None:
+        conditions.append('sampler = ?')
+        values.append(sampler)
+    if model is not None:
+        conditions.append('model = ?')
+        values.append(model)
+
+    for token, negative in [(token, 0) for token in tokens] + [(token, 1) for token in negative_tokens]:
+        conditions.append('id IN (SELECT image_id FROM prompt_tokens WHERE token = ? AND negative = ?)')
+        values += [token.strip().lower(), negative]
+
+    where = ' AND '.join(conditions)
+    rows = connection.execute(f'SELECT path, seed, sampler, prompt FROM images WHERE {where} ORDER BY path LIMIT ?',
+                              values + [limit]).fetchall()
+    connection.close()
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index A1111 generation parameters of PNG files')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    index_parser = commands.add_parser('index', help='Scan a folder tree into the index')
+    index_parser.add_argument('root')
+    index_parser.add_argument('--db', default='png_index.sqlite')
+    index_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    index_parser.add_argument('--batch', type=int, default=256, help='Files per worker task and per commit')
+    index_parser.add_argument('--watch', action='store_true', help='Keep the index updated')
+    index_parser.add_argument('--interval', type=float, default=30, help='Seconds between updates with --watch')
+
+    query_parser = commands.add_parser('query', help='Search the index')
+    query_parser.add_argument('--db', default='png_index.sqlite')
+    query_parser.add_argument('--seed', type=int)
+    query_parser.add_argument('--sampler')
+    query_parser.add_argument('--model')
+    query_parser.add_argument('--token', action='append', default=[], help='Prompt tag, may be repeated')
+    query_parser.add_argument('--neg-token', action='append', default=[], help='Negative prompt tag, may be repeated')
+    query_parser.add_argument('--limit', type=int, default=100)
+
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        build_index(args.root, args.db, args.workers, args.batch, args.interval if args.watch else None)
+    else:
+        for path, seed, sampler, prompt in query_index(args.db, args.seed, args.sampler, args.model,
+                                                       args.token, args.neg_token, args.limit):
+            print(f'{path} [Seed: {seed}, Sampler: {sampler}] {prompt[:80]}')
@@ -13,6 +13,8 @@ from hydra.utils import instantiate
 from omegaconf import OmegaConf
 
 import sam2
+from checkpoint_cache import load_checkpoint
+from model_prep import prepare_for_inference
 
 # Check if the user is running Python from the parent directory of the sam2 repo
 # (i.e. the directory where this repo is cloned into) -- this is not supported since
@@ -75,6 +77,7 @@ def build_sam2(
     mode="eval",
     hydra_overrides_extra=[],
     apply_postprocessing=True,
+    prepare=True,
     **kwargs,
 ):
 
@@ -94,6 +97,9 @@ def build_sam2(
     model = model.to(device)
     if mode == "eval":
         model.eval()
+        if prepare:
+            # fold norms, drop dropout and precompute position embeddings
+            prepare_for_inference(model)
     return model
 
 
@@ -156,8 +162,9 @@ def build_sam2_video_predictor_hf(model_id, **kwargs):
 
 def _load_checkpoint(model, ckpt_path):
     if ckpt_path is not None:
-        sd = torch.load(ckpt_path, map_location="cpu", weights_only=True)["model"]
-        missing_keys, unexpected_keys = model.load_state_dict(sd)
+        # mapped from the safetensors cache next to the checkpoint, assign keeps the weights shared
+        sd = load_checkpoint(ckpt_path, key="model", weights_only=True)
+        missing_keys, unexpected_keys = model.load_state_dict(sd, assign=True)
         if missing_keys:
             logging.error(missing_keys)
             raise RuntimeError()
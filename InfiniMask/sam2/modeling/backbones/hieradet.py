@@ -19,6 +19,7 @@ from sam2.modeling.backbones.utils import (
     window_unpartition,
 )
 
+from sam2.modeling.position_encoding import PositionEncodingCacheMixin
 from sam2.modeling.sam2_utils import DropPath, MLP
 
 
@@ -166,7 +167,7 @@ class MultiScaleBlock(nn.Module):
         return x
 
 
-class Hiera(nn.Module):
+class Hiera(PositionEncodingCacheMixin, nn.Module):
     """
     Reference: https://arxiv.org/abs/2306.00989
     """
@@ -224,6 +225,8 @@ class Hiera(nn.Module):
         self.pos_embed_window = nn.Parameter(
             torch.zeros(1, embed_dim, self.window_spec[0], self.window_spec[0])
         )
+        # eval mode cache of _get_pos_embed, see precompute_pos_embed
+        self._pe_cache = {}
 
         dpr = [
             x.item() for x in torch.linspace(0, drop_path_rate, depth)
@@ -271,6 +274,30 @@ class Hiera(nn.Module):
             logging.info("loading Hiera", self.load_state_dict(chkpt, strict=False))
 
     def _get_pos_embed(self, hw: Tuple[int, int]) -> torch.Tensor:
+        # The embedding only depends on the input size in eval mode, reuse it until the
+        # weights change (in place updates bump the version counters, assign replaces the data)
+        use_cache = not self.training and not (
+            torch.is_grad_enabled() and self.pos_embed.requires_grad
+        )
+        key = (
+            tuple(hw),
+            self.pos_embed.device,
+            self.pos_embed.dtype,
+            self.pos_embed.data_ptr(),
+            self.pos_embed._version,
+            self.pos_embed_window._version,
+        )
+        if use_cache:
+            return self._get_cached_encoding(key, lambda: self._compute_pos_embed(hw))
+        return self._compute_pos_embed(hw)
+
+    @torch.no_grad()
+    def precompute_pos_embed(self, hw: Tuple[int, int]):
+        """Fill the eval mode position embedding cache for inputs of patch grid size hw."""
+        if not self.training:
+            self._get_pos_embed(hw)
+
+    def _compute_pos_embed(self, hw: Tuple[int, int]) -> torch.Tensor:
         h, w = hw
         window_embed = self.pos_embed_window
         pos_embed = F.interpolate(self.pos_embed, size=(h, w), mode="bicubic")
@@ -13,7 +13,32 @@ import torch
 from torch import nn
 
 
-class PositionEmbeddingSine(nn.Module):
+class PositionEncodingCacheMixin:
+    """
+    For modules caching constant positional encodings in self._pe_cache, keyed by
+    (size, device, dtype, ...). The cache is cleared when the module is moved or cast
+    (.to(), .cuda(), .half() all go through _apply), entries never outlive a device change.
+    """
+
+    max_cached_encodings = 8
+
+    def _get_cached_encoding(self, key, compute):
+        if key in self._pe_cache:
+            return self._pe_cache[key]
+        # Plain tensors even under inference_mode, they are reused outside of it
+        with torch.inference_mode(False), torch.no_grad():
+            encoding = compute()
+        if len(self._pe_cache) >= self.max_cached_encodings:
+            self._pe_cache.clear()
+        self._pe_cache[key] = encoding
+        return encoding
+
+    def _apply(self, fn, *args, **kwargs):
+        self._pe_cache.clear()
+        return super()._apply(fn, *args, **kwargs)
+
+
+class PositionEmbeddingSine(PositionEncodingCacheMixin, nn.Module):
     """
     This is a more standard version of the position embedding, very similar to the one
     used by the Attention Is All You Need paper, generalized to work on images.
@@ -37,7 +62,7 @@ class PositionEmbeddingSine(nn.Module):
             scale = 2 * math.pi
         self.scale = scale
 
-        self.cache = {}
+        self._pe_cache = {}
 
     def _encode_xy(self, x, y):
         # The positions are expected to be normalized
@@ -77,18 +102,23 @@ class PositionEmbeddingSine(nn.Module):
 
     @torch.no_grad()
     def forward(self, x: torch.Tensor):
-        cache_key = (x.shape[-2], x.shape[-1])
-        if cache_key in self.cache:
-            return self.cache[cache_key][None].repeat(x.shape[0], 1, 1, 1)
+        # The encoding is the same for every image of the batch
+        cache_key = (x.shape[-2], x.shape[-1], x.device)
+        pos = self._get_cached_encoding(
+            cache_key, lambda: self._compute_pos(x.shape[-2], x.shape[-1], x.device)
+        )
+        return pos[None].repeat(x.shape[0], 1, 1, 1)
+
+    def _compute_pos(self, h: int, w: int, device) -> torch.Tensor:
         y_embed = (
-            torch.arange(1, x.shape[-2] + 1, dtype=torch.float32, device=x.device)
+            torch.arange(1, h + 1, dtype=torch.float32, device=device)
             .view(1, -1, 1)
-            .repeat(x.shape[0], 1, x.shape[-1])
+            .repeat(1, 1, w)
         )
         x_embed = (
-            torch.arange(1, x.shape[-1] + 1, dtype=torch.float32, device=x.device)
+            torch.arange(1, w + 1, dtype=torch.float32, device=device)
             .view(1, 1, -1)
-            .repeat(x.shape[0], x.shape[-2], 1)
+            .repeat(1, h, 1)
         )
 
         if self.normalize:
@@ -96,7 +126,7 @@ class PositionEmbeddingSine(nn.Module):
             y_embed = y_embed / (y_embed[:, -1:, :] + eps) * self.scale
             x_embed = x_embed / (x_embed[:, :, -1:] + eps) * self.scale
 
-        dim_t = torch.arange(self.num_pos_feats, dtype=torch.float32, device=x.device)
+        dim_t = torch.arange(self.num_pos_feats, dtype=torch.float32, device=device)
         dim_t = self.temperature ** (2 * (dim_t // 2) / self.num_pos_feats)
 
         pos_x = x_embed[:, :, :, None] / dim_t
@@ -108,11 +138,10 @@ class PositionEmbeddingSine(nn.Module):
             (pos_y[:, :, :, 0::2].sin(), pos_y[:, :, :, 1::2].cos()), dim=4
         ).flatten(3)
         pos = torch.cat((pos_y, pos_x), dim=3).permute(0, 3, 1, 2)
-        self.cache[cache_key] = pos[0]
-        return pos
+        return pos[0]
 
 
-class PositionEmbeddingRandom(nn.Module):
+class PositionEmbeddingRandom(PositionEncodingCacheMixin, nn.Module):
     """
     Positional encoding using random spatial frequencies.
     """
@@ -125,6 +154,7 @@ class PositionEmbeddingRandom(nn.Module):
             "positional_encoding_gaussian_matrix",
             scale * torch.randn((2, num_pos_feats)),
         )
+        self._pe_cache = {}
 
     def _pe_encoding(self, coords: torch.Tensor) -> torch.Tensor:
         """Positionally encode points that are normalized to [0,1]."""
@@ -137,6 +167,19 @@ class PositionEmbeddingRandom(nn.Module):
 
     def forward(self, size: Tuple[int, int]) -> torch.Tensor:
         """Generate positional encoding for a grid of the specified size."""
+        # Constant until the projection changes (in place loads bump the version, assign
+        # replaces the data), the prompt encoder asks for it on every prediction
+        gaussian_matrix = self.positional_encoding_gaussian_matrix
+        key = (
+            tuple(size),
+            gaussian_matrix.device,
+            gaussian_matrix.dtype,
+            gaussian_matrix.data_ptr(),
+            gaussian_matrix._version,
+        )
+        return self._get_cached_encoding(key, lambda: self._compute_dense_pe(size))
+
+    def _compute_dense_pe(self, size: Tuple[int, int]) -> torch.Tensor:
         h, w = size
         device: Any = self.positional_encoding_gaussian_matrix.device
         grid = torch.ones((h, w), device=device, dtype=torch.float32)
@@ -198,6 +198,17 @@ class SAM2Base(torch.nn.Module):
     def device(self):
         return next(self.parameters()).device
 
+    def prepare_for_inference(self):
+        """Precompute constant tensors for image_size inputs, called by model_prep.prepare_for_inference."""
+        trunk = self.image_encoder.trunk
+        if hasattr(trunk, "precompute_pos_embed"):
+            proj = trunk.patch_embed.proj
+            hw = tuple(
+                (self.image_size + 2 * p - k) // s + 1
+                for p, k, s in zip(proj.padding, proj.kernel_size, proj.stride)
+            )
+            trunk.precompute_pos_embed(hw)
+
     def forward(self, *args, **kwargs):
         raise NotImplementedError(
             "Please use the corresponding methods in SAM2VideoPredictor for inference or SAM2Train for training/fine-tuning"
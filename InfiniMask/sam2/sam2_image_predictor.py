@@ -5,8 +5,9 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from typing import List, Optional, Tuple, Union
+from typing import List, NamedTuple, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -14,9 +15,96 @@ from PIL.Image import Image
 
 from sam2.modeling.sam2_base import SAM2Base
 
+from sam2.utils.misc import get_image_hw, load_image_rgb
 from sam2.utils.transforms import SAM2Transforms
 
 
+class ImageHandle(NamedTuple):
+    """An image embedded by set_image_batch, img_idx addresses it in predict and get_image_embedding."""
+
+    img_idx: int
+    orig_hw: Tuple[int, int]
+
+
+class LazyMasks:
+    """
+    Mask candidates of one prediction kept as low resolution logits on the model device.
+
+    Candidates are upscaled to the original image size one at a time and only when
+    requested, and thresholded on the device before the copy to the host. Indices
+    are an int (HxW result), a sequence of ints (KxHxW) or None for all candidates.
+    """
+
+    def __init__(self, low_res_logits: torch.Tensor, orig_hw, mask_threshold, upscale):
+        # CxHxW logits after hole and sprinkle filling
+        self.low_res_logits = low_res_logits
+        self.orig_hw = tuple(orig_hw)
+        self.mask_threshold = mask_threshold
+        self._upscale = upscale
+
+    def __len__(self) -> int:
+        return self.low_res_logits.shape[0]
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return (len(self), *self.orig_hw)
+
+    def __getitem__(self, index) -> np.ndarray:
+        return self.to_bool(index)
+
+    def _upscaled(self, indices, convert) -> np.ndarray:
+        """Upscale and convert the selected candidates on the device, then copy them at once."""
+        if indices is None:
+            indices = range(len(self))
+        elif isinstance(indices, (int, np.integer)):
+            return self._upscaled([indices], convert)[0]
+
+        # One full resolution float candidate at a time bounds the device memory
+        outputs = [
+            convert(self._upscale(self.low_res_logits[i, None, None], self.orig_hw)[0, 0])
+            for i in indices
+        ]
+        if not outputs:
+            raise ValueError("No mask candidates selected")
+        return torch.stack(outputs).cpu().numpy()
+
+    def to_logits(self, indices=None) -> np.ndarray:
+        """Full resolution float32 logits."""
+        return self._upscaled(indices, lambda logits: logits.float())
+
+    def to_bool(self, indices=None) -> np.ndarray:
+        """Full resolution binary masks."""
+        return self._upscaled(indices, lambda logits: logits > self.mask_threshold)
+
+    def to_uint8(self, indices=None, value=255) -> np.ndarray:
+        """Full resolution masks as uint8, value inside the mask and 0 outside."""
+        return self._upscaled(
+            indices,
+            lambda logits: (logits > self.mask_threshold).to(torch.uint8) * value,
+        )
+
+    def to_packed(self, indices=None) -> np.ndarray:
+        """
+        Full resolution masks with 8 pixels per byte along the width, packed on the
+        device in the order of np.packbits. np.unpackbits(packed, axis=-1, count=W)
+        restores them.
+        """
+        return self._upscaled(
+            indices, lambda logits: _packbits(logits > self.mask_threshold)
+        )
+
+
+def _packbits(mask: torch.Tensor) -> torch.Tensor:
+    """np.packbits(mask, axis=-1) of a bool tensor, on its device."""
+    bits = mask.to(torch.uint8)
+    if bits.shape[-1] % 8:
+        bits = torch.nn.functional.pad(bits, (0, -bits.shape[-1] % 8))
+    weights = torch.tensor(
+        [128, 64, 32, 16, 8, 4, 2, 1], dtype=torch.uint8, device=bits.device
+    )
+    return (bits.unflatten(-1, (-1, 8)) * weights).sum(-1, dtype=torch.uint8)
+
+
 class SAM2ImagePredictor:
     def __init__(
         self,
@@ -24,6 +112,7 @@ class SAM2ImagePredictor:
         mask_threshold=0.0,
         max_hole_area=0.0,
         max_sprinkle_area=0.0,
+        embedding_store=None,
         **kwargs,
     ) -> None:
         """
@@ -38,6 +127,8 @@ class SAM2ImagePredictor:
             the maximum area of max_hole_area in low_res_masks.
           max_sprinkle_area (int): If max_sprinkle_area > 0, we remove small sprinkles up to
             the maximum area of max_sprinkle_area in low_res_masks.
+          embedding_store (str or None): Directory of precomputed image features read by
+            load_features, see sam_embedding_store.py.
         """
         super().__init__()
         self.model = sam_model
@@ -57,6 +148,9 @@ class SAM2ImagePredictor:
 
         # Predictor config
         self.mask_threshold = mask_threshold
+        self.embedding_store = embedding_store
+        # Upper bound of the full resolution mask pixels predict_batch upscales at once
+        self.postprocess_max_pixels = 1 << 28
 
         # Spatial dim for backbone feature maps
         self._bb_feat_sizes = [
@@ -107,8 +201,7 @@ class SAM2ImagePredictor:
         else:
             raise NotImplementedError("Image format not supported")
 
-        input_image = self._transforms(image)
-        input_image = input_image[None, ...].to(self.device)
+        input_image = self._transforms(image, device=self.device)[None, ...]
 
         assert (
             len(input_image.shape) == 4 and input_image.shape[1] == 3
@@ -128,30 +221,133 @@ class SAM2ImagePredictor:
         self._is_image_set = True
         logging.info("Image embeddings computed.")
 
+    def set_features(self, features: dict, orig_hw: Tuple[int, int]) -> None:
+        """
+        Sets the features of a single image computed earlier (see get_image_features),
+        in place of running the image encoder in set_image.
+        """
+        self.reset_predictor()
+        # Stored features are fp16, the decoder runs in the dtype of its weights
+        dtype = next(self.model.sam_mask_decoder.parameters()).dtype
+        self._features = {
+            "image_embed": features["image_embed"].to(self.device, dtype),
+            "high_res_feats": [
+                feat.to(self.device, dtype) for feat in features["high_res_feats"]
+            ],
+        }
+        self._orig_hw = [tuple(orig_hw)]
+        self._is_image_set = True
+
+    @torch.no_grad()
+    def load_features(self, image_hash: str) -> bool:
+        """
+        Counterpart of set_image for images whose features are in the embedding store,
+        image_hash is the hash of the encoded image file (see sam_embedding_store.hash_image).
+        Returns False if the image is not in the store.
+        """
+        from sam_embedding_store import load_features
+
+        loaded = load_features(self.embedding_store, image_hash) if self.embedding_store else None
+        if loaded is None:
+            return False
+
+        features, orig_hw = loaded
+        self.set_features(features, orig_hw)
+        return True
+
+    def get_image_features(self, img_idx: int = -1) -> dict:
+        """
+        Returns the features of one image, with a batch dimension of 1, as accepted by set_features.
+        """
+        if not self._is_image_set:
+            raise RuntimeError(
+                "An image must be set with .set_image(...) to get its features."
+            )
+        return {
+            "image_embed": self._features["image_embed"][img_idx].unsqueeze(0),
+            "high_res_feats": [
+                feat[img_idx].unsqueeze(0) for feat in self._features["high_res_feats"]
+            ],
+        }
+
     @torch.no_grad()
     def set_image_batch(
         self,
-        image_list: List[Union[np.ndarray]],
-    ) -> None:
+        image_list: List[Union[np.ndarray, Image, str, bytes]],
+        max_chunk_bytes: int = 1 << 29,
+        num_workers: int = 4,
+    ) -> List[ImageHandle]:
         """
         Calculates the image embeddings for the provided image batch, allowing
-        masks to be predicted with the 'predict_batch' method.
+        masks to be predicted with the 'predict_batch' method, or for a single
+        image of the batch with 'predict(img_idx=...)'.
 
         Arguments:
-          image_list (List[np.ndarray]): The input images to embed in RGB format. The image should be in HWC format if np.ndarray
-          with pixel values in [0, 255].
+          image_list (List): The input images to embed, np.ndarray in RGB HWC format
+          with pixel values in [0, 255], PIL images, file paths or encoded image bytes.
+          Images can have different sizes.
+          max_chunk_bytes (int): Images are decoded in a thread pool and sent through the
+          image encoder in chunks of at most this many bytes of decoded pixels (at least
+          one image per chunk), the next chunk is decoded while the current one is encoded.
+          num_workers (int): Number of decoding threads.
+
+        Returns:
+          (List[ImageHandle]): The index in the batch and original size of each image.
         """
         self.reset_predictor()
-        assert isinstance(image_list, list)
+        assert isinstance(image_list, list) and len(image_list) > 0
+        chunks = self._get_image_chunks(image_list, max_chunk_bytes)
         self._orig_hw = []
-        for image in image_list:
-            assert isinstance(
-                image, np.ndarray
-            ), "Images are expected to be an np.ndarray in RGB format, and of shape  HWC"
-            self._orig_hw.append(image.shape[:2])
+        chunk_features = []
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+
+            def decode(chunk):
+                return [executor.submit(load_image_rgb, image_list[i]) for i in chunk]
+
+            pending = decode(chunks[0])
+            for chunk_idx in range(len(chunks)):
+                images = [future.result() for future in pending]
+                if chunk_idx + 1 < len(chunks):
+                    pending = decode(chunks[chunk_idx + 1])
+                for image in images:
+                    self._orig_hw.append(image.shape[:2])
+                chunk_features.append(self._encode_images(images))
+                del images
+
+        self._features = {
+            "image_embed": torch.cat([f["image_embed"] for f in chunk_features]),
+            "high_res_feats": [
+                torch.cat(feats)
+                for feats in zip(*[f["high_res_feats"] for f in chunk_features])
+            ],
+        }
+        self._is_image_set = True
+        self._is_batch = True
+        logging.info("Image embeddings computed.")
+        return [
+            ImageHandle(img_idx, tuple(orig_hw))
+            for img_idx, orig_hw in enumerate(self._orig_hw)
+        ]
+
+    @staticmethod
+    def _get_image_chunks(image_list, max_chunk_bytes) -> List[List[int]]:
+        """
+        Split the indices of image_list into chunks of at most max_chunk_bytes decoded pixels.
+        """
+        chunks, chunk_bytes = [], 0
+        for img_idx, image in enumerate(image_list):
+            h, w = get_image_hw(image)
+            if chunks and chunk_bytes + h * w * 3 <= max_chunk_bytes:
+                chunks[-1].append(img_idx)
+                chunk_bytes += h * w * 3
+            else:
+                chunks.append([img_idx])
+                chunk_bytes = h * w * 3
+        return chunks
+
+    def _encode_images(self, image_list: List[np.ndarray]) -> dict:
         # Transform the image to the form expected by the model
-        img_batch = self._transforms.forward_batch(image_list)
-        img_batch = img_batch.to(self.device)
+        img_batch = self._transforms.forward_batch(image_list, device=self.device)
         batch_size = img_batch.shape[0]
         assert (
             len(img_batch.shape) == 4 and img_batch.shape[1] == 3
@@ -167,10 +363,7 @@ class SAM2ImagePredictor:
             feat.permute(1, 2, 0).view(batch_size, -1, *feat_size)
             for feat, feat_size in zip(vision_feats[::-1], self._bb_feat_sizes[::-1])
         ][::-1]
-        self._features = {"image_embed": feats[-1], "high_res_feats": feats[:-1]}
-        self._is_image_set = True
-        self._is_batch = True
-        logging.info("Image embeddings computed.")
+        return {"image_embed": feats[-1], "high_res_feats": feats[:-1]}
 
     def predict_batch(
         self,
@@ -184,6 +377,10 @@ class SAM2ImagePredictor:
     ) -> Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]:
         """This function is very similar to predict(...), however it is used for batched mode, when the model is expected to generate predictions on multiple images.
         It returns a tuple of lists of masks, ious, and low_res_masks_logits.
+
+        Prompts of several images are decoded in one call for convenience, this is not
+        faster than calling predict per image: on CPU it measured 0.64x-1.06x the per
+        image loop (bench_sam2_predict_batch.py), and it was not measured on CUDA.
         """
         assert self._is_batch, "This function should only be used when in batched mode"
         if not self._is_image_set:
@@ -191,11 +388,12 @@ class SAM2ImagePredictor:
                 "An image must be set with .set_image_batch(...) before mask prediction."
             )
         num_images = len(self._features["image_embed"])
-        all_masks = []
-        all_ious = []
-        all_low_res_masks = []
+        # Images whose prompts have the same number of tokens (and a mask input or not)
+        # are decoded together, the tokens are not masked in the decoder so point sets
+        # of different lengths cannot be padded to a common one without changing results
+        prompts = []
+        groups = {}
         for img_idx in range(num_images):
-            # Transform input prompts
             point_coords = (
                 point_coords_batch[img_idx] if point_coords_batch is not None else None
             )
@@ -214,26 +412,107 @@ class SAM2ImagePredictor:
                 normalize_coords,
                 img_idx=img_idx,
             )
-            masks, iou_predictions, low_res_masks = self._predict(
-                unnorm_coords,
-                labels,
-                unnorm_box,
-                mask_input,
-                multimask_output,
-                return_logits=return_logits,
-                img_idx=img_idx,
+            concat_points = self._concat_prompts(unnorm_coords, labels, unnorm_box)
+            num_prompts = self.model.sam_prompt_encoder._get_batch_size(
+                concat_points, None, mask_input
             )
-            masks_np = masks.squeeze(0).float().detach().cpu().numpy()
-            iou_predictions_np = (
-                iou_predictions.squeeze(0).float().detach().cpu().numpy()
+            num_tokens = concat_points[0].shape[1] if concat_points is not None else None
+            prompts.append((concat_points, mask_input, num_prompts))
+            groups.setdefault((num_tokens, mask_input is not None), []).append(img_idx)
+
+        all_low_res_masks = [None] * num_images
+        all_ious = [None] * num_images
+        for (num_tokens, has_mask_input), img_indices in groups.items():
+            counts = [prompts[i][2] for i in img_indices]
+            concat_points = None
+            if num_tokens is not None:
+                concat_points = (
+                    torch.cat([prompts[i][0][0] for i in img_indices]),
+                    torch.cat([prompts[i][0][1] for i in img_indices]),
+                )
+            mask_input = None
+            if has_mask_input:
+                mask_input = torch.cat([prompts[i][1] for i in img_indices])
+            # Image of each prompt
+            if len(img_indices) == 1:
+                img_index = img_indices[0]
+            else:
+                img_index = torch.repeat_interleave(
+                    torch.tensor(img_indices, device=self.device),
+                    torch.tensor(counts, device=self.device),
+                    output_size=sum(counts),
+                )
+            low_res_masks, iou_predictions = self._decode_prompts(
+                concat_points, mask_input, img_index, multimask_output, sum(counts)
             )
-            low_res_masks_np = low_res_masks.squeeze(0).float().detach().cpu().numpy()
-            all_masks.append(masks_np)
-            all_ious.append(iou_predictions_np)
-            all_low_res_masks.append(low_res_masks_np)
+            for img_idx, low_res, ious in zip(
+                img_indices, low_res_masks.split(counts), iou_predictions.split(counts)
+            ):
+                all_low_res_masks[img_idx] = low_res
+                all_ious[img_idx] = ious
+
+        # Upscale the masks of same sized images together
+        all_masks = [None] * num_images
+        sizes = {}
+        for img_idx in range(num_images):
+            sizes.setdefault(tuple(self._orig_hw[img_idx]), []).append(img_idx)
+        for orig_hw, img_indices in sizes.items():
+            for chunk in self._postprocess_chunks(img_indices, all_low_res_masks, orig_hw):
+                low_res_masks = torch.cat([all_low_res_masks[i] for i in chunk])
+                masks = self._transforms.postprocess_masks(low_res_masks, orig_hw)
+                if not return_logits:
+                    masks = masks > self.mask_threshold
+                counts = [len(all_low_res_masks[i]) for i in chunk]
+                for img_idx, img_masks in zip(chunk, masks.split(counts)):
+                    all_masks[img_idx] = img_masks
+
+        all_low_res_masks = [
+            torch.clamp(low_res, -32.0, 32.0) for low_res in all_low_res_masks
+        ]
+
+        # One device to host copy per dtype instead of three per image
+        float_outputs = [t.squeeze(0).float() for t in all_ious + all_low_res_masks]
+        masks = [t.squeeze(0) for t in all_masks]
+        if return_logits:
+            float_outputs += [t.float() for t in masks]
+        float_outputs = self._to_numpy(float_outputs)
+        all_ious = float_outputs[:num_images]
+        all_low_res_masks = float_outputs[num_images : 2 * num_images]
+        if return_logits:
+            all_masks = float_outputs[2 * num_images :]
+        else:
+            all_masks = [m.astype(np.float32) for m in self._to_numpy(masks)]
 
         return all_masks, all_ious, all_low_res_masks
 
+    def _postprocess_chunks(self, img_indices, low_res_masks, orig_hw):
+        """
+        Split img_indices so each chunk upscales at most postprocess_max_pixels mask pixels.
+        """
+        chunk, pixels = [], 0
+        for img_idx in img_indices:
+            num_pixels = low_res_masks[img_idx].shape[:2].numel() * orig_hw[0] * orig_hw[1]
+            if chunk and pixels + num_pixels > self.postprocess_max_pixels:
+                yield chunk
+                chunk, pixels = [], 0
+            chunk.append(img_idx)
+            pixels += num_pixels
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _to_numpy(tensors: List[torch.Tensor]) -> List[np.ndarray]:
+        """
+        Copy tensors of the same dtype to the host in a single transfer.
+        """
+        if not tensors:
+            return []
+        flat = torch.cat([t.detach().reshape(-1) for t in tensors]).cpu().numpy()
+        offsets = np.cumsum([t.numel() for t in tensors])[:-1]
+        return [
+            array.reshape(t.shape) for array, t in zip(np.split(flat, offsets), tensors)
+        ]
+
     def predict(
         self,
         point_coords: Optional[np.ndarray] = None,
@@ -243,6 +522,7 @@ class SAM2ImagePredictor:
         multimask_output: bool = True,
         return_logits: bool = False,
         normalize_coords=True,
+        img_idx: int = -1,
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
         Predict masks for the given input prompts, using the currently set image.
@@ -267,6 +547,7 @@ class SAM2ImagePredictor:
           return_logits (bool): If true, returns un-thresholded masks logits
             instead of a binary mask.
           normalize_coords (bool): If true, the point coordinates will be normalized to the range [0,1] and point_coords is expected to be wrt. image dimensions.
+          img_idx (int): The image of a batch set with set_image_batch to predict on, see ImageHandle.
 
         Returns:
           (np.ndarray): The output masks in CxHxW format, where C is the
@@ -285,7 +566,7 @@ class SAM2ImagePredictor:
         # Transform input prompts
 
         mask_input, unnorm_coords, labels, unnorm_box = self._prep_prompts(
-            point_coords, point_labels, box, mask_input, normalize_coords
+            point_coords, point_labels, box, mask_input, normalize_coords, img_idx=img_idx
         )
 
         masks, iou_predictions, low_res_masks = self._predict(
@@ -295,13 +576,73 @@ class SAM2ImagePredictor:
             mask_input,
             multimask_output,
             return_logits=return_logits,
+            img_idx=img_idx,
         )
 
-        masks_np = masks.squeeze(0).float().detach().cpu().numpy()
+        if return_logits:
+            masks_np = masks.squeeze(0).float().cpu().numpy()
+        else:
+            # Copy the binary masks, 4x less than float32
+            masks_np = masks.squeeze(0).cpu().numpy().astype(np.float32)
         iou_predictions_np = iou_predictions.squeeze(0).float().detach().cpu().numpy()
         low_res_masks_np = low_res_masks.squeeze(0).float().detach().cpu().numpy()
         return masks_np, iou_predictions_np, low_res_masks_np
 
+    def predict_lazy(
+        self,
+        point_coords: Optional[np.ndarray] = None,
+        point_labels: Optional[np.ndarray] = None,
+        box: Optional[np.ndarray] = None,
+        mask_input: Optional[np.ndarray] = None,
+        multimask_output: bool = True,
+        normalize_coords=True,
+        img_idx: int = -1,
+    ) -> Tuple[LazyMasks, np.ndarray, np.ndarray]:
+        """
+        Same as predict for a single prompt, but the masks are returned as LazyMasks
+        which upscale only the candidates that are read, e.g. masks.to_uint8(best)
+        or masks.to_packed(), instead of three full resolution float32 masks.
+
+        Returns:
+          (LazyMasks): The C mask candidates, CxHxW where (H, W) is the original
+            image size.
+          (np.ndarray): An array of length C with the predicted quality of each mask.
+          (np.ndarray): The CxHxW (H=W=256) low resolution logits, see predict.
+        """
+        if not self._is_image_set:
+            raise RuntimeError(
+                "An image must be set with .set_image(...) before mask prediction."
+            )
+
+        mask_input, unnorm_coords, labels, unnorm_box = self._prep_prompts(
+            point_coords, point_labels, box, mask_input, normalize_coords, img_idx=img_idx
+        )
+
+        low_res_filled, iou_predictions, low_res_masks = self._predict(
+            unnorm_coords,
+            labels,
+            unnorm_box,
+            mask_input,
+            multimask_output,
+            img_idx=img_idx,
+            upscale=False,
+        )
+        if low_res_filled.shape[0] != 1:
+            raise ValueError(
+                "predict_lazy takes a single prompt, use predict for batched prompts"
+            )
+
+        masks = LazyMasks(
+            low_res_filled[0],
+            self._orig_hw[img_idx],
+            self.mask_threshold,
+            self._transforms.upscale_masks,
+        )
+        iou_predictions_np, low_res_masks_np = self._to_numpy(
+            [iou_predictions[0].float(), low_res_masks[0].float()]
+        )
+        return masks, iou_predictions_np, low_res_masks_np
+
     def _prep_prompts(
         self, point_coords, point_labels, box, mask_logits, normalize_coords, img_idx=-1
     ):
@@ -343,6 +684,7 @@ class SAM2ImagePredictor:
         multimask_output: bool = True,
         return_logits: bool = False,
         img_idx: int = -1,
+        upscale: bool = True,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         Predict masks for the given input prompts, using the currently set image.
@@ -369,6 +711,8 @@ class SAM2ImagePredictor:
             input prompts, multimask_output=False can give better results.
           return_logits (bool): If true, returns un-thresholded masks logits
             instead of a binary mask.
+          upscale (bool): If false, returns the hole filled low resolution logits
+            instead of the masks at the original image size (see LazyMasks).
 
         Returns:
           (torch.Tensor): The output masks in BxCxHxW format, where C is the
@@ -384,24 +728,7 @@ class SAM2ImagePredictor:
                 "An image must be set with .set_image(...) before mask prediction."
             )
 
-        if point_coords is not None:
-            concat_points = (point_coords, point_labels)
-        else:
-            concat_points = None
-
-        # Embed prompts
-        if boxes is not None:
-            box_coords = boxes.reshape(-1, 2, 2)
-            box_labels = torch.tensor([[2, 3]], dtype=torch.int, device=boxes.device)
-            box_labels = box_labels.repeat(boxes.size(0), 1)
-            # we merge "boxes" and "points" into a single "concat_points" input (where
-            # boxes are added at the beginning) to sam_prompt_encoder
-            if concat_points is not None:
-                concat_coords = torch.cat([box_coords, concat_points[0]], dim=1)
-                concat_labels = torch.cat([box_labels, concat_points[1]], dim=1)
-                concat_points = (concat_coords, concat_labels)
-            else:
-                concat_points = (box_coords, box_labels)
+        concat_points = self._concat_prompts(point_coords, point_labels, boxes)
 
         sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(
             points=concat_points,
@@ -427,6 +754,10 @@ class SAM2ImagePredictor:
             high_res_features=high_res_features,
         )
 
+        if not upscale:
+            masks = self._transforms.postprocess_low_res_masks(low_res_masks)
+            return masks, iou_predictions, torch.clamp(low_res_masks, -32.0, 32.0)
+
         # Upscale the masks to the original image resolution
         masks = self._transforms.postprocess_masks(
             low_res_masks, self._orig_hw[img_idx]
@@ -437,11 +768,89 @@ class SAM2ImagePredictor:
 
         return masks, iou_predictions, low_res_masks
 
-    def get_image_embedding(self) -> torch.Tensor:
+    def _concat_prompts(
+        self,
+        point_coords: Optional[torch.Tensor],
+        point_labels: Optional[torch.Tensor],
+        boxes: Optional[torch.Tensor],
+    ) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Merges boxes and points into a single (coords, labels) input for the prompt
+        encoder, boxes are added at the beginning as two corner points.
+        """
+        if point_coords is not None:
+            concat_points = (point_coords, point_labels)
+        else:
+            concat_points = None
+
+        if boxes is not None:
+            box_coords = boxes.reshape(-1, 2, 2)
+            box_labels = torch.tensor([[2, 3]], dtype=torch.int, device=boxes.device)
+            box_labels = box_labels.repeat(boxes.size(0), 1)
+            if concat_points is not None:
+                concat_coords = torch.cat([box_coords, concat_points[0]], dim=1)
+                concat_labels = torch.cat([box_labels, concat_points[1]], dim=1)
+                concat_points = (concat_coords, concat_labels)
+            else:
+                concat_points = (box_coords, box_labels)
+        return concat_points
+
+    @torch.no_grad()
+    def _decode_prompts(
+        self,
+        concat_points: Optional[Tuple[torch.Tensor, torch.Tensor]],
+        mask_input: Optional[torch.Tensor],
+        img_index: Union[int, torch.Tensor],
+        multimask_output: bool,
+        num_prompts: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Runs the prompt encoder and the mask decoder once for prompts of several images
+        of the batch, img_index holds the image of each prompt (an int when all the
+        num_prompts prompts are of the same image).
+        Returns the low resolution mask logits and the IoU predictions.
+        """
+        sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(
+            points=concat_points,
+            boxes=None,
+            masks=mask_input,
+        )
+        if sparse_embeddings.shape[0] != num_prompts:
+            # No points nor mask inputs, one empty prompt per image
+            sparse_embeddings = sparse_embeddings.expand(num_prompts, -1, -1)
+            dense_embeddings = dense_embeddings.expand(num_prompts, -1, -1, -1)
+
+        image_embed = self._features["image_embed"]
+        high_res_features = self._features["high_res_feats"]
+        if isinstance(img_index, int):
+            # Prompts of a single image, broadcast its features instead of copying them per prompt
+            image_embed = image_embed[img_index : img_index + 1].expand(
+                num_prompts, -1, -1, -1
+            )
+            high_res_features = [
+                feat_level[img_index : img_index + 1] for feat_level in high_res_features
+            ]
+        else:
+            image_embed = image_embed[img_index]
+            high_res_features = [feat_level[img_index] for feat_level in high_res_features]
+        low_res_masks, iou_predictions, _, _ = self.model.sam_mask_decoder(
+            image_embeddings=image_embed,
+            image_pe=self.model.sam_prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embeddings,
+            dense_prompt_embeddings=dense_embeddings,
+            multimask_output=multimask_output,
+            repeat_image=False,
+            high_res_features=high_res_features,
+        )
+        return low_res_masks, iou_predictions
+
+    def get_image_embedding(self, img_idx: Optional[int] = None) -> torch.Tensor:
         """
         Returns the image embeddings for the currently set image, with
         shape 1xCxHxW, where C is the embedding dimension and (H,W) are
         the embedding spatial dimension of SAM (typically C=256, H=W=64).
+        For a batch, returns the embeddings of all images (BxCxHxW) or only
+        of image img_idx.
         """
         if not self._is_image_set:
             raise RuntimeError(
@@ -450,6 +859,8 @@ class SAM2ImagePredictor:
         assert (
             self._features is not None
         ), "Features must exist if an image has been set."
+        if img_idx is not None:
+            return self._features["image_embed"][img_idx].unsqueeze(0)
         return self._features["image_embed"]
 
     @property
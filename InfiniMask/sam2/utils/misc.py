@@ -4,12 +4,16 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import io
 import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from threading import Thread
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL import Image
 from tqdm import tqdm
 
@@ -44,10 +48,24 @@ def get_sdpa_settings():
     return old_gpu, use_flash_attn, math_kernel_on
 
 
+@lru_cache(maxsize=None)
+def _load_cuda_extension():
+    """The compiled sam2._C extension, None if it is not built."""
+    try:
+        from sam2 import _C
+    except ImportError:
+        return None
+    return _C
+
+
 def get_connected_components(mask):
     """
     Get the connected components (8-connectivity) of binary masks of shape (N, 1, H, W).
 
+    CUDA tensors use the sam2._C kernel when the extension is built, everything else
+    the CPU implementation (get_connected_components_cpu). Label numbering differs
+    between the two, the components and their areas are the same.
+
     Inputs:
     - mask: A binary mask tensor of shape (N, 1, H, W), where 1 is foreground and 0 is
             background.
@@ -58,9 +76,93 @@ def get_connected_components(mask):
     - counts: A tensor of shape (N, 1, H, W) containing the area of the connected
               components for foreground pixels and 0 for background pixels.
     """
-    from sam2 import _C
+    if mask.is_cuda and _load_cuda_extension() is not None:
+        return _load_cuda_extension().get_connected_componnets(
+            mask.to(torch.uint8).contiguous()
+        )
+
+    labels, counts = get_connected_components_cpu(mask.cpu())
+    return labels.to(mask.device), counts.to(mask.device)
+
+
+def get_connected_components_cpu(mask, num_workers=4):
+    """
+    CPU version of get_connected_components with the same inputs and outputs (int32).
 
-    return _C.get_connected_componnets(mask.to(torch.uint8).contiguous())
+    Uses OpenCV's connectedComponentsWithStats on the masks of the batch in a thread
+    pool, and a vectorized union-find in torch when OpenCV is not installed.
+    """
+    try:
+        import cv2
+    except ImportError:
+        return _connected_components_torch(mask)
+
+    masks = mask.reshape(-1, *mask.shape[-2:]).to(torch.uint8).numpy()
+
+    def label(m):
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(
+            m, connectivity=8, ltype=cv2.CV_32S
+        )
+        areas = stats[:, cv2.CC_STAT_AREA].astype(np.int32)
+        areas[0] = 0  # background
+        return labels, areas[labels]
+
+    if num_workers > 1 and len(masks) > 1 and masks.size >= 1 << 20:
+        # OpenCV releases the GIL, smaller batches are faster without the pool
+        with ThreadPoolExecutor(min(num_workers, len(masks))) as executor:
+            results = list(executor.map(label, masks))
+    else:
+        results = [label(m) for m in masks]
+
+    labels = np.zeros(masks.shape, dtype=np.int32)
+    counts = np.zeros(masks.shape, dtype=np.int32)
+    for i, (mask_labels, mask_counts) in enumerate(results):
+        labels[i], counts[i] = mask_labels, mask_counts
+    return (
+        torch.from_numpy(labels).reshape(mask.shape),
+        torch.from_numpy(counts).reshape(mask.shape),
+    )
+
+
+def _connected_components_torch(mask):
+    """
+    Vectorized union-find: every pixel label is the root of its tree, the root is hooked
+    onto the smallest label of the 3x3 neighbourhood and the trees are compressed by
+    pointer jumping, until the labels no longer change. Labels end up as the smallest
+    pixel index (+ 1) of each component.
+    """
+    N, C, H, W = mask.shape
+    foreground = mask.bool().reshape(N * C, H * W)
+    # parent[:, 0] is the background, parent[:, i] the parent of the label of pixel i - 1
+    parent = torch.arange(H * W + 1).repeat(N * C, 1)
+    labels = torch.where(foreground, parent[:, 1:], 0)
+
+    while True:
+        # float64 keeps the labels exact through max_pool2d
+        outside = torch.where(foreground, labels, H * W + 1).double()
+        neighbours = -F.max_pool2d(
+            -outside.reshape(N * C, 1, H, W), 3, stride=1, padding=1
+        )
+        neighbours = torch.where(foreground, neighbours.flatten(1).long(), 0)
+        parent.scatter_reduce_(1, labels, neighbours, reduce="amin")
+        while True:
+            grandparent = torch.gather(parent, 1, parent)
+            if torch.equal(grandparent, parent):
+                break
+            parent = grandparent
+        new_labels = torch.gather(parent, 1, labels)
+        if torch.equal(new_labels, labels):
+            break
+        labels = new_labels
+
+    # Areas per (mask, label), label 0 is the background
+    offsets = torch.arange(N * C).unsqueeze(1) * (H * W + 1)
+    areas = torch.bincount((labels + offsets).flatten(), minlength=N * C * (H * W + 1))
+    counts = torch.where(labels > 0, areas[labels + offsets], 0)
+    return (
+        labels.to(torch.int32).reshape(N, C, H, W),
+        counts.to(torch.int32).reshape(N, C, H, W),
+    )
 
 
 def mask_to_box(masks: torch.Tensor):
@@ -101,6 +203,39 @@ def _load_img_as_tensor(img_path, image_size):
     return img, video_height, video_width
 
 
+def load_image_rgb(image):
+    """
+    Decode an image given as an np.ndarray (returned as is), a PIL image, a file path
+    or encoded bytes into an HxWx3 uint8 RGB array.
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+    elif isinstance(image, (str, os.PathLike)):
+        image = Image.open(image)
+    elif not isinstance(image, Image.Image):
+        raise NotImplementedError(f"Image format not supported: {type(image)}")
+    # np.asarray would be read-only, torch warns when wrapping it
+    return np.array(image.convert("RGB"))
+
+
+def get_image_hw(image):
+    """
+    (height, width) of an image accepted by load_image_rgb, files and bytes are not decoded.
+    """
+    if isinstance(image, np.ndarray):
+        return image.shape[:2]
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+    elif isinstance(image, (str, os.PathLike)):
+        with Image.open(image) as img:
+            return img.size[::-1]
+    elif not isinstance(image, Image.Image):
+        raise NotImplementedError(f"Image format not supported: {type(image)}")
+    return image.size[::-1]
+
+
 class AsyncVideoFrameLoader:
     """
     A list of video frames to be load asynchronously without blocking session start.
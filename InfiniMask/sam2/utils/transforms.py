@@ -6,41 +6,124 @@
 
 import warnings
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torchvision.transforms import Normalize, Resize, ToTensor
+
+
+def _image_shape(image):
+    """Shape of an np.ndarray or PIL image, without converting PIL images to arrays."""
+    if isinstance(image, np.ndarray):
+        return image.shape
+    return (image.height, image.width, len(image.getbands()))
 
 
 class SAM2Transforms(nn.Module):
     def __init__(
-        self, resolution, mask_threshold, max_hole_area=0.0, max_sprinkle_area=0.0
+        self,
+        resolution,
+        mask_threshold,
+        max_hole_area=0.0,
+        max_sprinkle_area=0.0,
+        uint8_resize=False,
     ):
         """
         Transforms for SAM2.
+
+        Images are uploaded as uint8 and resized on the target device, the /255 scaling
+        is folded into the normalization. uint8_resize=True resizes uint8 images before
+        converting them to float, which avoids a float copy of the full resolution image
+        on CPU but moves pixels by up to about one gray level (embeddings then differ
+        slightly from the float reference path).
         """
         super().__init__()
         self.resolution = resolution
         self.mask_threshold = mask_threshold
         self.max_hole_area = max_hole_area
         self.max_sprinkle_area = max_sprinkle_area
+        self.uint8_resize = uint8_resize
+        # Upper bound of the full resolution data (uint8, or float without uint8_resize)
+        # forward_batch resizes at once, larger batches are split
+        self.max_resize_bytes = 1 << 28
         self.mean = [0.485, 0.456, 0.406]
         self.std = [0.229, 0.224, 0.225]
-        self.to_tensor = ToTensor()
-        self.transforms = torch.jit.script(
-            nn.Sequential(
-                Resize((self.resolution, self.resolution)),
-                Normalize(self.mean, self.std),
-            )
+        # (x / 255 - mean) / std = x * scale + shift, per device
+        self._normalize_cache = {}
+
+    def _get_normalize(self, device, is_uint8):
+        key = (device, is_uint8)
+        if key not in self._normalize_cache:
+            mean = torch.tensor(self.mean, device=device).view(-1, 1, 1)
+            std = torch.tensor(self.std, device=device).view(-1, 1, 1)
+            scale = 1.0 / (std * 255.0) if is_uint8 else 1.0 / std
+            self._normalize_cache[key] = (scale, -mean / std)
+        return self._normalize_cache[key]
+
+    def _upload(self, images, device):
+        """
+        Stack same sized HWC images (np.ndarray or PIL) into a NxCxHxW tensor on device,
+        through pinned memory on CUDA. Only the uint8 data is copied.
+        """
+        images = [
+            np.ascontiguousarray(image) if isinstance(image, np.ndarray) else np.array(image)
+            for image in images
+        ]
+        images = [image[..., None] if image.ndim == 2 else image for image in images]
+        if len(images) == 1:
+            batch = torch.from_numpy(images[0])[None]
+        else:
+            batch = torch.from_numpy(np.stack(images))
+        if device.type == "cuda":
+            batch = batch.pin_memory()
+        # HWC stays channels last, the resize kernels are fastest on that layout
+        return batch.to(device, non_blocking=True).permute(0, 3, 1, 2)
+
+    def _resize_normalize(self, batch):
+        is_uint8 = batch.dtype == torch.uint8
+        if not (is_uint8 and self.uint8_resize):
+            batch = batch.float()
+
+        # Same as torchvision Resize on tensors
+        batch = F.interpolate(
+            batch,
+            (self.resolution, self.resolution),
+            mode="bilinear",
+            align_corners=False,
+            antialias=True,
         )
+        scale, shift = self._get_normalize(batch.device, is_uint8)
+        return torch.addcmul(shift, batch.float(), scale).contiguous()
+
+    def __call__(self, x, device=None):
+        device = torch.device(device or "cpu")
+        return self._resize_normalize(self._upload([x], device))[0]
 
-    def __call__(self, x):
-        x = self.to_tensor(x)
-        return self.transforms(x)
+    def forward_batch(self, img_list, device=None):
+        device = torch.device(device or "cpu")
+        # Images of the same size are uploaded and resized together, in chunks of at
+        # most max_resize_bytes so only the resized tensors of the whole batch are kept
+        groups = {}
+        for i, img in enumerate(img_list):
+            groups.setdefault(_image_shape(img), []).append(i)
 
-    def forward_batch(self, img_list):
-        img_batch = [self.transforms(self.to_tensor(img)) for img in img_list]
-        img_batch = torch.stack(img_batch, dim=0)
+        img_batch = None
+        for shape, indices in groups.items():
+            # PIL images are uploaded as uint8
+            dtype = getattr(img_list[indices[0]], "dtype", np.uint8)
+            is_float = not (self.uint8_resize and dtype == np.uint8)
+            image_bytes = int(np.prod(shape)) * (4 if is_float else 1)
+            chunk_size = max(1, self.max_resize_bytes // max(image_bytes, 1))
+            for start in range(0, len(indices), chunk_size):
+                chunk = indices[start : start + chunk_size]
+                resized = self._resize_normalize(
+                    self._upload([img_list[i] for i in chunk], device)
+                )
+                if len(chunk) == len(img_list):
+                    return resized
+                if img_batch is None:
+                    img_batch = resized.new_empty((len(img_list), *resized.shape[1:]))
+                img_batch[chunk] = resized
         return img_batch
 
     def transform_coords(
@@ -77,6 +160,12 @@ class SAM2Transforms(nn.Module):
         """
         Perform PostProcessing on output masks.
         """
+        return self.upscale_masks(self.postprocess_low_res_masks(masks), orig_hw)
+
+    def postprocess_low_res_masks(self, masks: torch.Tensor) -> torch.Tensor:
+        """
+        Hole and sprinkle filling of BxCxHxW low resolution mask logits, returned as float.
+        """
         from sam2.utils.misc import get_connected_components
 
         masks = masks.float()
@@ -114,5 +203,11 @@ class SAM2Transforms(nn.Module):
             )
             masks = input_masks
 
-        masks = F.interpolate(masks, orig_hw, mode="bilinear", align_corners=False)
         return masks
+
+    @staticmethod
+    def upscale_masks(masks: torch.Tensor, orig_hw) -> torch.Tensor:
+        """
+        Upscale BxCxHxW mask logits to the original image size, channels are independent.
+        """
+        return F.interpolate(masks, orig_hw, mode="bilinear", align_corners=False)
@@ -0,0 +1,196 @@
+"""
+Content-addressed store of precomputed SAM2 image features.
+
+`build` walks an image tree (e.g. the InfiniCore RootPath), runs the SAM2 image
+encoder on batches of images and writes the features of each image as fp16 to
+<store>/<hash[:2]>/<hash>.safetensors, where hash is the hash of the image file.
+The mask server maps those files instead of running the image encoder when an
+image is already in the store (SAM2ImagePredictor.load_features), the first
+prompt on a precomputed image then skips the Hiera backbone entirely.
+
+Features take about 8 MB per image (1024x1024 input). store.json records the
+SAM2 model the features were computed with, a store is only used with the same
+model.
+
+Usage:
+    python sam_embedding_store.py build G:/BulkMagic --store models/sam2/embeddings [--batch 8]
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import torch
+from PIL import Image
+
+from checkpoint_cache import load_safetensors_mmap, save_file, write_cache
+
+STORE_FORMAT = '1'
+
+
+def hash_image(data: bytes) -> str:
+    """
+    Content address of an encoded image file.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def get_model_id(config: str, checkpoint: str) -> str:
+    return f'{os.path.basename(config)}:{os.path.basename(checkpoint)}:{os.path.getsize(checkpoint)}'
+
+
+def get_feature_path(store: str, image_hash: str) -> str:
+    return os.path.join(store, image_hash[:2], image_hash + '.safetensors')
+
+
+def open_store(store: str, model_id: str, create=True):
+    """
+    Check that the store holds features of model_id, creating it if create is set.
+    A store opened with create=False is only read, ValueError if it does not exist.
+    """
+    info_path = os.path.join(store, 'store.json')
+
+    if not create and not os.path.isfile(info_path):
+        raise ValueError(f'{store} is not an embedding store (no store.json)')
+
+    if os.path.isfile(info_path):
+        with open(info_path) as f:
+            info = json.load(f)
+
+        if info.get('format') != STORE_FORMAT or info.get('model') != model_id:
+            raise ValueError(f'{store} holds features of {info.get("model")} (format {info.get("format")}), '
+                             f'not {model_id}')
+        return
+
+    os.makedirs(store, exist_ok=True)
+    with open(info_path, 'w') as f:
+        json.dump({'format': STORE_FORMAT, 'model': model_id}, f, indent=4)
+
+
+def save_features(store: str, image_hash: str, features: dict, orig_hw):
+    """
+    Write the features of one image (SAM2ImagePredictor.get_image_features) as fp16.
+    """
+    tensors = {'image_embed': features['image_embed'][0].half()}
+    for level, feat in enumerate(features['high_res_feats']):
+        tensors[f'high_res_feats.{level}'] = feat[0].half()
+
+    path = get_feature_path(store, image_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_cache(tensors, path, {'orig_h': str(orig_hw[0]), 'orig_w': str(orig_hw[1])})
+
+
+def load_features(store: str, image_hash: str):
+    """
+    Returns (features, (h, w)) mapped from the store, None if the image is not in it.
+    """
+    path = get_feature_path(store, image_hash)
+    if not os.path.isfile(path):
+        return None
+
+    tensors, metadata = load_safetensors_mmap(path)
+    levels = sum(name.startswith('high_res_feats.') for name in tensors)
+    features = {
+        'image_embed': tensors['image_embed'][None],
+        'high_res_feats': [tensors[f'high_res_feats.{level}'][None] for level in range(levels)],
+    }
+
+    return features, (int(metadata['orig_h']), int(metadata['orig_w']))
+
+
+def scan_images(root, accept_types):
+    for folder, _, names in os.walk(root):
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in accept_types:
+                yield os.path.join(folder, name)
+
+
+def embed_batch(predictor, store, batch):
+    """
+    Embed and store batch, [(image hash, encoded bytes)]. Returns (embedded, failed), a batch
+    with an unreadable image is retried one image at a time.
+    """
+    try:
+        handles = predictor.set_image_batch([data for _, data in batch])
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        if len(batch) == 1:
+            print(f'Could not embed {batch[0][0]}: {e}')
+            return 0, 1
+
+        results = [embed_batch(predictor, store, [item]) for item in batch]
+        return sum(embedded for embedded, _ in results), sum(failed for _, failed in results)
+
+    for (image_hash, _), handle in zip(batch, handles):
+        save_features(store, image_hash, predictor.get_image_features(handle.img_idx), handle.orig_hw)
+
+    return len(batch), 0
+
+
+@torch.no_grad()
+def build_store(root, store, predictor, model_id, accept_types, batch_size):
+    """
+    Embed every image under root which is not in the store yet.
+    """
+    if save_file is None:
+        raise RuntimeError('safetensors is required to write the embedding store')
+
+    open_store(store, model_id)
+
+    start = time.perf_counter()
+    embedded, skipped, failed = 0, 0, 0
+    batch = [ ]
+    for path in scan_images(root, accept_types):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        image_hash = hash_image(data)
+        if os.path.isfile(get_feature_path(store, image_hash)):
+            skipped += 1
+        else:
+            batch.append((image_hash, data))
+
+        if len(batch) == batch_size:
+            batch_embedded, batch_failed = embed_batch(predictor, store, batch)
+            embedded, failed, batch = embedded + batch_embedded, failed + batch_failed, [ ]
+            print(f'{embedded} embedded, {skipped} already stored, {failed} failed, '
+                  f'{time.perf_counter() - start:.0f} s')
+
+    if batch:
+        batch_embedded, batch_failed = embed_batch(predictor, store, batch)
+        embedded, failed = embedded + batch_embedded, failed + batch_failed
+
+    print(f'Done: {embedded} embedded, {skipped} already stored, {failed} failed '
+          f'in {time.perf_counter() - start:.0f} s')
+
+
+if __name__ == '__main__':
+    conf = { }
+    if os.path.isfile('config.json'):
+        with open('config.json') as f:
+            conf = json.load(f)
+
+    parser = argparse.ArgumentParser(description='Precompute SAM2 image features of a folder tree')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='Embed the images of a folder tree into the store')
+    build_parser.add_argument('root')
+    build_parser.add_argument('--store', default=conf.get('sam_embedding_store', ''))
+    build_parser.add_argument('--config', default=conf.get('sam_config', ''))
+    build_parser.add_argument('--checkpoint', default=conf.get('sam_model', ''))
+    build_parser.add_argument('--device', default=conf.get('mask_gen_device', 'cuda'))
+    build_parser.add_argument('--batch', type=int, default=8, help='Images per image encoder call')
+
+    args = parser.parse_args()
+
+    if not args.store:
+        parser.error('a --store is required (or sam_embedding_store in config.json)')
+
+    from sam2.build_sam import build_sam2
+    from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+    predictor = SAM2ImagePredictor(build_sam2(args.config, args.checkpoint, device=args.device))
+    accept_types = set(conf.get('accept_types', ['.png', '.jpg', '.jpeg', '.webp']))
+
+    build_store(args.root, args.store, predictor, get_model_id(args.config, args.checkpoint),
+                accept_types, args.batch)
@@ -1,48 +1,21 @@
-from PIL import Image
-import re
+import sys
 import json
 
-#img = Image.open('C:/Users/DevBo/Downloads/00000-3206416230.png')
-img = Image.open('G:/BulkMagic/test/11227_out/1_out_2077.png')
+from png_info_index import read_png_text, parse_parameters
 
-img.load() # necessary for png images to prepare the info data
+#path = 'C:/Users/DevBo/Downloads/00000-3206416230.png'
+path = sys.argv[1] if len(sys.argv) > 1 else 'G:/BulkMagic/test/11227_out/1_out_2077.png'
 
-img_p:list[str] = img.info['parameters'].split('\n')
+# Only the text chunks are read, no need to load the image data
+parsed = parse_parameters(read_png_text(path)['parameters'])
 
-prompt = img_p[0].split(',')
+prompt = parsed['prompt'].split(',')
 print(f'Prompt: {prompt}\n')
 
-if len(img_p) > 1 and img_p[1].lower().startswith('negative prompt:'):
-    neg_prompt = img_p[1].strip().split(',')
+if parsed['negative_prompt']:
+    neg_prompt = parsed['negative_prompt'].split(',')
     print(f'Neg Prompt: {neg_prompt}\n')
 
-    params_text = img_p[2]
-else:
-    params_text = img_p[1]
+other_param_json = json.dumps(parsed['params'], indent=2)
 
-
-def parse_parameters(param_string):
-    # This regex matches key-value pairs, even if values are quoted and contain nested parameters
-    pattern = r'(\w+)\s*:\s*(?:"([^"]+)"|([^,]+))'
-    
-    matches = re.finditer(pattern, param_string)
-    params = {}
-
-    for match in matches:
-        key = match.group(1)
-        value = match.group(2) if match.group(2) is not None else match.group(3)
-        
-        # If the value contains nested parameters, parse them recursively
-        if ':' in value:
-            nested_params = parse_parameters(value)
-            params[key] = nested_params
-        else:
-            params[key] = value.strip()
-            
-    return params
-
-
-other_param_obj = parse_parameters(params_text)
-other_param_json = json.dumps(other_param_obj, indent=2)
-
-print(f'Other params: {other_param_json}\n')
\ No newline at end of file
+print(f'Other params: {other_param_json}\n')